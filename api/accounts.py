@@ -0,0 +1,132 @@
+"""
+Resolve or create the user and customer of a Google login in one statement.
+
+On PostgreSQL ``upsert_google_customer`` is a single ``INSERT ... ON
+CONFLICT`` statement (data-modifying CTEs): it finds the user by email
+through ``auth_user_email_idx``, inserts one if there is none, and upserts
+the customer with the new tokens. A statement is its own transaction, so
+concurrent first logins can't create two users or two customers:
+
+* the usernames a login tries depend only on the email, so two first
+  logins with the same email insert the same username, and the loser's
+  ``ON CONFLICT DO NOTHING`` waits for the winner's row, then finds it by
+  email on the next attempt;
+* an email whose local part is already someone else's username gets that
+  username with a suffix derived from the whole email.
+
+Other databases run the same steps with the ORM in a transaction.
+"""
+import hashlib
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .auth_cache import auth_cache
+from .models import Customer, hash_token
+from .single_flight import token_refreshes
+
+
+def usernames(email):
+    """The usernames a first login with ``email`` tries, in order"""
+    base = email.split('@')[0][:140]
+    suffixed = f"{base}.{hashlib.sha256(email.encode('utf-8')).hexdigest()[:8]}"
+    # the repeat finds a racing login that inserted the suffixed name
+    return [base, suffixed, suffixed]
+
+
+def upsert_google_customer(user_info, access_token, refresh_token):
+    """
+    Find or create the user with ``user_info['email']`` and their customer,
+    storing the tokens. Returns (customer with only ids loaded, created).
+    """
+    values = {
+        'email': user_info['email'],
+        'first_name': user_info.get('given_name', '')[:150],
+        'last_name': user_info.get('family_name', '')[:150],
+        'access_token': access_token,
+        'access_token_hash': hash_token(access_token),
+        'refresh_token': refresh_token,
+        'refresh_token_hash': hash_token(refresh_token),
+        'now': timezone.now(),
+    }
+    attempt = _upsert if connection.vendor == 'postgresql' else _upsert_orm
+    for username in usernames(values['email']):
+        row = attempt({**values, 'username': username})
+        if row is not None:
+            break
+    else:
+        raise IntegrityError(f"No free username for {values['email']}")
+
+    customer_id, user_id, created, previous_access, previous_refresh = row
+    # the statement bypasses save(), so do what Customer's signals would
+    auth_cache.invalidate_digest(previous_access)
+    token_refreshes.forget(previous_refresh)
+    return Customer(pk=customer_id, user_id=user_id), created
+
+
+def _upsert(values):
+    user, customer = User._meta.db_table, Customer._meta.db_table
+    sql = f"""
+        WITH found AS (
+            SELECT id FROM {user} WHERE email = %(email)s ORDER BY id LIMIT 1
+        ), inserted AS (
+            INSERT INTO {user} (password, is_superuser, username, first_name, last_name,
+                                email, is_staff, is_active, date_joined)
+            SELECT %(password)s, false, %(username)s, %(first_name)s, %(last_name)s,
+                   %(email)s, false, true, %(now)s
+            WHERE NOT EXISTS (SELECT 1 FROM found)
+            ON CONFLICT (username) DO NOTHING
+            RETURNING id
+        ), account AS (
+            SELECT id FROM found UNION ALL SELECT id FROM inserted
+        ), previous AS (
+            SELECT access_token_hash, refresh_token_hash FROM {customer}
+            WHERE user_id = (SELECT id FROM account)
+        ), upserted AS (
+            INSERT INTO {customer} (user_id, phone_number, access_token, access_token_hash,
+                                    refresh_token, refresh_token_hash, updated_at)
+            SELECT id, '', %(access_token)s, %(access_token_hash)s,
+                   %(refresh_token)s, %(refresh_token_hash)s, %(now)s
+            FROM account
+            ON CONFLICT (user_id) DO UPDATE SET
+                access_token = EXCLUDED.access_token,
+                access_token_hash = EXCLUDED.access_token_hash,
+                refresh_token = EXCLUDED.refresh_token,
+                refresh_token_hash = EXCLUDED.refresh_token_hash,
+                updated_at = EXCLUDED.updated_at
+            RETURNING id, user_id
+        )
+        SELECT upserted.id, upserted.user_id, EXISTS (SELECT 1 FROM inserted),
+               previous.access_token_hash, previous.refresh_token_hash
+        FROM upserted LEFT JOIN previous ON true
+    """
+    with connection.cursor() as cursor:
+        # no row: the username belongs to someone else, or to a login racing us
+        cursor.execute(sql, {**values, 'password': make_password(None)})
+        return cursor.fetchone()
+
+
+def _upsert_orm(values):
+    with transaction.atomic():
+        user_id = User.objects.filter(email=values['email']).order_by('pk').values_list(
+            'pk', flat=True).first()
+        created = user_id is None
+        if created:
+            try:
+                with transaction.atomic():
+                    user_id = User.objects.create_user(
+                        username=values['username'], email=values['email'],
+                        first_name=values['first_name'], last_name=values['last_name']).pk
+            except IntegrityError:
+                return None
+        previous = Customer.objects.filter(user_id=user_id).values_list(
+            'access_token_hash', 'refresh_token_hash').first() or (None, None)
+        customer, _ = Customer.objects.update_or_create(
+            user_id=user_id,
+            defaults={'access_token': values['access_token'],
+                      'refresh_token': values['refresh_token']},
+            create_defaults={'phone_number': '', 'access_token': values['access_token'],
+                             'refresh_token': values['refresh_token']})
+    return customer.pk, user_id, created, *previous
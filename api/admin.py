@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Customer, Orders
+from .models import Customer, Orders, SMSOutbox
 # Register your models here.
 admin.site.register(Customer)
 admin.site.register(Orders)
+admin.site.register(SMSOutbox)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
@@ -7,3 +8,11 @@ class ApiConfig(AppConfig):
     
     def ready(self):
         import api.signals  # Import signals when the app is ready
+        from .metrics import REGISTRY
+
+        from .partitions import ensure_after_migrate
+
+        # publishes this process's metrics when METRICS_MULTIPROCESS_DIR is set
+        REGISTRY.start_flusher()
+        # creates the coming months' order partitions on every migrate
+        post_migrate.connect(ensure_after_migrate, sender=self)
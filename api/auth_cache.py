@@ -0,0 +1,187 @@
+"""
+Cache of access token -> (user, customer) used by CookieAuthentication.
+
+Two tiers are consulted in order:
+
+* a bounded, per-process LRU with a TTL, so a warm worker authenticates
+  without touching the database at all;
+* an optional shared tier backed by Django's cache framework, so workers and
+  nodes can reuse each other's lookups. Set ``AUTH_CACHE['SHARED_CACHE']`` to
+  the alias of a configured cache to enable it.
+
+Entries are keyed by the token digest, never the raw token, and hold field
+values rather than model instances: every hit builds a fresh user and
+customer, so requests can't see each other's changes to them. Anything that
+rotates or changes a customer's token must call ``invalidate`` with the old
+token so the next request goes back to the database.
+
+``invalidate`` only reaches this process's LRU and the shared tier. With a
+shared tier, a local hit is trusted only while the shared entry still exists
+(one ``has_key`` round trip), so a token revoked by any worker stops working
+everywhere at once. Without one, other workers keep accepting a revoked token
+for up to ``LOCAL_TTL`` seconds, which is why it defaults to a few seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+
+from .models import Customer, hash_token
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 10000,
+    # seconds an entry lives in the shared tier
+    'TTL': 60,
+    # seconds an entry lives in the LRU; without a shared tier, how long
+    # other workers keep accepting a revoked token
+    'LOCAL_TTL': 5,
+    'SHARED_CACHE': None,
+    'KEY_PREFIX': 'auth',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AUTH_CACHE', {})}
+
+
+def field_names(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def dump(user, customer):
+    """The cached form of a (user, customer) pair: plain field values"""
+    return (tuple(getattr(user, name) for name in field_names(User)),
+            tuple(getattr(customer, name) for name in field_names(Customer)))
+
+
+def load(value):
+    """Fresh (user, customer) instances built from ``dump``'s values"""
+    user_values, customer_values = value
+    user = User.from_db(None, field_names(User), user_values)
+    customer = Customer.from_db(None, field_names(Customer), customer_values)
+    # also primes user.customer
+    customer.user = user
+    return user, customer
+
+
+class AuthCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def _shared(self, config):
+        alias = config['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    def _key(self, config, digest):
+        return f"{config['KEY_PREFIX']}:{digest}"
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _store_local(self, config, digest, value):
+        with self._lock:
+            self._entries[digest] = (time.monotonic() + config['LOCAL_TTL'], value)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def get(self, token):
+        """Return the cached (user, customer) pair for a token, or None"""
+        config = get_config()
+        if not config['ENABLED'] or not token:
+            return None
+        digest = hash_token(token)
+        shared = self._shared(config)
+
+        value = self._get_local(digest)
+        if value is not None:
+            # another worker may have revoked the token since we cached it
+            if shared is None or shared.has_key(self._key(config, digest)):
+                self._count('hits')
+                return load(value)
+            with self._lock:
+                self._entries.pop(digest, None)
+        elif shared is not None:
+            value = shared.get(self._key(config, digest))
+            if value is not None:
+                self._store_local(config, digest, value)
+                self._count('shared_hits')
+                return load(value)
+
+        self._count('misses')
+        return None
+
+    def _get_local(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(digest)
+                return value
+            del self._entries[digest]
+            return None
+
+    def set(self, token, user, customer):
+        config = get_config()
+        if not config['ENABLED'] or not token:
+            return
+        digest = hash_token(token)
+        value = dump(user, customer)
+        self._store_local(config, digest, value)
+
+        shared = self._shared(config)
+        if shared is not None:
+            shared.set(self._key(config, digest), value, timeout=config['TTL'])
+
+    def invalidate(self, token):
+        """Drop a token from both tiers"""
+        if token:
+            self.invalidate_digest(hash_token(token))
+
+    def invalidate_digest(self, digest):
+        if not digest:
+            return
+        config = get_config()
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._counters['invalidations'] += 1
+
+        shared = self._shared(config)
+        if shared is not None:
+            shared.delete(self._key(config, digest))
+
+    def clear(self):
+        """Empty the in-process tier and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = (
+            (stats['hits'] + stats['shared_hits']) / lookups if lookups else 0.0)
+        return stats
+
+
+auth_cache = AuthCache()
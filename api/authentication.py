@@ -1,7 +1,14 @@
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.contrib.auth.models import User
-from .models import Customer
+from . import metrics, routers, session_tokens
+from .auth_cache import auth_cache
+from .models import Customer, hash_token
+
+AUTH_CACHED = metrics.COOKIE_AUTH.labels('cached')
+AUTH_DATABASE = metrics.COOKIE_AUTH.labels('database')
+AUTH_SESSION = metrics.COOKIE_AUTH.labels('session')
+AUTH_INVALID = metrics.COOKIE_AUTH.labels('invalid')
 
 
 class CookieAuthentication(BaseAuthentication):
@@ -10,8 +17,45 @@ class CookieAuthentication(BaseAuthentication):
         if not access_token:
             return None
 
+        if session_tokens.enabled() and session_tokens.looks_like_session_token(access_token):
+            return self.authenticate_session(access_token)
+
+        cached = auth_cache.get(access_token)
+        if cached is not None:
+            user, customer = cached
+            AUTH_CACHED.inc()
+            return (user, None)
+
         try:
-            customer = Customer.objects.get(access_token=access_token)
-            return (customer.user, None)
+            customer = self.get_customer(hash_token(access_token))
         except Customer.DoesNotExist:
+            AUTH_INVALID.inc()
             raise AuthenticationFailed('Invalid access token')
+        AUTH_DATABASE.inc()
+
+        # select_related also primes user.customer, so views reading
+        # request.user.customer don't query the customer again
+        auth_cache.set(access_token, customer.user, customer)
+        return (customer.user, None)
+
+    def authenticate_session(self, token):
+        # signature, expiry and revocation are all checked in memory
+        try:
+            claims = session_tokens.verify(token)
+        except session_tokens.InvalidSessionToken:
+            AUTH_INVALID.inc()
+            raise AuthenticationFailed('Invalid session token')
+        AUTH_SESSION.inc()
+        user, _ = session_tokens.principal(claims)
+        return (user, claims)
+
+    def get_customer(self, digest):
+        # look the token up through its indexed digest, not the raw text
+        customers = Customer.objects.select_related('user')
+        try:
+            return customers.get(access_token_hash=digest)
+        except Customer.DoesNotExist:
+            if not routers.reads_from_replica():
+                raise
+        # a token issued moments ago may not have replicated yet
+        return customers.using(routers.PRIMARY).get(access_token_hash=digest)
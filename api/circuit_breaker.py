@@ -0,0 +1,424 @@
+"""
+Circuit breakers and bulkheads for the services we call out to.
+
+``get(name).guard()`` wraps one call to a dependency (``google``, ``sms``):
+
+* **bulkhead**: at most ``MAX_CONCURRENCY`` calls per process are in
+  flight; the next one is refused at once instead of queueing behind a
+  slow dependency and holding a worker thread or connection.
+* **breaker**: ``FAILURE_THRESHOLD`` failures (exceptions, or calls marked
+  with ``call.fail()``, e.g. 5xx answers) within ``FAILURE_WINDOW`` seconds
+  open the circuit. For ``RESET_TIMEOUT`` seconds every call is refused
+  without touching the network. Then the circuit is half open: a single
+  call is let through as a probe, closing the circuit if it succeeds and
+  opening it again if it fails.
+
+Refused calls raise ``Unavailable`` (``CircuitOpen`` or ``BulkheadFull``)
+after a lock and a clock read, so a dead dependency costs microseconds per
+request instead of a timeout. ``aguard()`` is the same for async code.
+
+With ``CIRCUIT_BREAKERS['CACHE']`` naming a Django cache shared by the
+workers, failures are counted and the circuit opened for all of them, and
+only one worker probes. Each process re-reads the shared state at most every
+``SYNC_INTERVAL`` seconds, so a closed circuit costs no cache round trip per
+call. The bulkhead always counts per process. The cache is never called
+while holding the breaker's lock, and ``aguard()`` uses its async API.
+"""
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+DEFAULT_BREAKER = {
+    'FAILURE_THRESHOLD': 5,
+    'FAILURE_WINDOW': 30,
+    'RESET_TIMEOUT': 30,
+    # calls in flight per process, None for no limit
+    'MAX_CONCURRENCY': 50,
+}
+
+DEFAULTS = {
+    'ENABLED': True,
+    # alias of a Django cache shared by the workers, None for per process
+    'CACHE': None,
+    'SYNC_INTERVAL': 1.0,
+    # per dependency overrides of DEFAULT_BREAKER
+    'BREAKERS': {
+        'google': {'MAX_CONCURRENCY': 100},
+        'sms': {'MAX_CONCURRENCY': 8},
+    },
+}
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CIRCUIT_BREAKERS', {})}
+
+
+def breaker_config(name, config):
+    return {**DEFAULT_BREAKER, **DEFAULTS['BREAKERS'].get(name, {}),
+            **config['BREAKERS'].get(name, {})}
+
+
+class Unavailable(Exception):
+    """A call refused without being made"""
+
+
+class CircuitOpen(Unavailable):
+    pass
+
+
+class BulkheadFull(Unavailable):
+    pass
+
+
+class Call:
+    """Handed to the guarded block, which marks bad answers as failures"""
+    failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class LocalState:
+    """The circuit of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open_until = 0.0
+        self.failures = []
+        self.probing = False
+
+    def get_open_until(self):
+        return self.open_until
+
+    def set_open_until(self, until):
+        with self._lock:
+            self.open_until = until
+            self.failures = []
+            self.probing = False
+
+    def close(self):
+        self.set_open_until(0.0)
+
+    def add_failure(self, now, window):
+        with self._lock:
+            self.failures = [at for at in self.failures if at > now - window] + [now]
+            return len(self.failures)
+
+    def start_probe(self, timeout):
+        with self._lock:
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def end_probe(self):
+        with self._lock:
+            self.probing = False
+
+    # in memory, so the async API just calls the sync one
+
+    async def aget_open_until(self):
+        return self.get_open_until()
+
+    async def aset_open_until(self, until):
+        self.set_open_until(until)
+
+    async def aclose(self):
+        self.close()
+
+    async def aadd_failure(self, now, window):
+        return self.add_failure(now, window)
+
+    async def astart_probe(self, timeout):
+        return self.start_probe(timeout)
+
+    async def aend_probe(self):
+        self.end_probe()
+
+
+class SharedState:
+    """The circuit in a Django cache, seen by every worker"""
+
+    def __init__(self, name, alias):
+        self.cache = caches[alias]
+        self.prefix = f'breaker:{name}'
+
+    def get_open_until(self):
+        return self.cache.get(f'{self.prefix}:open_until', 0.0)
+
+    def set_open_until(self, until):
+        self.cache.set(f'{self.prefix}:open_until', until, timeout=None)
+        self.cache.delete(f'{self.prefix}:probe')
+
+    def close(self):
+        self.cache.delete_many(
+            [f'{self.prefix}:{key}' for key in ('open_until', 'probe', 'failures')])
+
+    def add_failure(self, now, window):
+        # counted in fixed windows, like the throttle counters
+        key = f'{self.prefix}:failures'
+        self.cache.add(key, 0, timeout=window)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # expired between add and incr
+            self.cache.set(key, 1, timeout=window)
+            return 1
+
+    def start_probe(self, timeout):
+        # a probe that never reports back frees the slot after timeout
+        return self.cache.add(f'{self.prefix}:probe', 1, timeout=timeout)
+
+    def end_probe(self):
+        self.cache.delete(f'{self.prefix}:probe')
+
+    async def aget_open_until(self):
+        return await self.cache.aget(f'{self.prefix}:open_until', 0.0)
+
+    async def aset_open_until(self, until):
+        await self.cache.aset(f'{self.prefix}:open_until', until, timeout=None)
+        await self.cache.adelete(f'{self.prefix}:probe')
+
+    async def aclose(self):
+        await self.cache.adelete_many(
+            [f'{self.prefix}:{key}' for key in ('open_until', 'probe', 'failures')])
+
+    async def aadd_failure(self, now, window):
+        key = f'{self.prefix}:failures'
+        await self.cache.aadd(key, 0, timeout=window)
+        try:
+            return await self.cache.aincr(key)
+        except ValueError:
+            await self.cache.aset(key, 1, timeout=window)
+            return 1
+
+    async def astart_probe(self, timeout):
+        return await self.cache.aadd(f'{self.prefix}:probe', 1, timeout=timeout)
+
+    async def aend_probe(self):
+        await self.cache.adelete(f'{self.prefix}:probe')
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._local = LocalState()
+        self._open_until = 0.0
+        self._synced_at = None
+        self._outcomes = {outcome: metrics.CIRCUIT_BREAKER_CALLS.labels(name, outcome)
+                          for outcome in ('success', 'failure', 'open', 'full')}
+
+    def _state(self, config):
+        if config['CACHE']:
+            return SharedState(self.name, config['CACHE'])
+        return self._local
+
+    def _stale(self, config):
+        """Whether the shared open_until is due to be re-read"""
+        return self._synced_at is None or \
+            time.monotonic() - self._synced_at >= config['SYNC_INTERVAL']
+
+    def _current_open_until(self, config, state):
+        """The shared open_until, re-read at most every SYNC_INTERVAL"""
+        if not config['CACHE']:
+            return state.get_open_until()
+        if self._stale(config):
+            self._remember(state.get_open_until())
+        return self._open_until
+
+    async def _acurrent_open_until(self, config, state):
+        if not config['CACHE']:
+            return await state.aget_open_until()
+        if self._stale(config):
+            self._remember(await state.aget_open_until())
+        return self._open_until
+
+    def _remember(self, open_until):
+        self._open_until = open_until
+        self._synced_at = time.monotonic()
+
+    def state(self):
+        config = get_config()
+        open_until = self._current_open_until(config, self._state(config))
+        if not open_until:
+            return CLOSED
+        return OPEN if time.time() < open_until else HALF_OPEN
+
+    def _enter(self, limits):
+        """Take a bulkhead slot"""
+        with self._lock:
+            if limits['MAX_CONCURRENCY'] is not None and \
+                    self._in_flight >= limits['MAX_CONCURRENCY']:
+                self._outcomes['full'].inc()
+                raise BulkheadFull(f'{self.name}: {self._in_flight} calls in flight')
+            self._in_flight += 1
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _refuse(self, remaining):
+        self._outcomes['open'].inc()
+        raise CircuitOpen(f'{self.name}: circuit open for {max(remaining, 0):.1f}s')
+
+    def _probe(self):
+        metrics.CIRCUIT_BREAKER_TRANSITIONS.labels(self.name, HALF_OPEN).inc()
+        return True
+
+    def _admit(self, config, limits, state):
+        """Take a slot, return whether the call is the half-open probe"""
+        self._enter(limits)
+        try:
+            open_until = self._current_open_until(config, state)
+            if not open_until:
+                return False
+            remaining = open_until - time.time()
+            if remaining > 0 or not state.start_probe(limits['RESET_TIMEOUT']):
+                self._refuse(remaining)
+        except BaseException:
+            # refused, or the cache failed: give the slot back
+            self._leave()
+            raise
+        return self._probe()
+
+    async def _aadmit(self, config, limits, state):
+        self._enter(limits)
+        try:
+            open_until = await self._acurrent_open_until(config, state)
+            if not open_until:
+                return False
+            remaining = open_until - time.time()
+            if remaining > 0 or not await state.astart_probe(limits['RESET_TIMEOUT']):
+                self._refuse(remaining)
+        except BaseException:
+            # refused, or the cache failed: give the slot back
+            self._leave()
+            raise
+        return self._probe()
+
+    def _closed(self):
+        self._remember(0.0)
+        metrics.CIRCUIT_BREAKER_TRANSITIONS.labels(self.name, CLOSED).inc()
+
+    def _opened(self, open_until):
+        self._remember(open_until)
+        metrics.CIRCUIT_BREAKER_TRANSITIONS.labels(self.name, OPEN).inc()
+
+    def _record(self, limits, state, ok, probe):
+        self._leave()
+        if ok is None:
+            # cancelled, not the dependency's doing
+            if probe:
+                state.end_probe()
+            return
+        self._outcomes['success' if ok else 'failure'].inc()
+        if ok:
+            if probe:
+                state.close()
+                self._closed()
+            return
+        now = time.time()
+        if probe or state.add_failure(now, limits['FAILURE_WINDOW']) >= limits['FAILURE_THRESHOLD']:
+            state.set_open_until(now + limits['RESET_TIMEOUT'])
+            self._opened(now + limits['RESET_TIMEOUT'])
+
+    async def _arecord(self, limits, state, ok, probe):
+        self._leave()
+        if ok is None:
+            if probe:
+                await state.aend_probe()
+            return
+        self._outcomes['success' if ok else 'failure'].inc()
+        if ok:
+            if probe:
+                await state.aclose()
+                self._closed()
+            return
+        now = time.time()
+        if probe or await state.aadd_failure(
+                now, limits['FAILURE_WINDOW']) >= limits['FAILURE_THRESHOLD']:
+            await state.aset_open_until(now + limits['RESET_TIMEOUT'])
+            self._opened(now + limits['RESET_TIMEOUT'])
+
+    @contextmanager
+    def guard(self):
+        """
+        Admit one call or raise Unavailable. Exceptions leaving the block
+        and ``call.fail()`` count as failures.
+        """
+        config = get_config()
+        call = Call()
+        if not config['ENABLED']:
+            yield call
+            return
+        limits = breaker_config(self.name, config)
+        state = self._state(config)
+        probe = self._admit(config, limits, state)
+        try:
+            yield call
+        except Exception:
+            self._record(limits, state, False, probe)
+            raise
+        except BaseException:
+            self._record(limits, state, None, probe)
+            raise
+        self._record(limits, state, not call.failed, probe)
+
+    @asynccontextmanager
+    async def aguard(self):
+        """``guard()`` for async code, using the cache's async API"""
+        config = get_config()
+        call = Call()
+        if not config['ENABLED']:
+            yield call
+            return
+        limits = breaker_config(self.name, config)
+        state = self._state(config)
+        probe = await self._aadmit(config, limits, state)
+        try:
+            yield call
+        except Exception:
+            await self._arecord(limits, state, False, probe)
+            raise
+        except BaseException:
+            await self._arecord(limits, state, None, probe)
+            raise
+        await self._arecord(limits, state, not call.failed, probe)
+
+    def reset(self):
+        """Close the circuit, here and in the shared cache"""
+        config = get_config()
+        self._local.close()
+        if config['CACHE']:
+            SharedState(self.name, config['CACHE']).close()
+        with self._lock:
+            self._open_until, self._synced_at = 0.0, None
+
+
+_lock = threading.Lock()
+_breakers = {}
+
+
+def get(name):
+    """This process's breaker for the dependency ``name``"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def reset():
+    """Close every breaker, e.g. between tests"""
+    for breaker in list(_breakers.values()):
+        breaker.reset()
@@ -0,0 +1,93 @@
+"""
+Conditional GET for polled read endpoints.
+
+Each view computes a version of what it would return from one aggregate
+query, or from objects authentication already loaded, without loading or
+serializing the rows themselves. The version becomes a weak ``ETag`` and,
+when the view knows one, a ``Last-Modified`` date. A request whose
+``If-None-Match`` (or, without it, ``If-Modified-Since``) still matches
+gets an empty 304 and the serializer never runs.
+
+``Last-Modified`` has one-second resolution and does not move when a row
+is deleted, so clients should prefer ``If-None-Match``.
+"""
+import hashlib
+
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date
+
+
+def make_etag(request, version):
+    """A weak ETag for ``version`` of the resource at this URL and media type"""
+    digest = hashlib.sha1(repr((
+        request.get_full_path(),
+        getattr(request, 'accepted_media_type', None),
+        version,
+    )).encode('utf-8')).hexdigest()
+    return f'W/"{digest}"'
+
+
+def timestamp(*dates):
+    """Latest of ``dates`` as a Unix timestamp for Last-Modified, ignoring None"""
+    dates = [date for date in dates if date is not None]
+    return int(max(dates).timestamp()) if dates else None
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # per-user data, and clients must revalidate before reusing it
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def conditional(request, version, respond, last_modified=None):
+    """
+    304 if the client already has ``version``, else ``respond()``.
+
+    ``version`` is read before ``respond`` builds the body, so a concurrent
+    write can only make the ETag older than the body, which costs the
+    client one extra full response rather than a stale one.
+    """
+    etag = make_etag(request, version)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = respond()
+    if response.status_code in (200, 304):
+        set_validators(response, etag, last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Conditional ``list`` and ``retrieve`` for a viewset.
+
+    Implement ``list_version()`` and ``detail_version()`` to return a
+    ``(version, last_modified)`` pair, or None to answer normally.
+    """
+
+    def list_version(self):
+        return None
+
+    def detail_version(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.list_version(), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.detail_version(), super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, validators, handler, request, *args, **kwargs):
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        version, last_modified = validators
+        return conditional(
+            request, version, lambda: handler(request, *args, **kwargs),
+            last_modified=last_modified)
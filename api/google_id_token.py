@@ -0,0 +1,263 @@
+"""
+Verify the ``id_token`` of a Google token exchange locally.
+
+The token exchange also returns an OpenID Connect ID token: a JWT signed
+by one of Google's rotating RSA keys that already carries the user's
+email and name. Checking its signature against Google's published keys
+(the JWKS at ``HTTP_CLIENT['ENDPOINTS']['google_jwks']``) saves the
+userinfo round trip on every login. ``user_info`` returns the claims in
+the userinfo shape, or None when the token is missing or can't be
+verified, in which case the callback asks userinfo as before.
+
+The keys are cached for as long as Google's ``Cache-Control: max-age``
+allows, minus its ``Age``:
+
+* in each process, so a warm worker verifies in memory;
+* in the Django cache ``GOOGLE_ID_TOKEN['CACHE']`` when set, so workers
+  and nodes share one fetch.
+
+Once less than ``REFRESH_AHEAD`` of the lifetime is left, the next login
+starts a background refresh and carries on with the current keys. Logins
+only wait for a fetch when the keys expired, or when a token names a key
+they don't have (Google rotated), at most once per ``MIN_REFETCH_INTERVAL``.
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+import httpx
+import jwt
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+from . import http_client, metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ISSUERS': ['https://accounts.google.com', 'accounts.google.com'],
+    'LEEWAY': 60,
+    # alias of a Django cache shared by the workers, None for per process
+    'CACHE': None,
+    'CACHE_KEY': 'google-jwks',
+    # lifetime of a response without max-age
+    'DEFAULT_TTL': 3600,
+    # fraction of the lifetime left when a background refresh starts
+    'REFRESH_AHEAD': 0.1,
+    'MIN_REFETCH_INTERVAL': 30,
+}
+
+ALGORITHMS = ['RS256']
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+VERIFIED = metrics.GOOGLE_ID_TOKEN.labels('verified')
+MISSING = metrics.GOOGLE_ID_TOKEN.labels('missing')
+INVALID = metrics.GOOGLE_ID_TOKEN.labels('invalid')
+UNAVAILABLE = metrics.GOOGLE_ID_TOKEN.labels('unavailable')
+
+# the userinfo fields the callback reads
+PROFILE_CLAIMS = ['sub', 'email', 'email_verified', 'name', 'given_name', 'family_name',
+                  'picture']
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GOOGLE_ID_TOKEN', {})}
+
+
+def client_id():
+    return settings.SOCIALACCOUNT_PROVIDERS['google']['APPS'][0]['client_id']
+
+
+def lifetime(response, default):
+    """Seconds a JWKS response may be used, from its Cache-Control and Age"""
+    match = MAX_AGE.search(response.headers.get('Cache-Control', ''))
+    if match is None:
+        return default
+    try:
+        age = int(response.headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    return max(int(match[1]) - age, 0)
+
+
+class KeySet:
+    def __init__(self, jwks, fetched_at, expires_at):
+        self.jwks = jwks
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.keys = {}
+        for entry in jwks.get('keys', []):
+            try:
+                self.keys[entry['kid']] = jwt.PyJWK(entry).key
+            except (KeyError, jwt.PyJWKError):
+                # keys of other types or uses, not ours to check
+                continue
+
+    def fresh(self, now):
+        return now < self.expires_at
+
+    def due(self, now, refresh_ahead):
+        return now >= self.expires_at - (self.expires_at - self.fetched_at) * refresh_ahead
+
+
+class JWKSCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keyset = None
+        self._refreshing = False
+        self._last_fetch = 0
+
+    def clear(self):
+        with self._lock:
+            self._keyset = None
+            self._last_fetch = 0
+
+    def _keep(self, response, config):
+        if response.status_code != 200:
+            raise ValueError(f'JWKS answered {response.status_code}')
+        now = time.time()
+        keyset = KeySet(response.json(), now,
+                        now + lifetime(response, config['DEFAULT_TTL']))
+        with self._lock:
+            self._keyset = keyset
+        return keyset
+
+    def _shared_entry(self, keyset):
+        """(value, timeout) of ``keyset`` in the shared cache"""
+        return (json.dumps([keyset.jwks, keyset.fetched_at, keyset.expires_at]),
+                max(int(keyset.expires_at - time.time()), 1))
+
+    def _store(self, response, config):
+        """Keep a fetched JWKS here and in the shared cache, from the refresh thread"""
+        keyset = self._keep(response, config)
+        if config['CACHE']:
+            value, timeout = self._shared_entry(keyset)
+            caches[config['CACHE']].set(config['CACHE_KEY'], value, timeout=timeout)
+        return keyset
+
+    async def _astore(self, response, config):
+        keyset = self._keep(response, config)
+        if config['CACHE']:
+            value, timeout = self._shared_entry(keyset)
+            await caches[config['CACHE']].aset(config['CACHE_KEY'], value, timeout=timeout)
+        return keyset
+
+    async def _shared(self, config):
+        if not config['CACHE']:
+            return None
+        stored = await caches[config['CACHE']].aget(config['CACHE_KEY'])
+        if stored is None:
+            return None
+        keyset = KeySet(*json.loads(stored))
+        with self._lock:
+            self._keyset = keyset
+        return keyset
+
+    def _may_fetch(self, config):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_fetch < config['MIN_REFETCH_INTERVAL']:
+                return False
+            self._last_fetch = now
+            return True
+
+    async def get(self, config, refetch=False):
+        """The current KeySet, fetched first if expired, None if unavailable"""
+        now = time.time()
+        keyset = self._keyset
+        if keyset is None or not keyset.fresh(now):
+            keyset = await self._shared(config)
+        if keyset is not None and keyset.fresh(now) and not refetch:
+            if keyset.due(now, config['REFRESH_AHEAD']):
+                await self.refresh_in_background(config)
+            return keyset
+        current = keyset if keyset is not None and keyset.fresh(now) else None
+        # while Google is failing, logins go straight to userinfo
+        if not self._may_fetch(config):
+            return current
+        try:
+            return await self._astore(await http_client.aget('google_jwks'), config)
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning("Could not fetch Google's JWKS: %s", e)
+            return current
+
+    async def refresh_in_background(self, config):
+        """
+        Fetch the keys again in a thread, which outlives the request's event
+        loop under WSGI, unless this or another worker already is.
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        if config['CACHE'] and not await caches[config['CACHE']].aadd(
+                f"{config['CACHE_KEY']}:refreshing", 1, timeout=config['MIN_REFETCH_INTERVAL']):
+            # another worker is refreshing the shared copy
+            with self._lock:
+                self._refreshing = False
+            return
+        threading.Thread(target=self._refresh, args=(config,), daemon=True).start()
+
+    def _refresh(self, config):
+        try:
+            self._store(http_client.get('google_jwks'), config)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Could not refresh Google's JWKS: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+jwks = JWKSCache()
+
+
+class Unavailable(Exception):
+    pass
+
+
+async def verify(id_token, config=None):
+    """The claims of a valid Google ID token for this app; raises jwt.PyJWTError"""
+    config = config or get_config()
+    kid = jwt.get_unverified_header(id_token).get('kid')
+    keyset = await jwks.get(config)
+    if keyset is None:
+        raise Unavailable()
+    if kid not in keyset.keys:
+        # signed with a key published after our copy
+        keyset = await jwks.get(config, refetch=True)
+        if keyset is None or kid not in keyset.keys:
+            raise jwt.InvalidTokenError(f'Unknown key {kid!r}')
+    return jwt.decode(
+        id_token, keyset.keys[kid], algorithms=ALGORITHMS, audience=client_id(),
+        issuer=config['ISSUERS'], leeway=config['LEEWAY'],
+        options={'require': ['iss', 'aud', 'exp', 'iat', 'sub']})
+
+
+async def user_info(tokens):
+    """
+    The profile in a token response's ``id_token``, shaped like a userinfo
+    response, or None when userinfo has to be asked instead.
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    id_token = tokens.get('id_token')
+    if not id_token:
+        MISSING.inc()
+        return None
+    try:
+        claims = await verify(id_token, config)
+    except Unavailable:
+        UNAVAILABLE.inc()
+        return None
+    except jwt.PyJWTError as e:
+        logger.warning("Rejected Google ID token: %s", e)
+        INVALID.inc()
+        return None
+    VERIFIED.inc()
+    return {claim: claims[claim] for claim in PROFILE_CLAIMS if claim in claims}
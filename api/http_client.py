@@ -0,0 +1,311 @@
+"""
+Shared HTTP client for outbound calls to Google.
+
+One ``requests.Session`` per process keeps TLS connections to each host
+alive between logins. Every endpoint has its own timeout and retry budget,
+configured in ``settings.HTTP_CLIENT['ENDPOINTS']``:
+
+    'google_token': {'url': ..., 'timeout': (connect, read), 'retries': {...}}
+
+``retries`` are keyword arguments for ``urllib3.util.Retry``. The token
+exchange only retries failures to connect, because an authorization code
+can be redeemed once and a repeated POST after a read timeout would fail.
+
+Calls go through the circuit breaker named by the endpoint's ``breaker``
+(see api/circuit_breaker.py); exceptions and 5xx answers count as failures.
+A refused call raises ``requests.ConnectionError`` (``httpx.ConnectError``
+for async calls), like an unreachable host but without waiting for one.
+
+Async views use ``arequest``/``aget``/``apost`` instead, which go through
+one ``httpx.AsyncClient`` per event loop with the same endpoints, timeouts
+and retry budgets. The client is closed when its loop shuts down. Under ASGI
+that is the worker's loop, so connections are reused across requests. Under
+WSGI every async view runs in a loop of its own, whose client would connect
+afresh for each request, so views wrap themselves in ``pooled_session()``:
+their async calls then go through the process's session on the request's
+thread, and answer with ``requests`` responses and ``httpx`` errors.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from http import cookiejar
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from django.conf import settings
+
+from . import circuit_breaker, instrumentation
+
+DEFAULT_ENDPOINTS = {
+    'google_token': {
+        'url': 'https://oauth2.googleapis.com/token',
+        'breaker': 'google',
+        'timeout': (3.05, 10),
+        'retries': {'total': 2, 'connect': 2, 'read': 0, 'status': 0},
+    },
+    'google_userinfo': {
+        'url': 'https://www.googleapis.com/oauth2/v3/userinfo',
+        'breaker': 'google',
+        'timeout': (3.05, 5),
+        'retries': {'total': 2, 'connect': 2, 'read': 1, 'status': 2,
+                    'status_forcelist': (500, 502, 503, 504),
+                    'backoff_factor': 0.1, 'raise_on_status': False},
+    },
+    # Google's ID token signing keys, see api/google_id_token.py
+    'google_jwks': {
+        'url': 'https://www.googleapis.com/oauth2/v3/certs',
+        'breaker': 'google',
+        'timeout': (3.05, 5),
+        'retries': {'total': 2, 'connect': 2, 'read': 1, 'status': 2,
+                    'status_forcelist': (500, 502, 503, 504),
+                    'backoff_factor': 0.1, 'raise_on_status': False},
+    },
+}
+
+DEFAULTS = {
+    # connections kept per host, size it to the number of worker threads
+    'POOL_MAXSIZE': 20,
+    # connections one event loop may open at once; async views share them
+    # across every in-flight login of the process
+    'ASYNC_MAX_CONNECTIONS': 200,
+    'ENDPOINTS': DEFAULT_ENDPOINTS,
+}
+
+
+class BlockAllCookies(cookiejar.CookiePolicy):
+    """The session is shared by every user, so it must never keep cookies"""
+    return_ok = set_ok = domain_return_ok = path_return_ok = \
+        lambda self, *args, **kwargs: False
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'HTTP_CLIENT', {})}
+    endpoints = {}
+    for name, endpoint in {**DEFAULT_ENDPOINTS, **config['ENDPOINTS']}.items():
+        endpoints[name] = {**DEFAULT_ENDPOINTS.get(name, {}), **endpoint}
+    config['ENDPOINTS'] = endpoints
+    return config
+
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+def build_session(config):
+    session = requests.Session()
+    session.cookies.set_policy(BlockAllCookies())
+    for endpoint in config['ENDPOINTS'].values():
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config['POOL_MAXSIZE'],
+            max_retries=Retry(**endpoint['retries']),
+        )
+        # the longest matching prefix wins, so each endpoint gets its own budget
+        session.mount(endpoint['url'], adapter)
+    return session
+
+
+def get_session():
+    """Return this process's session, building a new one after a fork"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = build_session(get_config())
+                _session_pid = pid
+    return _session
+
+
+def reset():
+    """Drop the pooled session, e.g. after changing settings.HTTP_CLIENT"""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _async_clients.clear()
+
+
+@contextmanager
+def breaker(config, error):
+    """Guard a call with the endpoint's circuit breaker, raising refusals as ``error``"""
+    if not config.get('breaker'):
+        yield circuit_breaker.Call()
+        return
+    try:
+        with circuit_breaker.get(config['breaker']).guard() as call:
+            yield call
+    except circuit_breaker.Unavailable as e:
+        raise error(str(e)) from e
+
+
+@asynccontextmanager
+async def abreaker(config, error):
+    """``breaker`` for async calls"""
+    if not config.get('breaker'):
+        yield circuit_breaker.Call()
+        return
+    try:
+        async with circuit_breaker.get(config['breaker']).aguard() as call:
+            yield call
+    except circuit_breaker.Unavailable as e:
+        raise error(str(e)) from e
+
+
+def request(method, endpoint, **kwargs):
+    """Call a configured endpoint through the pooled session"""
+    config = get_config()['ENDPOINTS'][endpoint]
+    kwargs.setdefault('timeout', config['timeout'])
+    with breaker(config, requests.ConnectionError) as call, \
+            instrumentation.external_call(endpoint):
+        response = get_session().request(method, config['url'], **kwargs)
+        if response.status_code >= 500:
+            call.fail()
+        return response
+
+
+def get(endpoint, **kwargs):
+    return request('GET', endpoint, **kwargs)
+
+
+def post(endpoint, **kwargs):
+    return request('POST', endpoint, **kwargs)
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def build_async_client(config):
+    limits = httpx.Limits(
+        max_connections=config['ASYNC_MAX_CONNECTIONS'],
+        max_keepalive_connections=config['POOL_MAXSIZE'])
+    return httpx.AsyncClient(
+        limits=limits,
+        cookies=cookiejar.CookieJar(policy=BlockAllCookies()))
+
+
+async def close_with_loop(client):
+    """
+    Parked at its ``yield`` for the life of the loop: asyncio.run(), async_to_sync
+    and uvicorn all finish a loop with shutdown_asyncgens(), which closes it.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def get_async_client():
+    """Return the client of the running event loop, building it on first use"""
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[1] != os.getpid():
+        client = build_async_client(get_config())
+        closer = close_with_loop(client)
+        await anext(closer)
+        # the loop only keeps a weak reference to the generator
+        entry = (client, os.getpid(), closer)
+        _async_clients[loop] = entry
+    return entry[0]
+
+
+def retry_kind(response=None, error=None, status_forcelist=()):
+    """Classify a failed attempt the way urllib3.util.Retry counts it"""
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return 'connect'
+    if isinstance(error, (httpx.ReadError, httpx.ReadTimeout)):
+        return 'read'
+    if response is not None and response.status_code in status_forcelist:
+        return 'status'
+    return None
+
+
+_use_session = contextvars.ContextVar('http_client_use_session', default=False)
+
+
+@contextmanager
+def pooled_session():
+    """Send the async calls made within the block through the pooled session"""
+    token = _use_session.set(True)
+    try:
+        yield
+    finally:
+        _use_session.reset(token)
+
+
+async def session_request(method, endpoint, **kwargs):
+    """``request`` on the thread serving the request, its errors raised as httpx's"""
+    try:
+        return await sync_to_async(request)(method, endpoint, **kwargs)
+    except requests.ConnectTimeout as e:
+        raise httpx.ConnectTimeout(str(e)) from e
+    except requests.Timeout as e:
+        raise httpx.ReadTimeout(str(e)) from e
+    except requests.ConnectionError as e:
+        raise httpx.ConnectError(str(e)) from e
+    except requests.RequestException as e:
+        raise httpx.TransportError(str(e)) from e
+
+
+async def arequest(method, endpoint, **kwargs):
+    """Call a configured endpoint through this event loop's pooled client"""
+    if _use_session.get():
+        return await session_request(method, endpoint, **kwargs)
+    async with abreaker(get_config()['ENDPOINTS'][endpoint], httpx.ConnectError) as call:
+        with instrumentation.external_call(endpoint):
+            response = await _arequest(method, endpoint, **kwargs)
+        if response.status_code >= 500:
+            call.fail()
+        return response
+
+
+async def _arequest(method, endpoint, **kwargs):
+    config = get_config()['ENDPOINTS'][endpoint]
+    connect, read = config['timeout']
+    # waiting for a free pooled connection counts against the read budget
+    kwargs.setdefault('timeout', httpx.Timeout(read, connect=connect, pool=read))
+
+    budget = dict(config['retries'])
+    total = budget.get('total', 0)
+    failures = 0
+    while True:
+        response = error = None
+        try:
+            client = await get_async_client()
+            response = await client.request(method, config['url'], **kwargs)
+        except httpx.TransportError as exc:
+            error = exc
+        kind = retry_kind(response, error, budget.get('status_forcelist', ()))
+        if kind is None:
+            if error is not None:
+                raise error
+            return response
+        remaining = budget.get(kind, total)
+        if total <= 0 or remaining <= 0:
+            if error is not None:
+                raise error
+            return response
+        total -= 1
+        budget[kind] = remaining - 1
+        failures += 1
+        if failures > 1:
+            await asyncio.sleep(budget.get('backoff_factor', 0) * 2 ** (failures - 1))
+
+
+async def aget(endpoint, **kwargs):
+    return await arequest('GET', endpoint, **kwargs)
+
+
+async def apost(endpoint, **kwargs):
+    return await arequest('POST', endpoint, **kwargs)
@@ -0,0 +1,181 @@
+"""
+Per-request timing of SQL queries and external HTTP calls.
+
+With ``settings.INSTRUMENTATION['ENABLED']``, InstrumentationMiddleware
+times every request and, through a database execute wrapper installed on
+each new connection, counts its queries and their time. Calls to Google
+and Africa's Talking are timed with ``external_call``. Each response gets
+a ``Server-Timing`` header, for example::
+
+    Server-Timing: db;dur=4.1;desc="6 queries", google_token;dur=212.0, total;dur=231.5
+
+and the same figures are observed into per-view histograms (api/metrics.py)
+served at ``/metrics``. A request that runs the same
+SQL ``DUPLICATE_QUERY_THRESHOLD`` times or more logs a warning, which is
+usually an N+1 query in a serializer or loop.
+"""
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import Counter as CounterMetric, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SERVER_TIMING': True,
+    'DUPLICATE_QUERY_THRESHOLD': 5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response',
+    ['view', 'method'])
+DB_SECONDS = Histogram(
+    'http_request_db_seconds', 'Time spent in SQL queries per request',
+    ['view'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, float('inf')))
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries per request',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, float('inf')))
+EXTERNAL_SECONDS = Histogram(
+    'http_request_external_seconds', 'Time spent calling an external service per request',
+    ['view', 'service'])
+DUPLICATE_QUERIES = CounterMetric(
+    'http_request_duplicate_queries', 'Requests that repeated one SQL query past the threshold',
+    ['view'])
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.external = {}
+        self.statements = Counter()
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        self.statements[sql] += 1
+
+    def add_external(self, service, seconds):
+        self.external[service] = self.external.get(service, 0.0) + seconds
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper, see ``install_query_recorder``"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - start)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver; pooled connections fire it on every checkout"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def external_call(service):
+    """Time a call to an external service against the current request"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_external(service, time.perf_counter() - start)
+
+
+def server_timing(metrics, total):
+    entries = [f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries"']
+    entries += [f'{service};dur={seconds * 1000:.1f}'
+                for service, seconds in metrics.external.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    Records query counts, DB, external and total time for each request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    def finish(self, request, response, metrics, total):
+        config = get_config()
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+
+        REQUEST_SECONDS.labels(view, request.method).observe(total)
+        DB_SECONDS.labels(view).observe(metrics.db_seconds)
+        DB_QUERIES.labels(view).observe(metrics.queries)
+        for service, seconds in metrics.external.items():
+            EXTERNAL_SECONDS.labels(view, service).observe(seconds)
+
+        threshold = config['DUPLICATE_QUERY_THRESHOLD']
+        repeated = [(sql, count) for sql, count in metrics.statements.items()
+                    if count >= threshold]
+        if repeated:
+            DUPLICATE_QUERIES.labels(view).inc()
+            for sql, count in repeated:
+                logger.warning(
+                    "%s %s ran the same query %d times, likely N+1: %s",
+                    request.method, view, count, sql[:300])
+
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = server_timing(metrics, total)
+        return response
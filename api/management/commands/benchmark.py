@@ -0,0 +1,164 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import outbox, utils
+from api.models import Orders, SMSOutbox
+from benchmarks import suite
+from benchmarks.fake_google import start_google
+from benchmarks.fake_sms_gateway import start_gateway
+from benchmarks.loadgen import free_port, start_server, stop_server
+
+
+class Command(BaseCommand):
+    help = ("Seed synthetic customers and orders, drive the API routes through "
+            "gunicorn and report latency, throughput and queries as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*', metavar='scenario',
+            help=f"Scenarios to run, all by default: {', '.join(suite.SCENARIOS)}")
+        parser.add_argument('--users', type=int, default=100,
+                            help="Customers to seed, requests rotate through them")
+        parser.add_argument('--orders', type=int, default=50,
+                            help="Orders seeded per customer")
+        parser.add_argument('--requests', type=int, default=2000,
+                            help="Requests per scenario, after a warm-up")
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help="Keep-alive clients sending at once")
+        parser.add_argument('--workers', type=int, default=2,
+                            help="gunicorn worker processes")
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--google-latency', type=float, default=0.05,
+                            help="Seconds the fake Google takes per call")
+        parser.add_argument('--sms-latency', type=float, default=0.05,
+                            help="Seconds the fake SMS gateway takes per request")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help="Fail if the run regressed against this JSON report")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fraction rps and latency may worsen by before it counts")
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'] or suite.SCENARIOS
+        unknown = sorted(set(scenarios) - set(suite.SCENARIOS))
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as stream:
+                baseline = json.load(stream)
+        if ('create_order' in scenarios and SMSOutbox.objects.exclude(
+                status__in=[SMSOutbox.SENT, SMSOutbox.FAILED, SMSOutbox.UNKNOWN]).exists()):
+            # the drain below would hand them to the fake gateway
+            raise CommandError(
+                "The SMS outbox has undelivered rows; deliver them or skip create_order")
+
+        google, google_url, _, _ = start_google(latency=options['google_latency'], tls=False)
+        gateway, gateway_url, gateway_stats = start_gateway(latency=options['sms_latency'])
+        self.stderr.write(f"Seeding {options['users']} customers with "
+                          f"{options['orders']} orders each")
+        prefix, tokens = suite.seed(options['users'], options['orders'])
+        oauth_user = suite.oauth_account() if 'oauth_callback' in scenarios else None
+
+        port = free_port()
+        env = {
+            **os.environ,
+            'PYTHONPATH': str(settings.BASE_DIR),
+            'DJANGO_SETTINGS_MODULE': 'benchmarks.bench_settings',
+            'BENCH_GOOGLE_URL': google_url,
+            'INSTRUMENTATION_ENABLED': 'true',
+            'INSTRUMENTATION_SERVER_TIMING': 'true',
+            'SERVER_INTERFACE': options['interface'],
+            'WEB_CONCURRENCY': str(options['workers']),
+            'GUNICORN_ACCESS_LOG': '',
+        }
+        results = {}
+        try:
+            server = start_server(
+                [sys.executable, '-m', 'gunicorn', '-c', 'config/gunicorn.conf.py',
+                 '--bind', f'127.0.0.1:{port}'],
+                port, settings.BASE_DIR, env)
+            try:
+                for scenario in scenarios:
+                    self.stderr.write(f"Running {scenario}")
+                    results[scenario] = suite.run(
+                        scenario, port, tokens, options['requests'], options['concurrency'])
+            finally:
+                stop_server(server)
+            if 'create_order' in results:
+                results['create_order']['sms'] = self.deliver(
+                    prefix, gateway_url, gateway_stats)
+        finally:
+            suite.cleanup(prefix)
+            if oauth_user is not None:
+                oauth_user.delete()
+            google.shutdown()
+            gateway.shutdown()
+
+        report = {'meta': self.meta(options), 'scenarios': results}
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+        if baseline is not None:
+            changed = [key for key, value in report['meta'].items()
+                       if key not in ('date', 'commit') and baseline['meta'].get(key) != value]
+            if changed:
+                self.stderr.write(
+                    f"The baseline ran with different {', '.join(changed)}, "
+                    f"numbers may not be comparable")
+            regressions = suite.compare(baseline, report, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['compare']}")
+            self.stderr.write(f"No regressions against {options['compare']}")
+
+    def deliver(self, prefix, gateway_url, stats):
+        """Send the confirmations the created orders queued through the fake gateway"""
+        # only the seeded customers' rows, whatever else reaches the outbox meanwhile
+        rows = SMSOutbox.objects.filter(
+            order__in=Orders.objects.filter(customer__user__username__startswith=prefix))
+        base_url = utils.sms.base_url
+        utils.sms.base_url = f'{gateway_url}/version1'
+        start = time.perf_counter()
+        try:
+            totals = outbox.drain(
+                config={**outbox.get_config(), 'BATCH_WINDOW': 0}, rows=rows)
+        finally:
+            utils.sms.base_url = base_url
+        return {
+            'sent': totals['sent'],
+            'failed': totals['failed'],
+            'gateway_requests': stats.requests,
+            'drain_s': round(time.perf_counter() - start, 2),
+        }
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'date': timezone.now().isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'cpus': os.cpu_count(),
+            **{key: options[key] for key in (
+                'users', 'orders', 'requests', 'concurrency', 'workers', 'interface',
+                'google_latency', 'sms_latency')},
+        }
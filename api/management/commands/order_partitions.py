@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import partitions
+
+
+class Command(BaseCommand):
+    help = "Create, list, archive and restore the monthly partitions of the orders table"
+
+    def add_arguments(self, parser):
+        config = partitions.get_config()
+        actions = parser.add_subparsers(dest='action', required=True)
+
+        ensure = actions.add_parser(
+            'ensure', help="Create partitions for the coming months; run daily")
+        ensure.add_argument(
+            '--months-ahead', type=int, default=config['MONTHS_AHEAD'],
+            help="Months after the current one to create partitions for")
+
+        actions.add_parser('list', help="Show attached and archived months")
+
+        archive = actions.add_parser(
+            'archive', help="Move months to gzipped CSV files and drop their partitions")
+        archive.add_argument(
+            '--before', type=partitions.parse_month, required=True,
+            help="Archive every attached month before this one (YYYY-MM)")
+        archive.add_argument('--dir', default=config['ARCHIVE_DIR'])
+
+        restore = actions.add_parser(
+            'restore', help="Load archived months back as attached partitions")
+        restore.add_argument('months', nargs='+', type=partitions.parse_month,
+                             help="Months to restore (YYYY-MM)")
+        restore.add_argument('--dir', default=config['ARCHIVE_DIR'])
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError("The orders table is not partitioned, this needs PostgreSQL")
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_ensure(self, options):
+        created = partitions.ensure_partitions(options['months_ahead'])
+        for month in created:
+            self.stdout.write(f"Created {partitions.partition_name(month)}")
+
+    def handle_list(self, options):
+        attached = partitions.attached_partitions()
+        archived = partitions.archived_months()
+        for month in sorted({*attached, *archived}):
+            if month in attached:
+                state = f"attached, ~{attached[month]} orders"
+            else:
+                state = "archived"
+            self.stdout.write(f"{month:%Y-%m}  {state}")
+
+    def handle_archive(self, options):
+        months = [month for month in sorted(partitions.attached_partitions())
+                  if month < options['before']]
+        for month in months:
+            try:
+                count = partitions.archive_partition(month, options['dir'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                f"Archived {count} orders of {month:%Y-%m} to "
+                f"{partitions.archive_path(month, options['dir'])}")
+
+    def handle_restore(self, options):
+        for month in options['months']:
+            try:
+                count = partitions.restore_partition(month, options['dir'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"Restored {count} orders of {month:%Y-%m}")
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued SMS messages from the outbox table"
+
+    def add_arguments(self, parser):
+        config = outbox.get_config()
+        parser.add_argument(
+            '--concurrency', type=int, default=config['CONCURRENCY'],
+            help="Number of gateway requests made in parallel")
+        parser.add_argument(
+            '--batch-size', type=int, default=config['BATCH_SIZE'],
+            help="Most rows collected before a batch is sent")
+        parser.add_argument(
+            '--poll-interval', type=float, default=config['POLL_INTERVAL'],
+            help="Seconds to sleep when the outbox is empty")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Drain the due messages once and exit")
+
+    def handle(self, *args, **options):
+        config = outbox.get_config()
+        while True:
+            totals = outbox.drain(
+                concurrency=options['concurrency'],
+                batch_size=options['batch_size'],
+                config=config,
+            )
+            if totals['sent'] or totals['failed'] or totals['unknown']:
+                self.stdout.write(
+                    f"Sent {totals['sent']} SMS in {totals['requests']} requests, "
+                    f"{totals['failed']} failed attempts, {totals['unknown']} unknown")
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
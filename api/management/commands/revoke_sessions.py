@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api import session_tokens
+
+
+class Command(BaseCommand):
+    help = "Revoke session tokens before they expire, per user or one at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help="Users whose session tokens issued until now and "
+                                 "stored Google tokens are revoked")
+        parser.add_argument('--token', action='append', default=[],
+                            help="A single session token to revoke, may be repeated")
+
+    def handle(self, *args, **options):
+        if not options['usernames'] and not options['token']:
+            raise CommandError("Give usernames or --token")
+
+        for username in options['usernames']:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"No user {username!r}")
+            session_tokens.revoke_user(user.pk)
+            self.stdout.write(f"Revoked the sessions of {username}")
+
+        for token in options['token']:
+            try:
+                claims = session_tokens.verify(token)
+            except session_tokens.InvalidSessionToken as e:
+                # expired and already revoked tokens need nothing more
+                raise CommandError(f"Not a live session token: {e}")
+            session_tokens.revoke(claims)
+            self.stdout.write(f"Revoked session {claims['jti']}")
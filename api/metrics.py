@@ -0,0 +1,359 @@
+"""
+Counters and latency histograms served at ``/metrics`` in the Prometheus
+text format.
+
+Recording only touches process memory: ``inc`` and ``observe`` take one
+uncontended lock, a few hundred nanoseconds, and never do I/O. Under
+gunicorn every worker is its own process, so with
+``settings.METRICS['MULTIPROCESS_DIR']`` set (config/gunicorn.conf.py
+sets it) a daemon thread in each process writes its values to
+``<dir>/<pid>.json`` every ``FLUSH_INTERVAL`` seconds and at exit.
+``render`` sums the files of every process. Files of exited workers are
+folded into ``archive.json`` by the gunicorn master (``mark_process_dead``),
+so counters survive worker recycling without the directory growing.
+
+Define metrics at import time with labels of low cardinality::
+
+    ORDERS_CREATED = Counter('orders_created', 'Orders created', ['endpoint'])
+    ORDERS_CREATED.labels('bulk').inc(len(orders))
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 1.0,
+    # when set, /metrics requires ``Authorization: Bearer <token>``
+    'TOKEN': None,
+}
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 7.5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+ARCHIVE = 'archive.json'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+
+class HistogramChild:
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return [*self.counts, self.sum]
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        """The series for these label values, bind it once on hot paths"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(
+                    tuple(str(value) for value in values), self.new_child())
+                self._children[values] = child
+        return child
+
+    def series(self):
+        return {key: child for key, child in self._children.items()
+                if all(isinstance(value, str) for value in key)}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self, labels, value):
+        yield f'{self.name}_total', labels, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        self.bounds = tuple(bound for bound in buckets if bound != float('inf'))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self, labels, value):
+        cumulative = 0
+        for bound, count in zip((*self.bounds, float('inf')), value):
+            cumulative += count
+            yield f'{self.name}_bucket', (*labels, ('le', format_value(bound))), cumulative
+        yield f'{self.name}_sum', labels, value[-1]
+        yield f'{self.name}_count', labels, cumulative
+
+
+def merge(total, value):
+    """Add one process's value of a series: a number, or histogram counts and sum"""
+    if total is None:
+        return value
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+
+def merge_into(totals, values):
+    for name, series in values.items():
+        merged = totals.setdefault(name, {})
+        for key, value in series.items():
+            merged[key] = merge(merged.get(key), value)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._flusher_pid = None
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Duplicate metric {metric.name}')
+        self._metrics[metric.name] = metric
+
+    def snapshot(self):
+        """This process's values, {metric name: {label json: value}}"""
+        return {
+            name: {json.dumps(key): child.snapshot()
+                   for key, child in metric.series().items()}
+            for name, metric in self._metrics.items()
+        }
+
+    def reset(self):
+        for metric in self._metrics.values():
+            for child in metric.series().values():
+                child.reset()
+
+    # multiprocess store
+
+    def flush(self, directory=None):
+        """Write this process's values to its file in the multiprocess directory"""
+        directory = directory or get_config()['MULTIPROCESS_DIR']
+        if not directory:
+            return
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        write_json(path, self.snapshot())
+
+    def start_flusher(self):
+        """Flush periodically from a daemon thread; safe to call repeatedly"""
+        config = get_config()
+        if not config['MULTIPROCESS_DIR'] or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        interval = config['FLUSH_INTERVAL']
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.flush()
+
+        threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+        atexit.register(self.flush)
+
+    def after_fork(self):
+        # the parent's values are in the parent's file, and its flusher
+        # thread is gone, possibly while holding one of the locks
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+        self.reset()
+        self._flusher_pid = None
+
+    def collect(self):
+        """{metric name: {label json: value}} summed over every process"""
+        directory = get_config()['MULTIPROCESS_DIR']
+        if not directory:
+            return self.snapshot()
+
+        self.flush(directory)
+        totals = {}
+        with locked(directory, fcntl.LOCK_SH):
+            for filename in os.listdir(directory):
+                if filename.endswith('.json'):
+                    merge_into(totals, read_json(os.path.join(directory, filename)))
+        return totals
+
+    def render(self):
+        lines = []
+        values = self.collect()
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {escape(metric.documentation)}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, value in sorted(values.get(name, {}).items()):
+                labels = tuple(zip(metric.labelnames, json.loads(key)))
+                for sample, sample_labels, number in metric.samples(labels, value):
+                    label_text = ','.join(f'{label}="{escape(text)}"'
+                                          for label, text in sample_labels)
+                    label_text = f'{{{label_text}}}' if label_text else ''
+                    lines.append(f'{sample}{label_text} {format_value(number)}')
+        return '\n'.join(lines) + '\n'
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_json(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def locked(directory, operation):
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def mark_process_dead(pid, directory):
+    """Fold an exited process's file into the archive; needs no Django setup"""
+    path = os.path.join(directory, f'{pid}.json')
+    if not os.path.exists(path):
+        return
+    with locked(directory, fcntl.LOCK_EX):
+        archive = os.path.join(directory, ARCHIVE)
+        totals = read_json(archive)
+        merge_into(totals, read_json(path))
+        write_json(archive, totals)
+        os.unlink(path)
+
+
+REGISTRY = Registry()
+os.register_at_fork(after_in_child=REGISTRY.after_fork)
+
+
+def render():
+    """Every registered metric in the Prometheus text format, as (body, content type)"""
+    return REGISTRY.render(), CONTENT_TYPE
+
+
+# Business metrics
+
+ORDERS_CREATED = Counter(
+    'orders_created', 'Orders created', ['endpoint'])
+ORDER_REQUESTS = Counter(
+    'order_create_requests', 'Order creation requests by outcome', ['endpoint', 'outcome'])
+ORDER_CREATE_SECONDS = Histogram(
+    'order_create_seconds', 'Time to validate and store an order request', ['endpoint'])
+
+COOKIE_AUTH = Counter(
+    'cookie_auth_attempts', 'Cookie authentication attempts by outcome', ['outcome'])
+
+GOOGLE_OAUTH = Counter(
+    'google_oauth_exchanges', 'Google OAuth code and refresh exchanges by outcome',
+    ['grant', 'outcome'])
+GOOGLE_ID_TOKEN = Counter(
+    'google_id_token_checks', 'Google ID tokens checked locally by outcome', ['outcome'])
+SINGLE_FLIGHT = Counter(
+    'single_flight_calls', 'Coalesced calls by whether they did the work or reused it',
+    ['flight', 'outcome'])
+GOOGLE_OAUTH_SECONDS = Histogram(
+    'google_oauth_seconds', 'Time spent calling Google per exchange', ['grant'])
+
+CIRCUIT_BREAKER_CALLS = Counter(
+    'circuit_breaker_calls', 'Calls to a dependency by outcome, open and full were refused',
+    ['dependency', 'outcome'])
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    'circuit_breaker_transitions', 'Times a dependency circuit changed state',
+    ['dependency', 'state'])
+
+SMS_SENDS = Counter(
+    'sms_sends', "Requests to the Africa's Talking SMS API by outcome", ['mode', 'outcome'])
+SMS_RECIPIENTS = Counter(
+    'sms_recipients', 'Phone numbers SMS were sent to', ['mode'])
+SMS_SEND_SECONDS = Histogram(
+    'sms_send_seconds', "Time per request to the Africa's Talking SMS API", ['mode'])
@@ -0,0 +1,40 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_access_token_hash(apps, schema_editor):
+    Customer = apps.get_model('api', 'Customer')
+    batch = []
+    customers = Customer.objects.exclude(access_token__isnull=True).exclude(
+        access_token='').only('id', 'access_token')
+    for customer in customers.iterator(chunk_size=2000):
+        customer.access_token_hash = hashlib.sha256(
+            customer.access_token.encode('utf-8')).hexdigest()
+        batch.append(customer)
+        if len(batch) >= 2000:
+            Customer.objects.bulk_update(batch, ['access_token_hash'])
+            batch = []
+    if batch:
+        Customer.objects.bulk_update(batch, ['access_token_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='access_token_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_access_token_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customer',
+            name='access_token_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_smsoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orders',
+            index=models.Index(fields=['customer', 'order_date', 'id'], name='orders_customer_date_idx'),
+        ),
+        # the composite index covers customer_id lookups, drop the FK index
+        migrations.AlterField(
+            model_name='orders',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.customer'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    Orders = apps.get_model('api', 'Orders')
+    OrderDailyRollup = apps.get_model('api', 'OrderDailyRollup')
+    rows = (Orders.objects.annotate(day=TruncDate('order_date'))
+            .values('customer_id', 'day')
+            .annotate(order_count=Count('id'), total_amount=Sum('total_amount'))
+            .order_by())
+    OrderDailyRollup.objects.bulk_create(
+        (OrderDailyRollup(**row) for row in rows.iterator(chunk_size=2000)),
+        batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_orders_customer_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='order_rollups', to='api.customer')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('customer', 'day'), name='order_rollup_customer_day')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
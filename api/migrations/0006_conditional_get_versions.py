@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_orderdailyrollup'),
+    ]
+
+    operations = [
+        # rebuilt below with updated_at as a covering column
+        migrations.RemoveIndex(
+            model_name='orders',
+            name='orders_customer_date_idx',
+        ),
+        # existing rows take the migration time as their first version
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='orders',
+            index=models.Index(fields=['customer', 'order_date', 'id'], include=('updated_at',), name='orders_customer_date_idx'),
+        ),
+    ]
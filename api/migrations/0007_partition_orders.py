@@ -0,0 +1,154 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:37
+
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+# api.partitions works on the current models; these are the names and
+# bounds as they stood at this migration
+MONTHS_AHEAD = 3
+
+
+PARTITION = [
+    'ALTER TABLE api_orders RENAME TO api_orders_unpartitioned',
+    'ALTER INDEX api_orders_pkey RENAME TO api_orders_unpartitioned_pkey',
+    'ALTER INDEX orders_customer_date_idx RENAME TO orders_customer_date_unpartitioned_idx',
+    'ALTER SEQUENCE api_orders_id_seq RENAME TO api_orders_unpartitioned_id_seq',
+    'CREATE TABLE api_orders (LIKE api_orders_unpartitioned INCLUDING DEFAULTS INCLUDING IDENTITY) '
+    'PARTITION BY RANGE (order_date)',
+    # the partition key has to be part of every unique index
+    'ALTER TABLE api_orders ADD CONSTRAINT api_orders_pkey PRIMARY KEY (id, order_date)',
+    'ALTER TABLE api_orders ADD CONSTRAINT api_orders_customer_id_fk_api_customer_id '
+    'FOREIGN KEY (customer_id) REFERENCES api_customer (id) DEFERRABLE INITIALLY DEFERRED',
+    'CREATE INDEX orders_customer_date_idx ON api_orders (customer_id, order_date, id) '
+    'INCLUDE (updated_at)',
+    'CREATE INDEX api_orders_order_code_idx ON api_orders (order_code)',
+    'CREATE TABLE api_orders_default PARTITION OF api_orders DEFAULT',
+]
+
+COPY = [
+    'INSERT INTO api_orders SELECT * FROM api_orders_unpartitioned',
+    "SELECT setval(pg_get_serial_sequence('api_orders', 'id'), "
+    "COALESCE(MAX(id), 0) + 1, false) FROM api_orders",
+    'INSERT INTO api_ordercode (code, order_id) SELECT order_code, id FROM api_orders',
+    'DROP TABLE api_orders_unpartitioned',
+]
+
+RESERVE_CODE = [
+    """
+    CREATE FUNCTION api_orders_reserve_code() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND NEW.order_code = OLD.order_code THEN
+            RETURN NEW;
+        END IF;
+        -- an order moving to another month's partition is inserted again
+        -- under its own id, which is not a conflict
+        INSERT INTO api_ordercode (code, order_id) VALUES (NEW.order_code, NEW.id)
+        ON CONFLICT (code) DO UPDATE SET order_id = EXCLUDED.order_id
+        WHERE api_ordercode.order_id = EXCLUDED.order_id;
+        IF NOT FOUND THEN
+            RAISE unique_violation USING
+                MESSAGE = format('order code %s is already taken', NEW.order_code),
+                CONSTRAINT = 'api_ordercode_pkey';
+        END IF;
+        RETURN NEW;
+    END
+    $$
+    """,
+    'CREATE TRIGGER api_orders_reserve_code BEFORE INSERT OR UPDATE OF order_code '
+    'ON api_orders FOR EACH ROW EXECUTE FUNCTION api_orders_reserve_code()',
+]
+
+UNPARTITION = [
+    'DROP TRIGGER api_orders_reserve_code ON api_orders',
+    'DROP FUNCTION api_orders_reserve_code()',
+    'ALTER TABLE api_orders RENAME TO api_orders_partitioned',
+    'ALTER INDEX api_orders_pkey RENAME TO api_orders_partitioned_pkey',
+    'ALTER INDEX orders_customer_date_idx RENAME TO orders_customer_date_partitioned_idx',
+    'ALTER SEQUENCE api_orders_id_seq RENAME TO api_orders_partitioned_id_seq',
+    'CREATE TABLE api_orders (LIKE api_orders_partitioned INCLUDING DEFAULTS INCLUDING IDENTITY)',
+    'INSERT INTO api_orders SELECT * FROM api_orders_partitioned',
+    "SELECT setval(pg_get_serial_sequence('api_orders', 'id'), "
+    "COALESCE(MAX(id), 0) + 1, false) FROM api_orders",
+    'ALTER TABLE api_orders ADD CONSTRAINT api_orders_pkey PRIMARY KEY (id)',
+    'ALTER TABLE api_orders ADD CONSTRAINT api_orders_order_code_key UNIQUE (order_code)',
+    'CREATE INDEX api_orders_order_code_85877038_like ON api_orders '
+    '(order_code varchar_pattern_ops)',
+    'ALTER TABLE api_orders ADD CONSTRAINT api_orders_customer_id_921d3f1b_fk_api_customer_id '
+    'FOREIGN KEY (customer_id) REFERENCES api_customer (id) DEFERRABLE INITIALLY DEFERRED',
+    'CREATE INDEX orders_customer_date_idx ON api_orders (customer_id, order_date, id) '
+    'INCLUDE (updated_at)',
+    'DROP TABLE api_orders_partitioned CASCADE',
+]
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_partition(schema_editor, month):
+    """Create and attach the partition of the UTC month starting on ``month``"""
+    end = add_months(month, 1)
+    schema_editor.execute(
+        f"CREATE TABLE api_orders_y{month.year}m{month.month:02d} PARTITION OF api_orders "
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') TO ('{end.isoformat()} 00:00+00')",
+        params=None)
+
+
+def partition_orders(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    for statement in PARTITION:
+        schema_editor.execute(statement, params=None)
+
+    # a partition per month that has orders, so the copy lands in place,
+    # and for the coming months
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', order_date AT TIME ZONE 'UTC')::date "
+            "FROM api_orders_unpartitioned")
+        months = {month for (month,) in cursor.fetchall()}
+    now = timezone.now()
+    current = date(now.year, now.month, 1)
+    months.update(add_months(current, offset) for offset in range(MONTHS_AHEAD + 1))
+    for month in sorted(months):
+        create_partition(schema_editor, month)
+
+    for statement in COPY + RESERVE_CODE:
+        schema_editor.execute(statement, params=None)
+
+
+def unpartition_orders(apps, schema_editor):
+    # archived months are not brought back, restore them first
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in UNPARTITION:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_conditional_get_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderCode',
+            fields=[
+                ('code', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('order_id', models.BigIntegerField()),
+            ],
+        ),
+        # a foreign key cannot reference the partitioned table by id alone
+        migrations.AlterField(
+            model_name='smsoutbox',
+            name='order',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_messages', to='api.orders'),
+        ),
+        migrations.RunPython(partition_orders, unpartition_orders),
+    ]
@@ -0,0 +1,40 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_refresh_token_hash(apps, schema_editor):
+    Customer = apps.get_model('api', 'Customer')
+    batch = []
+    customers = Customer.objects.exclude(refresh_token__isnull=True).exclude(
+        refresh_token='').only('id', 'refresh_token')
+    for customer in customers.iterator(chunk_size=2000):
+        customer.refresh_token_hash = hashlib.sha256(
+            customer.refresh_token.encode('utf-8')).hexdigest()
+        batch.append(customer)
+        if len(batch) >= 2000:
+            Customer.objects.bulk_update(batch, ['refresh_token_hash'])
+            batch = []
+    if batch:
+        Customer.objects.bulk_update(batch, ['refresh_token_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_revokedsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='refresh_token_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_refresh_token_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customer',
+            name='refresh_token_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index auth_user.email, which the OAuth callback looks users up by.
+    auth.User belongs to Django, so the index is created in SQL here.
+    """
+
+    dependencies = [
+        ('api', '0009_customer_refresh_token_hash'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX IF EXISTS auth_user_email_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_user_email_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='smsoutbox',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed'), ('unknown', 'Unknown')], default='pending', max_length=10),
+        ),
+    ]
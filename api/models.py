@@ -1,30 +1,205 @@
-from django.db import models
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import order_codes
+
+
+def hash_token(token):
+    """Return the fixed-width sha256 digest used to index a raw token"""
+    if not token:
+        return None
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     phone_number = models.CharField(max_length=15, blank=True)
     access_token = models.TextField(null=True, blank=True)
+    # sha256 of access_token, this is what CookieAuthentication looks up
+    access_token_hash = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False)
     refresh_token = models.TextField(null=True, blank=True)
+    # sha256 of refresh_token, what the refresh view looks up
+    refresh_token_hash = models.CharField(
+        max_length=64, null=True, blank=True, editable=False, db_index=True)
+    # the customer's version for conditional GETs, see api.conditional
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        # keep the digest in sync with the raw token
+        self.access_token_hash = hash_token(self.access_token)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'refresh_token' in update_fields:
+            self.refresh_token_hash = hash_token(self.refresh_token)
+        if update_fields is not None:
+            extra = {'updated_at'}
+            if 'access_token' in update_fields:
+                extra.add('access_token_hash')
+            if 'refresh_token' in update_fields:
+                extra.add('refresh_token_hash')
+            kwargs['update_fields'] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user.get_full_name()}"
 
 
 class Orders(models.Model):
+    # indexed through orders_customer_date_idx, which starts with customer_id
     customer = models.ForeignKey(
-        Customer, on_delete=models.CASCADE, related_name='orders')
+        Customer, on_delete=models.CASCADE, related_name='orders',
+        db_index=False)
     order_date = models.DateTimeField(auto_now_add=True)
     order_code = models.CharField(max_length=20, unique=True, blank=True)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # the order's version for conditional GETs, see api.conditional
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # serves per-customer listings and their (order_date, id) cursors;
+            # updated_at is included so a list's count and latest change are
+            # read from the index alone
+            models.Index(fields=['customer', 'order_date', 'id'],
+                         include=['updated_at'],
+                         name='orders_customer_date_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.order_code:
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        generated = not self.order_code
+        if generated:
             # generate a unique order code when order is created
             self.order_code = self.generate_order_code()
-        super().save(*args, **kwargs)
+        attempts = getattr(settings, 'ORDER_CODE_MAX_ATTEMPTS', 3)
+        for attempt in range(1, attempts + 1):
+            try:
+                # post_save handlers (e.g. the SMS outbox) write in the same
+                # transaction; a savepoint lets a code collision be retried
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if not (generated and attempt < attempts
+                        and self.code_taken(self.order_code)):
+                    raise
+                self.order_code = self.generate_order_code()
 
     def generate_order_code(self):
-        import uuid
-        return f"ORD-{uuid.uuid4().hex[:8].upper()}"
+        return order_codes.generate_order_code()
+
+    @classmethod
+    def code_taken(cls, *codes):
+        return (cls.objects.filter(order_code__in=codes).exists()
+                or OrderCode.objects.filter(code__in=codes).exists())
+
+
+class OrderCode(models.Model):
+    """
+    Every order code issued, with the order it went to.
+
+    The orders table is partitioned by month on PostgreSQL, where unique
+    indexes only apply within a partition, so a trigger inserts each new
+    code here and rejects codes already taken (see api.partitions). Codes
+    stay reserved after their order is deleted or archived.
+    """
+    code = models.CharField(max_length=20, primary_key=True)
+    order_id = models.BigIntegerField()
+
+    def __str__(self):
+        return self.code
+
+
+class OrderDailyRollup(models.Model):
+    """
+    Per-customer, per-day order totals, kept up to date by api.rollups as
+    orders are created, changed and deleted.
+    """
+    # indexed through order_rollup_customer_day
+    customer = models.ForeignKey(
+        Customer, on_delete=models.CASCADE, related_name='order_rollups',
+        db_index=False)
+    day = models.DateField()
+    order_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'day'],
+                                    name='order_rollup_customer_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} {self.day}: {self.order_count} orders"
+
+
+class SMSOutbox(models.Model):
+    """
+    SMS messages waiting to be delivered by the process_sms_outbox worker.
+
+    Rows are written in the same transaction as the record that triggers
+    them, so a message is queued if and only if that record is committed.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    # the gateway accepted the request without reporting on this recipient
+    UNKNOWN = 'unknown'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+        (UNKNOWN, 'Unknown'),
+    ]
+
+    # no database constraint: a foreign key cannot reference the
+    # partitioned orders table by id alone
+    order = models.ForeignKey(
+        Orders, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='sms_messages', db_constraint=False)
+    phone_number = models.CharField(max_length=15)
+    message = models.TextField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # when the row is next due; while SENDING it is the end of the worker's lease
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    provider_response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='sms_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"SMS to {self.phone_number} ({self.status})"
+
+
+class RevokedSession(models.Model):
+    """
+    A session token revoked before it expired: one token by ``jti``, or,
+    with ``jti`` empty, every token of ``user_id`` issued up to
+    ``revoked_at``. See api.session_tokens.
+    """
+    jti = models.CharField(max_length=32, blank=True)
+    # not a foreign key, revocations outlive deleted users
+    user_id = models.IntegerField()
+    revoked_at = models.DateTimeField(auto_now_add=True)
+    # the row is dropped once every token it covers has expired
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.jti or 'all sessions'}"
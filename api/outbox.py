@@ -0,0 +1,307 @@
+"""
+Transactional outbox for SMS notifications.
+
+Request handlers only insert SMSOutbox rows; the ``process_sms_outbox``
+management command claims due rows and talks to Africa's Talking, so a slow
+SMS gateway never holds up an API response.
+"""
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import circuit_breaker, utils
+from .models import SMSOutbox
+
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    # most recipients Africa's Talking accepts in one request
+    'MAX_RECIPIENTS': 100,
+    # seconds to wait for a partial batch to fill before sending it
+    'BATCH_WINDOW': 0.5,
+    'CONCURRENCY': 4,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 30,
+    'BACKOFF_MAX': 3600,
+    # how long a claimed row stays with a worker before others may retry it
+    'LEASE_SECONDS': 300,
+    'POLL_INTERVAL': 2,
+    # seconds to hold rows back while the gateway's circuit is open
+    'UNAVAILABLE_DELAY': 5,
+    # prefixed to local numbers when matching the gateway's answers
+    'COUNTRY_CODE': '254',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SMS_OUTBOX', {})}
+
+
+def enqueue_order_confirmation(order):
+    """Queue the confirmation SMS for a newly created order"""
+    customer = order.customer
+    return SMSOutbox.objects.create(
+        order=order,
+        phone_number=customer.phone_number,
+        message=utils.order_confirmation_message(customer, order),
+    )
+
+
+def enqueue_order_confirmations(orders):
+    """Queue confirmations for many new orders with a single insert"""
+    return SMSOutbox.objects.bulk_create([
+        SMSOutbox(
+            order=order,
+            phone_number=order.customer.phone_number,
+            message=utils.order_confirmation_message(order.customer, order),
+        )
+        for order in orders if order.customer.phone_number
+    ])
+
+
+def backoff_delay(attempts, config=None):
+    """Seconds to wait before retry number ``attempts``, with full jitter"""
+    config = config or get_config()
+    ceiling = min(config['BACKOFF_MAX'],
+                  config['BACKOFF_BASE'] * 2 ** max(attempts - 1, 0))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim_batch(limit, lease_seconds, rows=None):
+    """
+    Lock up to ``limit`` due rows and lease them to the caller.
+
+    SKIP LOCKED lets several workers drain the table without handing out the
+    same row twice; rows whose lease expired (worker crashed mid-send) become
+    due again. ``rows`` narrows the claim to a queryset of SMSOutbox.
+    """
+    now = timezone.now()
+    rows = SMSOutbox.objects.all() if rows is None else rows
+    with transaction.atomic():
+        ids = list(
+            rows.select_for_update(skip_locked=True)
+            .filter(status__in=[SMSOutbox.PENDING, SMSOutbox.SENDING],
+                    next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        SMSOutbox.objects.filter(id__in=ids).update(
+            status=SMSOutbox.SENDING,
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=lease_seconds),
+        )
+    return list(SMSOutbox.objects.filter(id__in=ids).order_by('id'))
+
+
+def e164(number, country_code):
+    """``number`` as +<country code><subscriber>, e.g. 0712 345678 -> +254712345678"""
+    digits = re.sub(r'\D', '', number or '')
+    if number.strip().startswith('+'):
+        return f'+{digits}'
+    if digits.startswith('00'):
+        return f'+{digits[2:]}'
+    if digits.startswith(country_code):
+        return f'+{digits}'
+    # a local number, with or without the trunk prefix
+    return f"+{country_code}{digits.removeprefix('0')}"
+
+
+def recipient_results(response, phone_numbers, config=None):
+    """
+    Map each phone number to (recipient entry, error) from a gateway response.
+
+    Africa's Talking returns one entry per recipient in
+    ``SMSMessageData.Recipients``, numbers in E.164 form. Error is None for
+    accepted recipients. A number missing from a request the gateway
+    accepted for others maps to (None, None): it may or may not have been
+    sent, see ``deliver_group``.
+    """
+    if not response:
+        return {number: (None, 'Empty response from SMS gateway')
+                for number in phone_numbers}
+    config = config or get_config()
+    data = response.get('SMSMessageData', {})
+    recipients = data.get('Recipients', [])
+    by_number = {e164(recipient.get('number') or '', config['COUNTRY_CODE']): recipient
+                 for recipient in recipients}
+    # a single recipient request may not echo the number back
+    if len(phone_numbers) == 1 and len(recipients) == 1:
+        by_number = {e164(phone_numbers[0], config['COUNTRY_CODE']): recipients[0]}
+
+    results = {}
+    for number in phone_numbers:
+        recipient = by_number.get(e164(number, config['COUNTRY_CODE']))
+        if recipient is None and recipients:
+            results[number] = (None, None)
+        elif recipient is None:
+            results[number] = (None, data.get('Message', 'No result for recipient'))
+        elif recipient.get('status') != 'Success':
+            results[number] = (recipient, f"Recipient status: {recipient.get('status')}")
+        else:
+            results[number] = (recipient, None)
+    return results
+
+
+def apply_result(entry, response=None, error=None, config=None):
+    """Set the delivery outcome on a claimed row without saving it"""
+    config = config or get_config()
+    entry.provider_response = response
+    if error is None and response is None:
+        # accepted, but not reported on: retrying could send it twice
+        entry.status = SMSOutbox.UNKNOWN
+        entry.last_error = 'No result for recipient in an accepted request'
+    elif error is None:
+        entry.status = SMSOutbox.SENT
+        entry.sent_at = timezone.now()
+        entry.last_error = ''
+    elif entry.attempts >= config['MAX_ATTEMPTS']:
+        entry.status = SMSOutbox.FAILED
+        entry.last_error = error
+    else:
+        entry.status = SMSOutbox.PENDING
+        entry.last_error = error
+        entry.next_attempt_at = timezone.now() + timedelta(
+            seconds=backoff_delay(entry.attempts, config))
+
+
+RESULT_FIELDS = ['status', 'sent_at', 'last_error', 'next_attempt_at',
+                 'provider_response']
+
+
+def group_by_message(batch, max_recipients):
+    """
+    Split claimed rows into sendable groups.
+
+    Rows with an identical body share one gateway request of at most
+    ``max_recipients`` distinct numbers. A number appears once per request,
+    so rows for different orders to the same number go out in separate
+    requests and the customer gets each confirmation; only rows queued
+    twice for the same order are sent once.
+    """
+    groups = {}
+    for entry in batch:
+        groups.setdefault(entry.message, []).append(entry)
+
+    for entries in groups.values():
+        # per chunk: the rows, and the order each number is being sent for
+        chunks = []
+        for entry in entries:
+            order = entry.order_id if entry.order_id is not None else id(entry)
+            for chunk, orders in chunks:
+                if orders.get(entry.phone_number, order) == order and (
+                        entry.phone_number in orders or len(orders) < max_recipients):
+                    break
+            else:
+                chunk, orders = [], {}
+                chunks.append((chunk, orders))
+            chunk.append(entry)
+            orders[entry.phone_number] = order
+        for chunk, _ in chunks:
+            yield chunk
+
+
+def deliver_group(entries, config=None):
+    """
+    Send one message to every row in ``entries`` and record each outcome.
+
+    Returns the number of rows per outcome: sent, failed and unknown, the
+    ones the gateway accepted the request for but didn't report on. Those
+    are not retried.
+    """
+    config = config or get_config()
+    message = entries[0].message
+    numbers = list(dict.fromkeys(entry.phone_number for entry in entries))
+    try:
+        if len(numbers) == 1:
+            response = utils.send_sms(numbers[0], message, raise_errors=True)
+        else:
+            response = utils.send_bulk_sms(numbers, message, raise_errors=True)
+        results = recipient_results(response, numbers, config)
+    except circuit_breaker.Unavailable as e:
+        defer(entries, f"{type(e).__name__}: {e}", config)
+        return {'sent': 0, 'failed': len(entries), 'unknown': 0}
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        results = {number: (None, error) for number in numbers}
+
+    for entry in entries:
+        recipient, error = results[entry.phone_number]
+        apply_result(entry, recipient, error, config)
+    SMSOutbox.objects.bulk_update(entries, RESULT_FIELDS)
+    sent = sum(1 for entry in entries if entry.status == SMSOutbox.SENT)
+    unknown = sum(1 for entry in entries if entry.status == SMSOutbox.UNKNOWN)
+    return {'sent': sent, 'failed': len(entries) - sent - unknown, 'unknown': unknown}
+
+
+def defer(entries, error, config=None):
+    """Put back rows that were refused without a request, keeping their attempt"""
+    config = config or get_config()
+    next_attempt_at = timezone.now() + timedelta(seconds=config['UNAVAILABLE_DELAY'])
+    for entry in entries:
+        entry.status = SMSOutbox.PENDING
+        entry.attempts -= 1
+        entry.last_error = error
+        entry.next_attempt_at = next_attempt_at
+    SMSOutbox.objects.bulk_update(entries, [*RESULT_FIELDS, 'attempts'])
+
+
+def _deliver_in_thread(entries, config):
+    try:
+        return deliver_group(entries, config)
+    finally:
+        close_old_connections()
+
+
+def collect_batch(batch_size, config, rows=None):
+    """
+    Claim up to ``batch_size`` rows, waiting at most BATCH_WINDOW seconds for
+    the batch to fill so that bursts of orders share bulk requests.
+    """
+    batch = claim_batch(batch_size, config['LEASE_SECONDS'], rows)
+    if not batch:
+        return batch
+    deadline = time.monotonic() + config['BATCH_WINDOW']
+    while len(batch) < batch_size and time.monotonic() < deadline:
+        time.sleep(min(0.05, config['BATCH_WINDOW']))
+        batch += claim_batch(batch_size - len(batch), config['LEASE_SECONDS'], rows)
+    return batch
+
+
+def drain(concurrency=None, batch_size=None, config=None, rows=None):
+    """
+    Deliver due messages, only those in the ``rows`` queryset if given,
+    until none are left.
+
+    Returns a dict with the number of messages sent, failed attempts,
+    messages with an unknown outcome and gateway requests made.
+    """
+    config = config or get_config()
+    concurrency = concurrency or config['CONCURRENCY']
+    batch_size = batch_size or config['BATCH_SIZE']
+    totals = {'sent': 0, 'failed': 0, 'unknown': 0, 'requests': 0}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            batch = collect_batch(batch_size, config, rows)
+            if not batch:
+                break
+            groups = list(group_by_message(batch, config['MAX_RECIPIENTS']))
+            if concurrency == 1:
+                results = [deliver_group(entries, config) for entries in groups]
+            else:
+                results = executor.map(
+                    lambda entries: _deliver_in_thread(entries, config), groups)
+            for outcomes in results:
+                for outcome, count in outcomes.items():
+                    totals[outcome] += count
+            totals['requests'] += len(groups)
+    return totals
@@ -0,0 +1,268 @@
+"""
+Monthly range partitions of the orders table on PostgreSQL.
+
+Migration 0007 partitions ``api_orders`` by ``order_date``. Each calendar
+month (UTC) gets its own partition, named like ``api_orders_y2025m01``, and
+``api_orders_default`` takes rows that no month covers yet. Listings,
+summaries and inserts only touch the months they need, and each month's
+indexes stay small whatever the size of the history.
+
+``ensure_partitions`` creates the partitions from the current month to
+``ORDER_PARTITIONS['MONTHS_AHEAD']`` months ahead. It runs after every
+``migrate`` and from ``manage.py order_partitions ensure``, which should
+also run daily. Rows that did land in the default partition are moved
+into their month when its partition is created.
+
+``manage.py order_partitions archive --before 2024-01`` detaches old
+months, writes each to ``ARCHIVE_DIR`` as a gzipped CSV and drops it.
+``restore`` loads such a file back as an attached partition, so those
+orders are served by the API again.
+
+Unique indexes on a partitioned table only apply within each partition,
+so ``order_code`` is kept unique by the OrderCode registry, filled by the
+``api_orders_reserve_code`` trigger.
+"""
+import csv
+import gzip
+import os
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Orders, SMSOutbox
+
+
+DEFAULTS = {
+    'MONTHS_AHEAD': 3,
+    'ARCHIVE_DIR': 'order_archive',
+}
+
+TABLE = Orders._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+COPY_BLOCK = 1 << 20
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ORDER_PARTITIONS', {})}
+
+
+def month_of(value):
+    """First day of the UTC month containing a date or datetime"""
+    if isinstance(value, datetime):
+        value = value.astimezone(dt_timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(text):
+    """``'2025-01'`` as ``date(2025, 1, 1)``"""
+    return datetime.strptime(text, '%Y-%m').date()
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year}m{month.month:02d}'
+
+
+def bounds(month):
+    """The [start, end) order_date range of a month's partition"""
+    end = add_months(month, 1)
+    return (datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc),
+            datetime(end.year, end.month, 1, tzinfo=dt_timezone.utc))
+
+
+def is_partitioned(using='default'):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def attached_partitions(using='default'):
+    """{month: estimated row count} of the attached monthly partitions"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname, c.reltuples FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass', [TABLE])
+        rows = cursor.fetchall()
+    months = {}
+    for name, estimate in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            # reltuples is -1 until the partition is first analyzed
+            months[date(int(match[1]), int(match[2]), 1)] = max(int(estimate), 0)
+    return months
+
+
+def lock(cursor):
+    """Serialize partition changes until the end of the transaction"""
+    cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [TABLE])
+
+
+def attach_month(cursor, month, fill=None):
+    """
+    Create ``month``'s partition, let ``fill(cursor, name)`` load it, move
+    the month's rows out of the default partition and attach it.
+
+    Returns the number of rows moved from the default partition.
+    """
+    name = partition_name(month)
+    start, end = bounds(month)
+    cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)')
+    if fill is not None:
+        fill(cursor, name)
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        f'WHERE order_date >= %s AND order_date < %s RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved', [start, end])
+    moved = cursor.rowcount
+    # bounds are generated above, never user input
+    cursor.execute(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+    return moved
+
+
+def create_partition(month, using='default'):
+    """Create and attach ``month``'s partition unless it exists"""
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        lock(cursor)
+        cursor.execute('SELECT to_regclass(%s)', [partition_name(month)])
+        if cursor.fetchone()[0] is not None:
+            return False
+        attach_month(cursor, month)
+    return True
+
+
+def ensure_partitions(months_ahead=None, using='default'):
+    """
+    Create the missing partitions from the current month to
+    ``months_ahead`` months ahead, and for any month with rows parked in
+    the default partition. Returns the months created.
+    """
+    if not is_partitioned(using):
+        return []
+    if months_ahead is None:
+        months_ahead = get_config()['MONTHS_AHEAD']
+
+    current = month_of(timezone.now())
+    wanted = {add_months(current, offset) for offset in range(months_ahead + 1)}
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', order_date AT TIME ZONE 'UTC')::date "
+            f"FROM {DEFAULT_PARTITION}")
+        wanted.update(month for (month,) in cursor.fetchall())
+
+    missing = sorted(wanted - set(attached_partitions(using)))
+    return [month for month in missing if create_partition(month, using)]
+
+
+def ensure_after_migrate(sender, using='default', **kwargs):
+    """post_migrate receiver, so every deploy leaves the coming months ready"""
+    ensure_partitions(using=using)
+
+
+def archive_path(month, directory=None):
+    directory = directory or get_config()['ARCHIVE_DIR']
+    return os.path.join(directory, f'{partition_name(month)}.csv.gz')
+
+
+def copy_out(cursor, sql, stream):
+    raw = cursor.cursor
+    if hasattr(raw, 'copy_expert'):
+        # psycopg2
+        raw.copy_expert(sql, stream)
+        return
+    with raw.copy(sql) as copy:
+        for block in copy:
+            stream.write(block)
+
+
+def copy_in(cursor, sql, stream):
+    raw = cursor.cursor
+    if hasattr(raw, 'copy_expert'):
+        raw.copy_expert(sql, stream)
+        return
+    with raw.copy(sql) as copy:
+        while block := stream.read(COPY_BLOCK):
+            copy.write(block)
+
+
+def archive_partition(month, directory=None, using='default'):
+    """
+    Detach a past month's partition, write it to ``<ARCHIVE_DIR>/<name>.csv.gz``
+    and drop it. Returns the number of orders archived.
+    """
+    if month >= month_of(timezone.now()):
+        raise ValueError(f'{month:%Y-%m} is not a past month')
+    if month not in attached_partitions(using):
+        raise ValueError(f'{month:%Y-%m} has no attached partition')
+
+    name = partition_name(month)
+    path = archive_path(month, directory)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        with transaction.atomic(using), connections[using].cursor() as cursor:
+            lock(cursor)
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            cursor.execute(f'SELECT count(*) FROM {name}')
+            (count,) = cursor.fetchone()
+            with gzip.open(f'{path}.tmp', 'wb') as stream:
+                copy_out(cursor, f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', stream)
+            # SMSOutbox.order has no database constraint to clear these
+            cursor.execute(
+                f'UPDATE {SMSOutbox._meta.db_table} SET order_id = NULL '
+                f'WHERE order_id IN (SELECT id FROM {name})')
+            cursor.execute(f'DROP TABLE {name}')
+            os.replace(f'{path}.tmp', path)
+    finally:
+        if os.path.exists(f'{path}.tmp'):
+            os.unlink(f'{path}.tmp')
+    return count
+
+
+def restore_partition(month, directory=None, using='default'):
+    """Load an archived month back as an attached partition, return its order count"""
+    path = archive_path(month, directory)
+    if month in attached_partitions(using):
+        raise ValueError(f'{month:%Y-%m} is already attached')
+    if not os.path.exists(path):
+        raise ValueError(f'No archive for {month:%Y-%m} at {path}')
+    quote_name = connections[using].ops.quote_name
+
+    def fill(cursor, name):
+        with gzip.open(path, 'rb') as stream:
+            # by name, so archives survive columns added since
+            header = next(csv.reader([stream.readline().decode()]))
+            columns = ', '.join(quote_name(column) for column in header)
+            copy_in(cursor, f'COPY {name} ({columns}) FROM STDIN WITH (FORMAT csv)', stream)
+
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        lock(cursor)
+        attach_month(cursor, month, fill)
+        cursor.execute(f'SELECT count(*) FROM {partition_name(month)}')
+        return cursor.fetchone()[0]
+
+
+def archived_months(directory=None):
+    directory = directory or get_config()['ARCHIVE_DIR']
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for filename in os.listdir(directory):
+        match = PARTITION_NAME.match(filename.removesuffix('.csv.gz'))
+        if match and filename.endswith('.csv.gz'):
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
@@ -0,0 +1,68 @@
+"""
+Incrementally maintained order totals per customer and day.
+
+Every change to an order applies a (count, amount) delta to its
+OrderDailyRollup row in the same transaction, so the summary endpoint can
+read a handful of small rows instead of scanning the customer's orders.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OrderDailyRollup
+
+
+def rollup_day(order_date):
+    return timezone.localdate(order_date)
+
+
+def apply_delta(customer_id, day, count, amount):
+    """Atomically add ``count`` orders worth ``amount`` to one rollup row"""
+    updated = OrderDailyRollup.objects.filter(customer_id=customer_id, day=day).update(
+        order_count=F('order_count') + count,
+        total_amount=F('total_amount') + amount,
+    )
+    # removals never create rows: when a customer is deleted its rollups
+    # may already be gone by the time the orders' post_delete fires
+    if updated or count < 0:
+        return
+    try:
+        with transaction.atomic():
+            OrderDailyRollup.objects.create(
+                customer_id=customer_id, day=day,
+                order_count=count, total_amount=amount)
+    except IntegrityError:
+        # another transaction created the row first
+        OrderDailyRollup.objects.filter(customer_id=customer_id, day=day).update(
+            order_count=F('order_count') + count,
+            total_amount=F('total_amount') + amount,
+        )
+
+
+def record_orders(orders, sign=1):
+    """Add (or with ``sign=-1`` remove) orders from their rollup rows"""
+    deltas = defaultdict(lambda: [0, 0])
+    for order in orders:
+        delta = deltas[(order.customer_id, rollup_day(order.order_date))]
+        delta[0] += sign
+        delta[1] += sign * Decimal(str(order.total_amount))
+    # a fixed order keeps concurrent writers from deadlocking on row locks
+    for (customer_id, day), (count, amount) in sorted(deltas.items()):
+        apply_delta(customer_id, day, count, amount)
+
+
+def move_order(previous, order):
+    """
+    Re-file an updated order. ``previous`` is the (customer_id, order_date,
+    total_amount) it had before the update.
+    """
+    customer_id, order_date, total_amount = previous
+    current = (order.customer_id, order.order_date, Decimal(str(order.total_amount)))
+    if (customer_id, rollup_day(order_date), total_amount) == (
+            current[0], rollup_day(current[1]), current[2]):
+        return
+    apply_delta(customer_id, rollup_day(order_date), -1, -total_amount)
+    apply_delta(current[0], rollup_day(current[1]), 1, current[2])
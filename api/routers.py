@@ -0,0 +1,134 @@
+"""
+Read-replica routing.
+
+Reads go to one of ``settings.REPLICA_DATABASES`` only while serving a safe
+(GET/HEAD/OPTIONS) request that ReplicaRoutingMiddleware has cleared for
+replica reads. A request picks one replica and sends all its reads there, so
+replicas lagging by different amounts can't show it inconsistent rows.
+Everything else, including management commands and the SMS worker, uses the
+primary. Once a request writes, the rest of it reads from
+the primary and the client gets a cookie that pins its reads to the primary
+for ``REPLICA_PIN_SECONDS``, so a new order or phone number is visible on
+the very next request despite replication lag.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = DEFAULT_DB_ALIAS
+PIN_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingState:
+    def __init__(self, replica_reads):
+        self.replica_reads = replica_reads
+        self.wrote = False
+        # picked on the first replica read
+        self.replica = None
+
+    def pick_replica(self):
+        if self.replica not in replica_aliases():
+            self.replica = random.choice(replica_aliases())
+        return self.replica
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def reads_from_replica():
+    """True when reads in the current context may be sent to a replica"""
+    state = _state.get()
+    return bool(
+        state is not None and state.replica_reads and not state.wrote
+        and replica_aliases()
+        and not connections[PRIMARY].in_atomic_block)
+
+
+@contextmanager
+def routing(replica_reads):
+    token = _state.set(RoutingState(replica_reads))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if reads_from_replica():
+            return _state.get().pick_replica()
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        aliases = {PRIMARY, *replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets safe requests read from replicas unless the client wrote recently.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not replica_aliases():
+            return self.get_response(request)
+
+        with routing(self.replica_reads_allowed(request)) as state:
+            response = self.get_response(request)
+        return self.pin_if_written(state, response)
+
+    async def __acall__(self, request):
+        if not replica_aliases():
+            return await self.get_response(request)
+
+        # sync_to_async copies the context, so ORM calls made in worker
+        # threads still see (and flag writes on) this request's state
+        with routing(self.replica_reads_allowed(request)) as state:
+            response = await self.get_response(request)
+        return self.pin_if_written(state, response)
+
+    def pin_if_written(self, state, response):
+        if state.wrote:
+            pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time() + pin_seconds)),
+                max_age=pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def replica_reads_allowed(self, request):
+        if request.method not in SAFE_METHODS:
+            return False
+        try:
+            pinned_until = int(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        return pinned_until <= time.time()
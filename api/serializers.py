@@ -1,8 +1,34 @@
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from .models import Customer, Orders
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Let GET clients pick the returned fields with ``?fields=a,b``.
+
+    Only applies to the top-level serializer of the response, so nested
+    serializers keep their full shape.
+    """
+    fields_query_param = 'fields'
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return fields
+        if self.root is not self and self.root is not self.parent:
+            return fields
+
+        requested = request.query_params.get(self.fields_query_param)
+        if not requested:
+            return fields
+        wanted = {name.strip() for name in requested.split(',')}
+        return {name: field for name, field in fields.items() if name in wanted}
+
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Orders
         fields = ['id', 'customer', 'order_date', 'order_code', 'total_amount']
@@ -13,10 +39,77 @@ class OrderSerializer(serializers.ModelSerializer):
 
 
 class CustomerSerializer(serializers.ModelSerializer):
-    orders = OrderSerializer(many=True, read_only=True)
+    """
+    A customer with a bounded view of their orders.
+
+    Only the most recent ``RECENT_ORDERS`` orders are embedded, alongside the
+    total count and a link to the paginated orders endpoint, so the payload
+    does not grow with the order history.
+    """
+    RECENT_ORDERS = 5
+
+    recent_orders = serializers.SerializerMethodField()
+    order_count = serializers.SerializerMethodField()
+    orders_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Customer
         fields = ['id', 'user', 'phone_number',
-                  'access_token', 'refresh_token', 'orders']
+                  'access_token', 'refresh_token',
+                  'recent_orders', 'order_count', 'orders_url']
         read_only_fields = ['access_token', 'refresh_token']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """Load the order count and recent orders for many customers in two queries"""
+        recent = Orders.objects.order_by('-order_date', '-id')[:cls.RECENT_ORDERS]
+        return queryset.annotate(order_total=Count('orders')).prefetch_related(
+            Prefetch('orders', queryset=recent, to_attr='recent_order_list'))
+
+    def get_recent_orders(self, instance):
+        orders = getattr(instance, 'recent_order_list', None)
+        if orders is None:
+            orders = instance.orders.order_by(
+                '-order_date', '-id')[:self.RECENT_ORDERS]
+        serializer = OrderSerializer(orders, many=True, context=self.context)
+        # bound as a nested field so ?fields= on this endpoint leaves it alone
+        serializer.bind(field_name='recent_orders', parent=self)
+        return serializer.data
+
+    def get_order_count(self, instance):
+        count = getattr(instance, 'order_total', None)
+        return instance.orders.count() if count is None else count
+
+    def get_orders_url(self, instance):
+        return reverse('order-list', request=self.context.get('request'))
+
+
+class OrderSummaryQuerySerializer(serializers.Serializer):
+    """Query parameters accepted by /api/orders/summary/"""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    bucket = serializers.ChoiceField(choices=['day', 'month'], default='day')
+    source = serializers.ChoiceField(choices=['live', 'rollup'], required=False)
+
+    def validate(self, attrs):
+        start, end = attrs.get('start'), attrs.get('end')
+        if start and end and start > end:
+            raise serializers.ValidationError({"end": "end must not be before start"})
+        return attrs
+
+
+class OrderSummaryBucketSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    count = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class OrderSummarySerializer(serializers.Serializer):
+    start = serializers.DateField(allow_null=True)
+    end = serializers.DateField(allow_null=True)
+    bucket = serializers.CharField()
+    source = serializers.CharField()
+    count = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    average = serializers.DecimalField(max_digits=14, decimal_places=2)
+    buckets = OrderSummaryBucketSerializer(many=True)
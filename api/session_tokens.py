@@ -0,0 +1,224 @@
+"""
+Signed session tokens, verified without a database query.
+
+With ``SESSION_TOKENS['ENABLED']`` the OAuth callback and the refresh view
+no longer put Google's access token in the ``access_token`` cookie (or in
+the database). Instead they mint a short-lived HS256 JWT of our own that
+carries the user id (``sub``) and customer id (``cid``).
+CookieAuthentication checks its signature and expiry in memory and builds
+the user and customer from those ids with every other field deferred.
+Views that read more than ids load the rows themselves (see
+``views.get_request_customer``).
+
+Keys are named: ``KEYS`` maps a key id to a secret, and tokens carry the
+id of the key that signed them in their ``kid`` header. To rotate:
+
+1. add the new key to ``KEYS`` on every node, still signing with the old;
+2. set ``SIGNING_KEY`` to the new key id;
+3. after ``LIFETIME`` seconds, remove the old key.
+
+Without ``KEYS`` a single key derived from ``SECRET_KEY`` is used.
+
+A token can be revoked before it expires, by its ``jti`` or along with
+every token of its user issued until now (``manage.py revoke_sessions``).
+Revocations are RevokedSession rows; each process keeps them in memory and
+reloads them every ``REVOCATION_REFRESH`` seconds. That is one query per
+process per interval instead of one per request, and revocations take up
+to that long to reach other processes. Rows are purged once the tokens
+they cover have expired, so the list stays small.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .auth_cache import auth_cache
+from .models import Customer, RevokedSession
+from .single_flight import token_refreshes
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    # key id -> secret; empty means one key derived from SECRET_KEY
+    'KEYS': {},
+    # key id new tokens are signed with, the first of KEYS by default
+    'SIGNING_KEY': None,
+    'LIFETIME': 900,
+    'LEEWAY': 10,
+    'ISSUER': 'sil-api',
+    'REVOCATION_REFRESH': 10,
+}
+
+ALGORITHM = 'HS256'
+DERIVED_KEY_ID = 'default'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SESSION_TOKENS', {})}
+
+
+def enabled():
+    return get_config()['ENABLED']
+
+
+def get_keys(config=None):
+    config = config or get_config()
+    if config['KEYS']:
+        return dict(config['KEYS'])
+    derived = hashlib.sha256(f'session-tokens:{settings.SECRET_KEY}'.encode()).hexdigest()
+    return {DERIVED_KEY_ID: derived}
+
+
+def looks_like_session_token(token):
+    """A JWT has three dot-separated parts; Google's access tokens don't"""
+    return token.count('.') == 2
+
+
+class InvalidSessionToken(Exception):
+    pass
+
+
+def mint(customer, config=None):
+    """A signed session token for ``customer``, return (token, claims)"""
+    config = config or get_config()
+    keys = get_keys(config)
+    kid = config['SIGNING_KEY'] or next(iter(keys))
+    # a fractional iat, so revoking a user's sessions covers exactly the
+    # tokens minted before it
+    now = time.time()
+    claims = {
+        'iss': config['ISSUER'],
+        'sub': str(customer.user_id),
+        'cid': customer.pk,
+        'iat': now,
+        'exp': int(now) + config['LIFETIME'],
+        'jti': uuid.uuid4().hex,
+    }
+    token = jwt.encode(claims, keys[kid], algorithm=ALGORITHM, headers={'kid': kid})
+    return token, claims
+
+
+def verify(token, config=None):
+    """The claims of a valid, unrevoked session token; raises InvalidSessionToken"""
+    config = config or get_config()
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = get_keys(config).get(kid)
+        if key is None:
+            raise InvalidSessionToken('Unknown signing key')
+        claims = jwt.decode(
+            token, key, algorithms=[ALGORITHM], issuer=config['ISSUER'],
+            leeway=config['LEEWAY'],
+            options={'require': ['exp', 'iat', 'sub', 'cid', 'jti']})
+    except jwt.InvalidTokenError as e:
+        raise InvalidSessionToken(str(e))
+    if revocations.is_revoked(claims, config):
+        raise InvalidSessionToken('Session revoked')
+    return claims
+
+
+def principal(claims):
+    """
+    The (user, customer) a session token stands for, built from its ids
+    alone. Any other field is loaded from the database on first access.
+    """
+    user = User.from_db(None, ['id'], [int(claims['sub'])])
+    customer = Customer.from_db(None, ['id', 'user_id'], [claims['cid'], user.pk])
+    # also caches customer as user.customer
+    customer.user = user
+    return user, customer
+
+
+def is_session(auth):
+    """Whether ``request.auth`` comes from a session token"""
+    return isinstance(auth, dict) and 'cid' in auth
+
+
+class RevocationList:
+    """The unexpired RevokedSession rows, reloaded every REVOCATION_REFRESH seconds"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._tokens = set()
+        self._users = {}
+
+    def is_revoked(self, claims, config=None):
+        config = config or get_config()
+        self._refresh(config)
+        if claims['jti'] in self._tokens:
+            return True
+        revoked_at = self._users.get(int(claims['sub']))
+        return revoked_at is not None and claims['iat'] <= revoked_at
+
+    def _refresh(self, config):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < config['REVOCATION_REFRESH']:
+            return
+        with self._lock:
+            if self._loaded_at is not None and now - self._loaded_at < config['REVOCATION_REFRESH']:
+                return
+            tokens, users = set(), {}
+            rows = RevokedSession.objects.filter(
+                expires_at__gt=timezone.now()).values_list(
+                    'jti', 'user_id', 'revoked_at')
+            for jti, user_id, revoked_at in rows:
+                if jti:
+                    tokens.add(jti)
+                else:
+                    users[user_id] = max(users.get(user_id, 0), revoked_at.timestamp())
+            self._tokens, self._users, self._loaded_at = tokens, users, now
+
+    def clear(self):
+        """Forget the loaded list, so the next check reloads it"""
+        with self._lock:
+            self._loaded_at = None
+
+
+revocations = RevocationList()
+
+
+def revoke(claims, config=None):
+    """Revoke one session token, given its claims"""
+    config = config or get_config()
+    expires_at = datetime.fromtimestamp(claims['exp'] + config['LEEWAY'], dt_timezone.utc)
+    RevokedSession.objects.create(
+        jti=claims['jti'], user_id=int(claims['sub']), expires_at=expires_at)
+    _purge()
+    revocations.clear()
+
+
+def revoke_user(user_id, config=None):
+    """
+    Revoke every session token of a user issued until now, and the Google
+    tokens stored on their customer: the refresh cookie would otherwise
+    mint them a new session token at once.
+    """
+    config = config or get_config()
+    expires_at = timezone.now() + timedelta(
+        seconds=config['LIFETIME'] + config['LEEWAY'])
+    digests = None
+    with transaction.atomic():
+        RevokedSession.objects.create(user_id=user_id, expires_at=expires_at)
+        customer = Customer.objects.select_for_update().filter(user_id=user_id).first()
+        if customer is not None:
+            digests = customer.access_token_hash, customer.refresh_token_hash
+            customer.access_token = customer.refresh_token = None
+            customer.save(update_fields=['access_token', 'refresh_token'])
+    if digests is not None:
+        # the save's signals only see the cleared tokens
+        auth_cache.invalidate_digest(digests[0])
+        token_refreshes.forget(digests[1])
+    _purge()
+    revocations.clear()
+
+
+def _purge():
+    RevokedSession.objects.filter(expires_at__lte=timezone.now()).delete()
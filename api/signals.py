@@ -1,10 +1,59 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Orders
-from .utils import send_order_confirmation_sms
+from . import instrumentation, rollups
+from .auth_cache import auth_cache
+from .models import Customer, Orders
+from .outbox import enqueue_order_confirmation
+from .single_flight import token_refreshes
 
 @receiver(post_save, sender=Orders)
-def send_confirmation_on_order_create(sender, instance, created, **kwargs):
-    """Send confirmation SMS when a new order is created"""
-    if created and instance.customer.phone_number:  
-        send_order_confirmation_sms(instance.customer, instance)
\ No newline at end of file
+def queue_confirmation_on_order_create(sender, instance, created, **kwargs):
+    """Queue the confirmation SMS in the order's transaction; a worker sends it"""
+    if created and instance.customer.phone_number:
+        enqueue_order_confirmation(instance)
+
+
+@receiver(pre_save, sender=Orders)
+def remember_rollup_state(sender, instance, **kwargs):
+    """Keep the stored values of an order being updated for its rollup"""
+    if not instance._state.adding:
+        instance._rollup_previous = Orders.objects.filter(pk=instance.pk).values_list(
+            'customer_id', 'order_date', 'total_amount').first()
+
+
+@receiver(post_save, sender=Orders)
+def update_rollup_on_order_save(sender, instance, created, **kwargs):
+    """Apply the order to the daily rollup in the order's transaction"""
+    if created:
+        rollups.record_orders([instance])
+    elif getattr(instance, '_rollup_previous', None):
+        rollups.move_order(instance._rollup_previous, instance)
+
+
+@receiver(post_delete, sender=Orders)
+def update_rollup_on_order_delete(sender, instance, **kwargs):
+    rollups.record_orders([instance], sign=-1)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_customer(sender, instance, **kwargs):
+    """Drop the cached auth entry so the next request sees the saved customer"""
+    digest = instance.access_token_hash
+    auth_cache.invalidate_digest(digest)
+    # a concurrent request may re-cache the old row before we commit
+    transaction.on_commit(lambda: auth_cache.invalidate_digest(digest))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def forget_refresh_result(sender, instance, **kwargs):
+    """A refresh kept for the grace window must not outlive the customer's tokens"""
+    if 'refresh_token_hash' not in instance.get_deferred_fields():
+        token_refreshes.forget(instance.refresh_token_hash)
+
+
+# counts each request's queries when INSTRUMENTATION is enabled
+connection_created.connect(instrumentation.install_query_recorder)
@@ -0,0 +1,158 @@
+"""
+Coalesce concurrent calls doing the same work into one.
+
+``SingleFlight.run(key, fn)`` awaits ``fn()`` once per key at a time:
+
+* within a process, callers arriving while a call for their key is in
+  flight wait for its result instead of starting their own. Flights are
+  ``concurrent.futures`` futures, so callers in other threads and event
+  loops (each WSGI request runs its own) join them too;
+* with ``SINGLE_FLIGHT['CACHE']`` set to a Django cache shared by the
+  workers, the leaders of each process also take a lock in that cache
+  (``add``), and the processes that don't get it poll for the winner's
+  result. A lock whose holder died expires after ``LOCK_TIMEOUT`` seconds,
+  then the pollers do the work themselves.
+
+Results ``keep`` accepts are reused for ``GRACE`` seconds, so callers
+arriving just after a flight landed don't start another. ``forget`` drops
+a kept result once it is stale. Results must be picklable to be shared.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+DEFAULTS = {
+    # alias of a Django cache shared by the workers, None for per process
+    'CACHE': None,
+    # seconds a finished flight's result is reused
+    'GRACE': 10,
+    'LOCK_TIMEOUT': 15,
+    'POLL_INTERVAL': 0.05,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SINGLE_FLIGHT', {})}
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._results = {}
+        self._led = metrics.SINGLE_FLIGHT.labels(name, 'led')
+        self._joined = metrics.SINGLE_FLIGHT.labels(name, 'joined')
+        self._reused = metrics.SINGLE_FLIGHT.labels(name, 'reused')
+        self._shared_hits = metrics.SINGLE_FLIGHT.labels(name, 'shared')
+
+    def _shared(self, config):
+        alias = config['CACHE']
+        return caches[alias] if alias else None
+
+    def _key(self, key, suffix):
+        return f'flight:{self.name}:{key}:{suffix}'
+
+    def _kept(self, key):
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                return entry
+            del self._results[key]
+            return None
+
+    def _keep_local(self, config, key, value):
+        with self._lock:
+            self._results[key] = (time.monotonic() + config['GRACE'], value)
+
+    async def run(self, key, fn, keep=None):
+        """The result of ``fn()``, shared with every concurrent caller for ``key``"""
+        config = get_config()
+        keep = keep or (lambda value: True)
+        kept = self._kept(key)
+        if kept is not None:
+            self._reused.inc()
+            return kept[1]
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = concurrent.futures.Future()
+        if not leader:
+            self._joined.inc()
+            return await asyncio.wrap_future(future)
+
+        try:
+            value = await self._lead(config, key, fn, keep)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+        return value
+
+    async def _lead(self, config, key, fn, keep):
+        shared = self._shared(config)
+        if shared is None:
+            self._led.inc()
+            value = await fn()
+            if keep(value):
+                self._keep_local(config, key, value)
+            return value
+
+        result_key, lock_key = self._key(key, 'result'), self._key(key, 'lock')
+        deadline = time.monotonic() + config['LOCK_TIMEOUT']
+        while True:
+            stored = await shared.aget(result_key)
+            if stored is not None:
+                self._shared_hits.inc()
+                self._keep_local(config, key, stored)
+                return stored
+            locked = await shared.aadd(lock_key, 1, timeout=config['LOCK_TIMEOUT'])
+            # past the deadline the holder is presumed dead
+            if locked or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(config['POLL_INTERVAL'])
+
+        self._led.inc()
+        try:
+            value = await fn()
+            if keep(value):
+                self._keep_local(config, key, value)
+                await shared.aset(result_key, value, timeout=config['GRACE'])
+            return value
+        finally:
+            if locked:
+                await shared.adelete(lock_key)
+
+    def forget(self, key):
+        """Drop the kept result for ``key``, in this process and the shared cache"""
+        if not key:
+            return
+        with self._lock:
+            self._results.pop(key, None)
+        shared = self._shared(get_config())
+        if shared is not None:
+            shared.delete(self._key(key, 'result'))
+
+    def clear(self):
+        """Forget every result kept in this process"""
+        with self._lock:
+            self._results.clear()
+
+
+# Google refreshes, keyed by the refresh token's digest
+token_refreshes = SingleFlight('refresh_token')
@@ -1,14 +1,22 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework.test import APITestCase, APIClient
 from django.urls import reverse
 from rest_framework import status
 from django.contrib.auth.models import User
 from unittest.mock import patch, MagicMock
+import datetime
 import json
 import pytest
 
-from .models import Customer, Orders
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Customer, Orders, SMSOutbox
 from .serializers import CustomerSerializer, OrderSerializer
+from .throttling import UserRateThrottle
+from .utils import send_bulk_sms
+from . import metrics, session_tokens
 
 
 @pytest.mark.integration
@@ -90,10 +98,10 @@ class APIEndToEndTests(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
         # Verify order details
-        order_amounts = [order['total_amount'] for order in response.data]
+        order_amounts = [order['total_amount'] for order in response.data['results']]
         self.assertIn('1000.00', order_amounts)
         self.assertIn('2000.00', order_amounts)
 
@@ -102,11 +110,8 @@ class APIEndToEndTests(APITestCase):
         url = reverse('order-list')
         data = {'total_amount': '3000.00'}  # String, not float
 
-        # Patch both SMS utilities to prevent actual SMS sending
-        # UPDATED: Use the correct signal path from api.signals module
-        with patch('api.signals.send_order_confirmation_sms') as mock_sms, \
-             patch('api.utils.send_sms') as mock_base_sms:
-            mock_sms.return_value = True  # Simulate successful SMS sending
+        # The SMS is only queued during the request, a worker sends it later
+        with patch('api.utils.send_sms') as mock_base_sms:
             mock_base_sms.return_value = {'SMSMessageData': {
                 'Recipients': [{'status': 'Success'}]}}
 
@@ -120,20 +125,19 @@ class APIEndToEndTests(APITestCase):
             self.assertEqual(response.data['total_amount'], '3000.00')
             self.assertTrue(Orders.objects.filter(total_amount=3000.00).exists())
             
-            # Verify SMS was called
-            self.assertTrue(mock_sms.called)
+            # Verify the notification was queued, not sent in the request
+            self.assertTrue(SMSOutbox.objects.filter(
+                order_id=response.data['id'], status=SMSOutbox.PENDING).exists())
+            self.assertFalse(mock_base_sms.called)
 
     def test_order_confirmation_sms(self):
         """Test that creating an order triggers a confirmation SMS"""
         url = reverse('order-list')
         data = {'total_amount': '4000.00'}  # String, not float
 
-        # UPDATED: Use the correct signal path from api.signals module
-        with patch('api.signals.send_order_confirmation_sms') as mock_confirm_sms, \
-             patch('api.utils.send_sms') as mock_send_sms:
+        with patch('api.utils.send_sms') as mock_send_sms:
             mock_send_sms.return_value = {'SMSMessageData': {
                 'Recipients': [{'status': 'Success'}]}}
-            mock_confirm_sms.return_value = True
 
             # Ensure authentication is working
             self.mock_auth.return_value = (self.user, None)
@@ -151,8 +155,17 @@ class APIEndToEndTests(APITestCase):
             # Verify an order with this amount was created
             self.assertTrue(Orders.objects.filter(total_amount=4000.00).exists())
             
-            # Verify the SMS sending function was called
-            self.assertTrue(mock_confirm_sms.called)
+            # Verify the confirmation was queued for the outbox worker
+            entry = SMSOutbox.objects.get(order_id=response.data['id'])
+            self.assertEqual(entry.phone_number, self.customer.phone_number)
+            self.assertIn(response.data['order_code'], entry.message)
+
+            # The worker delivers it and records the result
+            call_command('process_sms_outbox', '--once', '--concurrency', '1')
+            mock_send_sms.assert_any_call(
+                entry.phone_number, entry.message, raise_errors=True)
+            entry.refresh_from_db()
+            self.assertEqual(entry.status, SMSOutbox.SENT)
 
     def test_authenticated_user_operations(self):
         """Test that only authenticated users can access protected endpoints"""
@@ -191,12 +204,12 @@ class GoogleOAuthIntegrationTests(TestCase):
         self.assertTrue('accounts.google.com' in response.url)
         self.assertTrue('oauth2/auth' in response.url)
 
-    @patch('requests.post')
-    @patch('requests.get')
+    @patch('api.http_client.apost')
+    @patch('api.http_client.aget')
     def test_oauth_callback_creates_user_and_customer(self, mock_get, mock_post):
         """Test that the callback creates a user and customer when needed"""
         # Mock token response
-        mock_post.return_value.status_code = 200
+        mock_post.return_value = MagicMock(status_code=200)
         mock_post.return_value.json.return_value = {
             'access_token': 'mock_access_token',
             'refresh_token': 'mock_refresh_token',
@@ -204,7 +217,7 @@ class GoogleOAuthIntegrationTests(TestCase):
         }
 
         # Mock user info response
-        mock_get.return_value.status_code = 200
+        mock_get.return_value = MagicMock(status_code=200)
         mock_get.return_value.json.return_value = {
             'email': 'newuser@example.com',
             'name': 'New User',
@@ -235,8 +248,8 @@ class GoogleOAuthIntegrationTests(TestCase):
         self.assertEqual(customer.access_token, 'mock_access_token')
         self.assertEqual(customer.refresh_token, 'mock_refresh_token')
 
-    @patch('requests.post')
-    @patch('requests.get')
+    @patch('api.http_client.apost')
+    @patch('api.http_client.aget')
     def test_oauth_callback_existing_user(self, mock_get, mock_post):
         """Test callback with an existing user"""
         # Create existing user
@@ -256,7 +269,7 @@ class GoogleOAuthIntegrationTests(TestCase):
         )
 
         # Mock token response
-        mock_post.return_value.status_code = 200
+        mock_post.return_value = MagicMock(status_code=200)
         mock_post.return_value.json.return_value = {
             'access_token': 'new_access_token',
             'refresh_token': 'new_refresh_token',
@@ -264,7 +277,7 @@ class GoogleOAuthIntegrationTests(TestCase):
         }
 
         # Mock user info response
-        mock_get.return_value.status_code = 200
+        mock_get.return_value = MagicMock(status_code=200)
         mock_get.return_value.json.return_value = {
             'email': 'existing@example.com',  # Same email as existing user
             'name': 'Existing User',
@@ -332,12 +345,9 @@ class OrderAPITests(APITestCase):
         
         # Mock authentication to return our test user
         # Also patch the SMS utility to prevent actual SMS sending
-        # UPDATED: Use the correct signal path from api.signals module
         with patch('api.authentication.CookieAuthentication.authenticate') as mock_auth, \
-             patch('api.signals.send_order_confirmation_sms') as mock_sms, \
              patch('api.utils.send_sms') as mock_base_sms:
             mock_auth.return_value = (self.user, None)
-            mock_sms.return_value = True
             mock_base_sms.return_value = {'SMSMessageData': {
                 'Recipients': [{'status': 'Success'}]}}
             
@@ -352,3 +362,628 @@ class OrderAPITests(APITestCase):
             self.assertEqual(Orders.objects.count(), 2)
             self.assertEqual(response.data['total_amount'], '500.00')
             self.assertIsNotNone(response.data['order_code'])
+
+
+@pytest.mark.integration
+class OrderPaginationTests(APITestCase):
+    """
+    Tests for cursor pagination and sparse fieldsets on the order listing
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('order-list')
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.customer = Customer.objects.create(
+            user=self.user,
+            phone_number='+254700000000'
+        )
+        self.orders = [
+            Orders.objects.create(customer=self.customer, total_amount=amount)
+            for amount in (100, 200, 300, 400, 500)
+        ]
+        # two orders placed in the same instant must still page deterministically
+        Orders.objects.filter(pk__in=[self.orders[1].pk, self.orders[2].pk]).update(
+            order_date=self.orders[1].order_date)
+
+        self.auth_patcher = patch(
+            'api.authentication.CookieAuthentication.authenticate')
+        self.mock_auth = self.auth_patcher.start()
+        self.mock_auth.return_value = (self.user, None)
+
+    def tearDown(self):
+        self.auth_patcher.stop()
+
+    def test_cursor_walks_every_order_once(self):
+        """Test that following next links returns each order exactly once, newest first"""
+        seen = []
+        url = f'{self.url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+
+        expected = list(Orders.objects.filter(customer=self.customer)
+                        .order_by('-order_date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_sparse_fieldset(self):
+        """Test that ?fields= trims each order to the requested fields"""
+        response = self.client.get(self.url, {'fields': 'order_code,total_amount'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for order in response.data['results']:
+            self.assertEqual(set(order), {'order_code', 'total_amount'})
+
+    def test_invalid_cursor(self):
+        """Test that a tampered cursor is rejected"""
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@pytest.mark.integration
+class CustomerOrdersTests(APITestCase):
+    """
+    Tests for the bounded orders view embedded in customer responses
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.customer = Customer.objects.create(
+            user=self.user,
+            phone_number='+254700000000'
+        )
+        self.orders = [
+            Orders.objects.create(customer=self.customer, total_amount=amount)
+            for amount in range(1, 9)
+        ]
+
+        self.auth_patcher = patch(
+            'api.authentication.CookieAuthentication.authenticate')
+        self.mock_auth = self.auth_patcher.start()
+        self.mock_auth.return_value = (self.user, None)
+
+    def tearDown(self):
+        self.auth_patcher.stop()
+
+    def test_customer_embeds_only_recent_orders(self):
+        """Test that the customer lists a bounded set of newest orders plus a count and link"""
+        response = self.client.get(reverse('customer-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        customer = response.data[0]
+        self.assertEqual(customer['order_count'], 8)
+        self.assertEqual(
+            [order['id'] for order in customer['recent_orders']],
+            [order.id for order in reversed(self.orders)][:CustomerSerializer.RECENT_ORDERS])
+        self.assertTrue(customer['orders_url'].endswith(reverse('order-list')))
+
+    def test_customer_list_query_count_is_flat(self):
+        """Test that orders are loaded with one prefetch regardless of history size"""
+        # the ETag version, the customer and the prefetch
+        with self.assertNumQueries(3):
+            self.client.get(reverse('customer-list'))
+
+        Orders.objects.bulk_create([
+            Orders(customer=self.customer, total_amount=1, order_code=f'ORD-BULK{i}')
+            for i in range(50)
+        ])
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('customer-list'))
+        self.assertEqual(response.data[0]['order_count'], 58)
+
+    def test_update_response_is_bounded(self):
+        """Test that a profile update does not serialize the whole order history"""
+        url = reverse('customer-detail', kwargs={'pk': self.customer.id})
+
+        response = self.client.patch(url, {'phone_number': '+254711111111'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['recent_orders']),
+                         CustomerSerializer.RECENT_ORDERS)
+        self.assertEqual(response.data['order_count'], 8)
+
+
+@pytest.mark.integration
+class OrderSummaryTests(APITestCase):
+    """
+    Tests for the database-aggregated order summary endpoint
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('order-summary')
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.customer = Customer.objects.create(
+            user=self.user,
+            phone_number='+254700000000'
+        )
+        placed = [
+            (datetime.datetime(2025, 1, 30, 10, tzinfo=datetime.timezone.utc), '100.00'),
+            (datetime.datetime(2025, 1, 30, 18, tzinfo=datetime.timezone.utc), '50.50'),
+            (datetime.datetime(2025, 2, 2, 9, tzinfo=datetime.timezone.utc), '25.00'),
+            (datetime.datetime(2025, 3, 1, 9, tzinfo=datetime.timezone.utc), '10.00'),
+        ]
+        for order_date, amount in placed:
+            order = Orders.objects.create(customer=self.customer, total_amount=amount)
+            # order_date is auto_now_add, move it through a regular update
+            order.order_date = order_date
+            order.save()
+
+        self.auth_patcher = patch(
+            'api.authentication.CookieAuthentication.authenticate')
+        self.mock_auth = self.auth_patcher.start()
+        self.mock_auth.return_value = (self.user, None)
+
+    def tearDown(self):
+        self.auth_patcher.stop()
+
+    def test_daily_summary_over_range(self):
+        """Test count, sum, average and per-day buckets inside a date range"""
+        response = self.client.get(
+            self.url, {'start': '2025-01-01', 'end': '2025-02-28'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['total'], '175.50')
+        self.assertEqual(response.data['average'], '58.50')
+        self.assertEqual(response.data['buckets'], [
+            {'period': '2025-01-30', 'count': 2, 'total': '150.50'},
+            {'period': '2025-02-02', 'count': 1, 'total': '25.00'},
+        ])
+
+    def test_rollup_matches_live_aggregation(self):
+        """Test that the rollup table answers exactly like the orders table"""
+        for bucket in ('day', 'month'):
+            live = self.client.get(self.url, {'bucket': bucket, 'source': 'live'})
+            rollup = self.client.get(self.url, {'bucket': bucket, 'source': 'rollup'})
+
+            self.assertEqual(live.data['buckets'], rollup.data['buckets'])
+            self.assertEqual(live.data['total'], rollup.data['total'])
+
+        self.assertEqual(
+            [row['period'] for row in rollup.data['buckets']],
+            ['2025-01-01', '2025-02-01', '2025-03-01'])
+
+    def test_rollup_follows_updates_and_deletes(self):
+        """Test that changed and deleted orders are reflected in the rollup"""
+        order = Orders.objects.get(total_amount='25.00')
+        order.total_amount = '40.00'
+        order.save()
+        Orders.objects.get(total_amount='10.00').delete()
+
+        response = self.client.get(self.url, {'source': 'rollup', 'start': '2025-02-01'})
+
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['total'], '40.00')
+
+    def test_summary_is_cheap(self):
+        """Test that the rollup summary is a single query plus authentication"""
+        with self.assertNumQueries(1):
+            self.client.get(self.url, {'source': 'rollup', 'bucket': 'month'})
+
+    def test_invalid_range(self):
+        """Test that an inverted date range is rejected"""
+        response = self.client.get(self.url, {'start': '2025-03-01', 'end': '2025-01-01'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@pytest.mark.integration
+class OrderBulkCreateTests(APITestCase):
+    """
+    Tests for creating a batch of orders in one request
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('order-bulk')
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            first_name='Test',
+            password='testpassword'
+        )
+        self.customer = Customer.objects.create(
+            user=self.user,
+            phone_number='+254700000000'
+        )
+
+        self.auth_patcher = patch(
+            'api.authentication.CookieAuthentication.authenticate')
+        self.mock_auth = self.auth_patcher.start()
+        self.mock_auth.return_value = (self.user, None)
+
+    def tearDown(self):
+        self.auth_patcher.stop()
+
+    def test_bulk_create_orders(self):
+        """Test that every order is created with its own code and queued SMS"""
+        payload = [{'total_amount': amount} for amount in ('10.00', '20.00', '30.50')]
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual([row['total_amount'] for row in response.data],
+                         ['10.00', '20.00', '30.50'])
+        codes = {row['order_code'] for row in response.data}
+        self.assertEqual(len(codes), 3)
+        self.assertTrue(all(code.startswith('ORD-') for code in codes))
+        self.assertEqual(self.customer.orders.count(), 3)
+        self.assertEqual(
+            set(SMSOutbox.objects.values_list('order__order_code', flat=True)),
+            codes)
+
+        summary = self.client.get(reverse('order-summary'), {'source': 'rollup'})
+        self.assertEqual(summary.data['count'], 3)
+        self.assertEqual(summary.data['total'], '60.50')
+
+    def test_bulk_create_is_constant_queries(self):
+        """Test that the number of queries does not grow with the batch"""
+        # the first batch of the day also inserts the rollup row
+        self.client.post(self.url, [{'total_amount': '5.00'}], format='json')
+
+        counts = []
+        for size in (1, 50):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    self.url, [{'total_amount': '5.00'}] * size, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_item_rejects_batch(self):
+        """Test that one invalid order rejects the whole batch"""
+        payload = [{'total_amount': '10.00'}, {'total_amount': 'abc'}]
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('total_amount', response.data[1])
+        self.assertEqual(Orders.objects.count(), 0)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        """Test that empty arrays and arrays above the limit are rejected"""
+        self.assertEqual(
+            self.client.post(self.url, [], format='json').status_code,
+            status.HTTP_400_BAD_REQUEST)
+        with patch('config.settings.ORDER_BULK_MAX_SIZE', 2):
+            response = self.client.post(
+                self.url, [{'total_amount': '1.00'}] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Orders.objects.count(), 0)
+
+    def test_requires_phone_number(self):
+        """Test that customers without a phone number cannot bulk order"""
+        self.customer.phone_number = ''
+        self.customer.save()
+
+        response = self.client.post(
+            self.url, [{'total_amount': '10.00'}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('phone_number', response.data)
+        self.assertEqual(Orders.objects.count(), 0)
+
+
+@pytest.mark.integration
+class ThrottlingAPITests(APITestCase):
+    """
+    Tests for request throttling against the shared counter store
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        Customer.objects.create(user=self.user, phone_number='+254700000000')
+
+        self.auth_patcher = patch(
+            'api.authentication.CookieAuthentication.authenticate')
+        self.mock_auth = self.auth_patcher.start()
+        self.mock_auth.return_value = (self.user, None)
+
+    def tearDown(self):
+        self.auth_patcher.stop()
+
+    def test_user_rate_is_enforced(self):
+        """Test that requests above the user rate get 429 with Retry-After"""
+        with patch.object(UserRateThrottle, 'THROTTLE_RATES', {'user': '3/minute'}):
+            statuses = [self.client.get(reverse('order-list')).status_code
+                        for _ in range(4)]
+            response = self.client.get(reverse('order-list'))
+
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+
+@pytest.mark.integration
+class BusinessMetricsTests(APITestCase):
+    """
+    Tests for the order, auth, OAuth and SMS metrics served at /metrics
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', first_name='Test')
+        self.customer = Customer.objects.create(
+            user=self.user, phone_number='+254700000000', access_token='metrics_token')
+        self.client.cookies['access_token'] = 'metrics_token'
+
+    def value(self, metric, *labels):
+        return metric.labels(*labels).value
+
+    def test_order_creation(self):
+        """Test that created and rejected order requests are counted"""
+        created = self.value(metrics.ORDERS_CREATED, 'bulk')
+        rejected = self.value(metrics.ORDER_REQUESTS, 'single', 'rejected')
+
+        self.client.post(reverse('order-bulk'), [{'total_amount': '1.00'}] * 3, format='json')
+        self.client.post(reverse('order-list'), {'total_amount': 'abc'}, format='json')
+
+        self.assertEqual(self.value(metrics.ORDERS_CREATED, 'bulk'), created + 3)
+        self.assertEqual(self.value(metrics.ORDER_REQUESTS, 'single', 'rejected'), rejected + 1)
+        self.assertIn(b'order_create_seconds_count{endpoint="bulk"}',
+                      self.client.get('/metrics').content)
+
+    def test_cookie_auth(self):
+        """Test that database, cached and invalid cookie logins are counted"""
+        before = {outcome: self.value(metrics.COOKIE_AUTH, outcome)
+                  for outcome in ('database', 'cached', 'invalid')}
+
+        self.client.get(reverse('order-list'))
+        self.client.get(reverse('order-list'))
+        self.client.cookies['access_token'] = 'unknown'
+        self.client.get(reverse('order-list'))
+
+        self.assertEqual(self.value(metrics.COOKIE_AUTH, 'database'), before['database'] + 1)
+        self.assertEqual(self.value(metrics.COOKIE_AUTH, 'cached'), before['cached'] + 1)
+        self.assertEqual(self.value(metrics.COOKIE_AUTH, 'invalid'), before['invalid'] + 1)
+
+    @patch('api.http_client.apost')
+    def test_oauth_exchange(self, mock_post):
+        """Test that refused and failed Google exchanges are counted by outcome"""
+        mock_post.return_value = MagicMock(status_code=400)
+        rejected = self.value(metrics.GOOGLE_OAUTH, 'refresh_token', 'rejected')
+        self.client.cookies['refresh_token'] = 'expired'
+
+        response = self.client.post(reverse('refresh_token'))
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.value(metrics.GOOGLE_OAUTH, 'refresh_token', 'rejected'),
+                         rejected + 1)
+
+    def test_sms_sends(self):
+        """Test that gateway requests and recipients are counted"""
+        sent = self.value(metrics.SMS_SENDS, 'bulk', 'sent')
+        recipients = self.value(metrics.SMS_RECIPIENTS, 'bulk')
+
+        send_bulk_sms(['+254700000001', '+254700000002'], 'Hello')
+
+        self.assertEqual(self.value(metrics.SMS_SENDS, 'bulk', 'sent'), sent + 1)
+        self.assertEqual(self.value(metrics.SMS_RECIPIENTS, 'bulk'), recipients + 2)
+
+
+@pytest.mark.integration
+class ConditionalGetTests(APITestCase):
+    """
+    Tests for ETag and Last-Modified validators on polled read endpoints
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser', first_name='Test', last_name='User')
+        self.customer = Customer.objects.create(
+            user=self.user, phone_number='+254700000000',
+            access_token='conditional_token')
+        self.orders = [
+            Orders.objects.create(customer=self.customer, total_amount=amount)
+            for amount in range(1, 4)
+        ]
+        self.client.cookies['access_token'] = 'conditional_token'
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_list_is_not_modified(self):
+        """Test that a matching If-None-Match gets an empty 304 from one query"""
+        url = reverse('order-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('private', response['Cache-Control'])
+
+        # the customer is now in the auth cache, so only the version is read
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.revalidate(url, response)
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(len(queries), 1)
+
+    def test_list_version_follows_writes(self):
+        """Test that creating, editing and deleting an order changes the list ETag"""
+        url = reverse('order-list')
+        etags = [self.client.get(url)['ETag']]
+
+        Orders.objects.create(customer=self.customer, total_amount=10)
+        etags.append(self.client.get(url)['ETag'])
+        self.orders[0].total_amount = 20
+        self.orders[0].save(update_fields=['total_amount'])
+        etags.append(self.client.get(url)['ETag'])
+        self.orders[1].delete()
+        etags.append(self.client.get(url)['ETag'])
+
+        self.assertEqual(len(set(etags)), 4)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_pages_have_their_own_etags(self):
+        """Test that another page or field selection of the same list is not a match"""
+        url = reverse('order-list')
+        response = self.client.get(url)
+
+        other = self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(other.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(other['ETag'], response['ETag'])
+
+    def test_order_detail_if_modified_since(self):
+        """Test that an order unchanged since Last-Modified gets a 304"""
+        url = reverse('order-detail', kwargs={'pk': self.orders[0].pk})
+        response = self.client.get(url)
+
+        not_modified = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        stale = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2024 00:00:00 GMT')
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(stale.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.revalidate(url, response).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+    def test_order_detail_of_other_customer(self):
+        """Test that orders of other customers still answer 404"""
+        other = Customer.objects.create(
+            user=User.objects.create_user(username='other'), phone_number='+254700000001')
+        order = Orders.objects.create(customer=other, total_amount=1)
+
+        response = self.client.get(reverse('order-detail', kwargs={'pk': order.pk}),
+                                   HTTP_IF_NONE_MATCH='*')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
+
+    def test_customer_version_follows_orders(self):
+        """Test that the customer ETag changes with its embedded orders"""
+        for url in (reverse('customer-list'),
+                    reverse('customer-detail', kwargs={'pk': self.customer.pk})):
+            response = self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.revalidate(url, response).status_code,
+                                 status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(len(queries), 1)
+
+            order = Orders.objects.create(customer=self.customer, total_amount=5)
+            self.assertEqual(self.revalidate(url, response).status_code, status.HTTP_200_OK)
+            order.delete()
+
+    def test_profile_revalidates_without_queries(self):
+        """Test that the profile answers 304 from the authenticated customer alone"""
+        url = reverse('profile')
+        response = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            not_modified = self.revalidate(url, response)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.customer.phone_number = '+254711111111'
+        self.customer.save()
+        changed = self.revalidate(url, response)
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertEqual(changed.data['phone_number'], '+254711111111')
+
+
+@pytest.mark.integration
+@override_settings(SESSION_TOKENS={'ENABLED': True, 'KEYS': {'k1': 'secret-one'}})
+class SessionTokenAPITests(APITestCase):
+    """
+    Tests for logins that hand out signed session tokens
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        session_tokens.revocations.clear()
+
+    @patch('api.http_client.apost')
+    @patch('api.http_client.aget')
+    def login(self, mock_get, mock_post):
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {
+            'access_token': 'ya29.google_access_token',
+            'refresh_token': 'google_refresh_token',
+        }
+        mock_get.return_value = MagicMock(status_code=200)
+        mock_get.return_value.json.return_value = {
+            'email': 'session@example.com',
+            'given_name': 'Session',
+            'family_name': 'User',
+        }
+        return self.client.get(reverse('google_callback'), {'code': 'mock_code'})
+
+    def test_login_sets_session_token(self):
+        """Test that the callback sets our token and keeps Google's out of the database"""
+        response = self.login()
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        token = response.cookies['access_token'].value
+        customer = Customer.objects.get(user__email='session@example.com')
+        claims = session_tokens.verify(token)
+        self.assertEqual(claims['cid'], customer.pk)
+        self.assertEqual(response.cookies['access_token']['max-age'],
+                         session_tokens.get_config()['LIFETIME'])
+        self.assertIsNone(customer.access_token)
+        self.assertEqual(customer.refresh_token, 'google_refresh_token')
+
+    def test_api_with_session_token(self):
+        """Test that session requests read orders without auth queries and order normally"""
+        self.login()
+        customer = Customer.objects.get(user__email='session@example.com')
+        customer.phone_number = '+254700000000'
+        customer.save()
+        Orders.objects.create(customer=customer, total_amount=10)
+
+        profile = self.client.get(reverse('profile'))
+        self.assertEqual(profile.status_code, status.HTTP_200_OK)
+        self.assertEqual(profile.data['first_name'], 'Session')
+
+        # the order version and the page, nothing to authenticate
+        with self.assertNumQueries(2):
+            orders = self.client.get(reverse('order-list'))
+        self.assertEqual(len(orders.data['results']), 1)
+
+        created = self.client.post(reverse('order-list'), {'total_amount': '25.00'}, format='json')
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        message = SMSOutbox.objects.get(order_id=created.data['id']).message
+        self.assertIn('Session', message)
+
+    @patch('api.http_client.apost')
+    def test_refresh_issues_new_session_token(self, mock_post):
+        """Test that refreshing hands out a new session token without writing the customer"""
+        first = self.login().cookies['access_token'].value
+        customer = Customer.objects.get(user__email='session@example.com')
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {'access_token': 'ya29.refreshed'}
+
+        response = self.client.post(reverse('refresh_token'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = response.cookies['access_token'].value
+        self.assertNotEqual(token, first)
+        self.assertEqual(session_tokens.verify(token)['cid'], customer.pk)
+        refreshed = Customer.objects.get(pk=customer.pk)
+        self.assertEqual(refreshed.updated_at, customer.updated_at)
+        self.assertIsNone(refreshed.access_token)
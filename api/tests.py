@@ -1,17 +1,52 @@
-from django.test import TestCase, Client
+from django.test import TestCase, SimpleTestCase, Client, RequestFactory, override_settings
+from django.http import HttpResponse
+from django.core.exceptions import MiddlewareNotUsed
+from django.conf import settings as django_settings
+from django.core.cache import cache, caches
+from config import settings as config_settings
+from django.utils.module_loading import import_string
+from asgiref.sync import async_to_sync, sync_to_async
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 import json
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
+import time
 import uuid
 import pytest
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+import requests
+import httpx
+import jwt
+from http import cookiejar
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from django.core.management import call_command
+from django.utils import timezone
+from django.db import IntegrityError, connection, connections
+from django.db.models import Sum
 
-from .models import Customer, Orders
+from .models import Customer, OrderCode, OrderDailyRollup, Orders, SMSOutbox, hash_token
 from .serializers import CustomerSerializer, OrderSerializer
-from .utils import send_sms, send_order_confirmation_sms
+from . import utils
+from .utils import send_sms, send_order_confirmation_sms, order_confirmation_message
+from . import (
+    accounts, circuit_breaker, instrumentation, metrics, order_codes, outbox, partitions, routers,
+    session_tokens, single_flight, throttling, views)
 from .authentication import CookieAuthentication
+from .auth_cache import auth_cache
+from . import google_id_token, http_client
+from benchmarks import suite
+from benchmarks.fake_google import SigningKey, start_google
+from benchmarks.fake_sms_gateway import start_gateway
 
 # Unit Tests
 @pytest.mark.unit
@@ -61,6 +96,7 @@ class OrderModelTests(TestCase):
         self.assertEqual(self.order.total_amount, 1000.00)
         self.assertEqual(self.order.customer, self.customer)
 
+    @override_settings(ORDER_CODE_GENERATOR='api.order_codes.uuid_order_code')
     def test_order_code_generation(self):
         """Test that a unique order code is generated"""
         with patch('uuid.uuid4') as mock_uuid:
@@ -69,6 +105,58 @@ class OrderModelTests(TestCase):
             order_code = order.generate_order_code()
             self.assertEqual(order_code, 'ORD-12345678')
 
+    def test_order_code_collision_is_retried(self):
+        """Test that a generated code that already exists is replaced"""
+        taken = self.order.order_code
+        with patch('api.order_codes.generate_order_code',
+                   side_effect=[taken, 'ORD-FRESH']):
+            order = Orders.objects.create(customer=self.customer, total_amount=5)
+
+        self.assertEqual(order.order_code, 'ORD-FRESH')
+        self.assertEqual(Orders.objects.filter(order_code=taken).count(), 1)
+
+    def test_explicit_duplicate_code_is_not_retried(self):
+        """Test that a caller-supplied duplicate code still fails"""
+        with self.assertRaises(IntegrityError):
+            Orders.objects.create(customer=self.customer, total_amount=5,
+                                  order_code=self.order.order_code)
+
+
+@pytest.mark.unit
+class OrderCodeGeneratorTests(TestCase):
+    def test_codes_are_time_ordered(self):
+        """Test that codes fit the column and sort in creation order"""
+        generator = order_codes.TimeOrderedCodeGenerator()
+        codes = [generator() for _ in range(1000)]
+
+        self.assertTrue(all(len(code) == 20 for code in codes))
+        self.assertTrue(all(code.startswith('ORD-') for code in codes))
+        self.assertEqual(codes, sorted(set(codes)))
+
+    def test_monotonic_within_a_millisecond(self):
+        """Test that a frozen or rewound clock still yields increasing codes"""
+        ticks = iter([1.0, 1.0, 1.0, 0.5, 2.0])
+        generator = order_codes.TimeOrderedCodeGenerator(
+            clock=lambda: next(ticks), randbits=lambda: 2 ** 32 - 2)
+        codes = [generator() for _ in range(5)]
+
+        self.assertEqual(codes, sorted(set(codes)))
+
+    def test_stress_uniqueness(self):
+        """Test uniqueness over a large batch of codes"""
+        generator = order_codes.TimeOrderedCodeGenerator()
+        previous = ''
+        for _ in range(200_000):
+            code = generator()
+            # strictly increasing implies unique without holding every code
+            self.assertGreater(code, previous)
+            previous = code
+
+    @override_settings(ORDER_CODE_GENERATOR='api.order_codes.uuid_order_code')
+    def test_generator_is_pluggable(self):
+        """Test that ORDER_CODE_GENERATOR selects the generator"""
+        self.assertRegex(order_codes.generate_order_code(), r'^ORD-[0-9A-F]{8}$')
+
 # SMS utility tests
 @pytest.mark.unit
 class SMSUtilityTests(TestCase):
@@ -111,6 +199,217 @@ class SMSUtilityTests(TestCase):
         expected_message = f"Hello {user.first_name}, your order with code {order.order_code} has been confirmed. Thank you for shopping with us!"
         mock_send_sms.assert_called_once_with(customer.phone_number, expected_message)
 
+@pytest.mark.unit
+class SMSOutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            first_name='Test',
+            password='testpassword'
+        )
+        self.customer = Customer.objects.create(
+            user=self.user,
+            phone_number='+254700000000'
+        )
+
+    def test_order_creation_queues_sms_without_sending(self):
+        """Test that creating an order only writes an outbox row"""
+        with patch('api.utils.sms') as mock_sms:
+            order = Orders.objects.create(customer=self.customer, total_amount=10)
+
+        self.assertFalse(mock_sms.send.called)
+        entry = SMSOutbox.objects.get(order=order)
+        self.assertEqual(entry.status, SMSOutbox.PENDING)
+        self.assertEqual(entry.message,
+                         order_confirmation_message(self.customer, order))
+
+    def test_order_is_rolled_back_when_queueing_fails(self):
+        """Test that the order and its outbox row commit together"""
+        with patch('api.signals.enqueue_order_confirmation',
+                   side_effect=RuntimeError('outbox unavailable')):
+            with self.assertRaises(RuntimeError):
+                Orders.objects.create(customer=self.customer, total_amount=10)
+
+        self.assertFalse(Orders.objects.exists())
+
+    @patch('api.utils.sms')
+    def test_failed_send_is_retried_with_backoff(self, mock_sms):
+        """Test that a gateway error reschedules the message"""
+        mock_sms.send.side_effect = ConnectionError('gateway down')
+        order = Orders.objects.create(customer=self.customer, total_amount=10)
+
+        totals = outbox.drain(concurrency=1)
+
+        self.assertEqual(totals, {'sent': 0, 'failed': 1, 'unknown': 0, 'requests': 1})
+        entry = SMSOutbox.objects.get(order=order)
+        self.assertEqual(entry.status, SMSOutbox.PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('gateway down', entry.last_error)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+    @override_settings(SMS_OUTBOX={'MAX_ATTEMPTS': 1})
+    @patch('api.utils.sms')
+    def test_rejected_recipient_is_marked_failed(self, mock_sms):
+        """Test that a message stops retrying after the last attempt"""
+        mock_sms.send.return_value = {'SMSMessageData': {
+            'Recipients': [{'status': 'InvalidPhoneNumber'}]}}
+        order = Orders.objects.create(customer=self.customer, total_amount=10)
+
+        outbox.drain(concurrency=1)
+
+        entry = SMSOutbox.objects.get(order=order)
+        self.assertEqual(entry.status, SMSOutbox.FAILED)
+        self.assertIn('InvalidPhoneNumber', entry.last_error)
+
+    @override_settings(SMS_CONFIRMATION_TEMPLATE='Your order has been confirmed.',
+                       SMS_OUTBOX={'BATCH_WINDOW': 0})
+    @patch('api.utils.sms')
+    def test_identical_messages_share_one_bulk_request(self, mock_sms):
+        """Test that identical confirmations go out in one multi-recipient call"""
+        other_user = User.objects.create_user(username='other', password='pw')
+        other_customer = Customer.objects.create(
+            user=other_user, phone_number='+254711111111')
+        first = Orders.objects.create(customer=self.customer, total_amount=10)
+        second = Orders.objects.create(customer=other_customer, total_amount=20)
+        mock_sms.send.return_value = {'SMSMessageData': {'Recipients': [
+            {'number': '+254711111111', 'status': 'InsufficientBalance'},
+            {'number': '+254700000000', 'status': 'Success', 'messageId': 'm1'},
+        ]}}
+
+        totals = outbox.drain(concurrency=1)
+
+        mock_sms.send.assert_called_once_with(
+            'Your order has been confirmed.', ['+254700000000', '+254711111111'])
+        self.assertEqual(totals, {'sent': 1, 'failed': 1, 'unknown': 0, 'requests': 1})
+        sent = SMSOutbox.objects.get(order=first)
+        self.assertEqual(sent.status, SMSOutbox.SENT)
+        self.assertEqual(sent.provider_response['messageId'], 'm1')
+        retried = SMSOutbox.objects.get(order=second)
+        self.assertEqual(retried.status, SMSOutbox.PENDING)
+        self.assertIn('InsufficientBalance', retried.last_error)
+
+    @override_settings(SMS_CONFIRMATION_TEMPLATE='Your order has been confirmed.',
+                       SMS_OUTBOX={'BATCH_WINDOW': 0})
+    @patch('api.utils.sms')
+    def test_recipients_are_matched_in_e164_form(self, mock_sms):
+        """Test that numbers stored in local form match the gateway's E.164 ones"""
+        other_user = User.objects.create_user(username='other', password='pw')
+        other_customer = Customer.objects.create(
+            user=other_user, phone_number='0711 111111')
+        first = Orders.objects.create(customer=self.customer, total_amount=10)
+        second = Orders.objects.create(customer=other_customer, total_amount=20)
+        mock_sms.send.return_value = {'SMSMessageData': {'Recipients': [
+            {'number': '+254700000000', 'status': 'Success'},
+            {'number': '+254711111111', 'status': 'Success'},
+        ]}}
+
+        totals = outbox.drain(concurrency=1)
+
+        self.assertEqual(totals['sent'], 2)
+        self.assertEqual(SMSOutbox.objects.get(order=second).status, SMSOutbox.SENT)
+        self.assertEqual(SMSOutbox.objects.get(order=first).status, SMSOutbox.SENT)
+
+    @override_settings(SMS_CONFIRMATION_TEMPLATE='Your order has been confirmed.',
+                       SMS_OUTBOX={'BATCH_WINDOW': 0})
+    @patch('api.utils.sms')
+    def test_unreported_recipient_is_unknown_not_retried(self, mock_sms):
+        """Test that a recipient missing from an accepted request isn't sent again"""
+        other_user = User.objects.create_user(username='other', password='pw')
+        other_customer = Customer.objects.create(
+            user=other_user, phone_number='+254711111111')
+        Orders.objects.create(customer=self.customer, total_amount=10)
+        second = Orders.objects.create(customer=other_customer, total_amount=20)
+        mock_sms.send.return_value = {'SMSMessageData': {'Recipients': [
+            {'number': '+254700000000', 'status': 'Success'},
+        ]}}
+
+        totals = outbox.drain(concurrency=1)
+
+        self.assertEqual(totals, {'sent': 1, 'failed': 0, 'unknown': 1, 'requests': 1})
+        entry = SMSOutbox.objects.get(order=second)
+        self.assertEqual(entry.status, SMSOutbox.UNKNOWN)
+        self.assertEqual(outbox.claim_batch(10, lease_seconds=300), [])
+
+    @override_settings(SMS_CONFIRMATION_TEMPLATE='Your order has been confirmed.',
+                       SMS_OUTBOX={'BATCH_WINDOW': 0})
+    @patch('api.utils.sms')
+    def test_each_order_gets_its_own_confirmation(self, mock_sms):
+        """Test that two orders to the same number and text send two messages"""
+        mock_sms.send.return_value = {'SMSMessageData': {'Recipients': [
+            {'number': '+254700000000', 'status': 'Success'}]}}
+        Orders.objects.create(customer=self.customer, total_amount=10)
+        Orders.objects.create(customer=self.customer, total_amount=20)
+
+        totals = outbox.drain(concurrency=1)
+
+        self.assertEqual(mock_sms.send.call_count, 2)
+        self.assertEqual(totals, {'sent': 2, 'failed': 0, 'unknown': 0, 'requests': 2})
+
+    @override_settings(SMS_OUTBOX={'BATCH_WINDOW': 0})
+    @patch('api.utils.sms')
+    def test_default_template_sends_a_request_per_order(self, mock_sms):
+        """Test that the personalised default template leaves batching off"""
+        other_user = User.objects.create_user(
+            username='other', first_name='Other', password='pw')
+        other_customer = Customer.objects.create(
+            user=other_user, phone_number='+254711111111')
+        Orders.objects.create(customer=self.customer, total_amount=10)
+        Orders.objects.create(customer=other_customer, total_amount=20)
+        mock_sms.send.side_effect = lambda message, numbers: {'SMSMessageData': {
+            'Recipients': [{'number': number, 'status': 'Success'} for number in numbers]}}
+
+        totals = outbox.drain(concurrency=1)
+
+        self.assertEqual(mock_sms.send.call_count, 2)
+        self.assertEqual(totals, {'sent': 2, 'failed': 0, 'unknown': 0, 'requests': 2})
+
+    def test_rows_for_the_same_order_are_sent_once(self):
+        """Test that a confirmation queued twice for one order shares a send"""
+        batch = [SMSOutbox(order_id=1, phone_number='+254700000000', message='Hi'),
+                 SMSOutbox(order_id=1, phone_number='+254700000000', message='Hi'),
+                 SMSOutbox(order_id=2, phone_number='+254700000000', message='Hi')]
+
+        groups = list(outbox.group_by_message(batch, max_recipients=100))
+
+        self.assertEqual([len(group) for group in groups], [2, 1])
+
+    def test_groups_are_capped_at_max_recipients(self):
+        """Test that a group never exceeds the per-request recipient limit"""
+        batch = [SMSOutbox(phone_number=f'+2547000000{i:02d}', message='Hi')
+                 for i in range(5)]
+        batch.append(SMSOutbox(phone_number='+254700000099', message='Other'))
+
+        groups = list(outbox.group_by_message(batch, max_recipients=2))
+
+        self.assertEqual([len(group) for group in groups], [2, 2, 1, 1])
+
+    @override_settings(SMS_OUTBOX={'BATCH_WINDOW': 0})
+    @patch('api.utils.sms')
+    def test_drain_can_be_limited_to_some_rows(self, mock_sms):
+        """Test that a drain given a queryset leaves every other row queued"""
+        mock_sms.send.return_value = {'SMSMessageData': {'Recipients': [
+            {'number': '+254700000000', 'status': 'Success'}]}}
+        mine = Orders.objects.create(customer=self.customer, total_amount=10)
+        other = Orders.objects.create(customer=self.customer, total_amount=20)
+
+        totals = outbox.drain(concurrency=1, rows=SMSOutbox.objects.filter(order=mine))
+
+        self.assertEqual(totals['sent'], 1)
+        self.assertEqual(SMSOutbox.objects.get(order=mine).status, SMSOutbox.SENT)
+        self.assertEqual(SMSOutbox.objects.get(order=other).status, SMSOutbox.PENDING)
+
+    def test_expired_lease_is_claimed_again(self):
+        """Test that rows left in SENDING by a crashed worker are retried"""
+        order = Orders.objects.create(customer=self.customer, total_amount=10)
+        self.assertEqual(len(outbox.claim_batch(10, lease_seconds=300)), 1)
+        self.assertEqual(outbox.claim_batch(10, lease_seconds=300), [])
+
+        SMSOutbox.objects.filter(order=order).update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1))
+        claimed = outbox.claim_batch(10, lease_seconds=300)
+        self.assertEqual([entry.attempts for entry in claimed], [2])
+
 # Authentication Tests
 @pytest.mark.unit
 class CookieAuthenticationTests(TestCase):
@@ -155,6 +454,1351 @@ class CookieAuthenticationTests(TestCase):
         
         self.assertIsNone(result)
 
+    def test_access_token_hash_is_stored(self):
+        """Test that the digest of the access token is kept in sync on save"""
+        self.assertEqual(self.customer.access_token_hash,
+                         hash_token('test_access_token'))
+        self.assertEqual(len(self.customer.access_token_hash), 64)
+
+        self.customer.access_token = 'rotated_access_token'
+        self.customer.save(update_fields=['access_token'])
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.access_token_hash,
+                         hash_token('rotated_access_token'))
+
+    def test_authenticate_uses_single_query(self):
+        """Test that authentication resolves the user in one indexed query"""
+        request = MagicMock()
+        request.COOKIES = {'access_token': 'test_access_token'}
+
+        with self.assertNumQueries(1):
+            user, auth = self.auth.authenticate(request)
+            self.assertEqual(user.username, 'testuser')
+
+@pytest.mark.unit
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        auth_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.customer = Customer.objects.create(
+            user=self.user,
+            phone_number='+254700000000',
+            access_token='test_access_token',
+            refresh_token='test_refresh_token'
+        )
+        self.auth = CookieAuthentication()
+        self.request = MagicMock()
+        self.request.COOKIES = {'access_token': 'test_access_token'}
+
+    def tearDown(self):
+        auth_cache.clear()
+
+    def test_warm_cache_costs_no_queries(self):
+        """Test that a cached token authenticates without touching the database"""
+        self.auth.authenticate(self.request)
+
+        with self.assertNumQueries(0):
+            user, auth = self.auth.authenticate(self.request)
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.customer, self.customer)
+
+        stats = auth_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_profile_view_with_warm_cache_costs_no_queries(self):
+        """Test that auth and the customer lookup in ProfileView both come from cache"""
+        client = APIClient()
+        client.cookies['access_token'] = 'test_access_token'
+        client.get(reverse('profile'))
+
+        with self.assertNumQueries(0):
+            response = client.get(reverse('profile'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['customer_id'], self.customer.id)
+
+    def test_customer_save_invalidates_entry(self):
+        """Test that saving the customer drops its cached entry"""
+        self.auth.authenticate(self.request)
+
+        self.customer.phone_number = '+254711111111'
+        self.customer.save()
+
+        user, auth = self.auth.authenticate(self.request)
+        self.assertEqual(user.customer.phone_number, '+254711111111')
+        self.assertEqual(auth_cache.stats()['misses'], 2)
+
+    @patch('api.http_client.apost')
+    def test_token_refresh_revokes_old_token(self, mock_post):
+        """Test that refreshing the access token stops the old one from authenticating"""
+        self.auth.authenticate(self.request)
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {
+            'access_token': 'new_access_token'}
+
+        client = Client()
+        client.cookies['refresh_token'] = 'test_refresh_token'
+        client.post(reverse('refresh_token'))
+
+        with self.assertRaises(Exception):
+            self.auth.authenticate(self.request)
+
+    @override_settings(AUTH_CACHE={'MAX_ENTRIES': 1})
+    def test_lru_is_bounded(self):
+        """Test that the in-process tier evicts the least recently used token"""
+        auth_cache.set('token-a', self.user, self.customer)
+        auth_cache.set('token-b', self.user, self.customer)
+
+        self.assertIsNone(auth_cache.get('token-a'))
+        self.assertIsNotNone(auth_cache.get('token-b'))
+        self.assertEqual(auth_cache.stats()['evictions'], 1)
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'auth': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                     'LOCATION': 'auth-cache-tests'},
+        },
+        AUTH_CACHE={'SHARED_CACHE': 'auth'})
+    def test_shared_tier_is_used_after_local_miss(self):
+        """Test that another worker's entry is picked up from the shared tier"""
+        auth_cache.set('token-a', self.user, self.customer)
+        # simulate a different process whose local tier is empty
+        auth_cache._entries.clear()
+
+        user, customer = auth_cache.get('token-a')
+        self.assertEqual(user, self.user)
+        self.assertEqual(auth_cache.stats()['shared_hits'], 1)
+
+        auth_cache.invalidate('token-a')
+        self.assertIsNone(auth_cache.get('token-a'))
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'auth': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                     'LOCATION': 'auth-cache-tests'},
+        },
+        AUTH_CACHE={'SHARED_CACHE': 'auth'})
+    def test_revocation_by_another_worker_drops_local_entry(self):
+        """Test that a local entry is not trusted once the shared entry is gone"""
+        auth_cache.set('token-a', self.user, self.customer)
+        # another process invalidates: only the shared tier is reachable from there
+        caches['auth'].delete(f"auth:{hash_token('token-a')}")
+
+        self.assertIsNone(auth_cache.get('token-a'))
+        self.assertEqual(auth_cache.stats()['size'], 0)
+
+    def test_hits_return_fresh_instances(self):
+        """Test that changing a cached user or customer doesn't leak into other requests"""
+        auth_cache.set('token-a', self.user, self.customer)
+
+        user, customer = auth_cache.get('token-a')
+        customer.phone_number = ''
+        user.first_name = 'Changed'
+
+        user, customer = auth_cache.get('token-a')
+        self.assertEqual(customer.phone_number, '+254700000000')
+        self.assertEqual(user.first_name, '')
+        self.assertIs(user.customer, customer)
+
+@pytest.mark.unit
+@override_settings(SESSION_TOKENS={'ENABLED': True, 'KEYS': {'k1': 'secret-one'}})
+class SessionTokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', first_name='Test')
+        self.customer = Customer.objects.create(user=self.user, phone_number='+254700000000')
+        self.auth = CookieAuthentication()
+        session_tokens.revocations.clear()
+
+    def authenticate(self, token):
+        request = MagicMock()
+        request.COOKIES = {'access_token': token}
+        return self.auth.authenticate(request)
+
+    def test_authenticates_without_queries(self):
+        """Test that a session token resolves to the user and customer in memory"""
+        token, _ = session_tokens.mint(self.customer)
+        self.authenticate(token)  # loads the revocation list
+
+        with self.assertNumQueries(0):
+            user, claims = self.authenticate(token)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.customer.pk, self.customer.pk)
+        self.assertTrue(session_tokens.is_session(claims))
+        # other fields load on first use
+        self.assertEqual(user.first_name, 'Test')
+
+    def test_rejects_bad_tokens(self):
+        """Test that tampered, expired and foreign tokens fail authentication"""
+        token, claims = session_tokens.mint(self.customer)
+        header, payload, signature = token.split('.')
+        expired = jwt.encode({**claims, 'exp': int(time.time()) - 60}, 'secret-one',
+                             algorithm='HS256', headers={'kid': 'k1'})
+        foreign = jwt.encode(claims, 'other-secret', algorithm='HS256', headers={'kid': 'k1'})
+        tampered = '.'.join([header, payload, signature[::-1]])
+
+        for bad in (expired, foreign, tampered):
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate(bad)
+
+    def test_key_rotation(self):
+        """Test that tokens of a retired key verify until it is removed"""
+        old, _ = session_tokens.mint(self.customer)
+        rotated = {'ENABLED': True, 'KEYS': {'k1': 'secret-one', 'k2': 'secret-two'},
+                   'SIGNING_KEY': 'k2'}
+        with override_settings(SESSION_TOKENS=rotated):
+            new, _ = session_tokens.mint(self.customer)
+            self.assertEqual(jwt.get_unverified_header(new)['kid'], 'k2')
+            self.assertEqual(self.authenticate(old)[0].pk, self.user.pk)
+        with override_settings(SESSION_TOKENS={**rotated, 'KEYS': {'k2': 'secret-two'}}):
+            self.assertEqual(self.authenticate(new)[0].pk, self.user.pk)
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate(old)
+
+    def test_revocation(self):
+        """Test that revoked tokens fail while newer ones of the user still work"""
+        first, first_claims = session_tokens.mint(self.customer)
+        second, _ = session_tokens.mint(self.customer)
+        session_tokens.revoke(first_claims)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(first)
+        self.authenticate(second)
+
+        call_command('revoke_sessions', 'testuser', stdout=StringIO())
+        later, _ = session_tokens.mint(self.customer)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(second)
+        self.assertEqual(self.authenticate(later)[0].pk, self.user.pk)
+
+    @patch('api.http_client.apost')
+    def test_revoked_user_cannot_refresh(self, mock_post):
+        """Test that the refresh cookie can't mint a new token after the user is revoked"""
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {'access_token': 'new_access_token'}
+        self.customer.refresh_token = 'test_refresh_token'
+        self.customer.save()
+        token, _ = session_tokens.mint(self.customer)
+        client = Client()
+        client.cookies['access_token'] = token
+        client.cookies['refresh_token'] = 'test_refresh_token'
+        self.addCleanup(single_flight.token_refreshes.clear)
+
+        call_command('revoke_sessions', 'testuser', stdout=StringIO())
+
+        self.assertEqual(client.get(reverse('profile')).status_code, 403)
+        self.assertEqual(client.post(reverse('refresh_token')).status_code, 401)
+        self.assertEqual(client.get(reverse('profile')).status_code, 403)
+        self.assertFalse(mock_post.called)
+
+    def test_google_tokens_still_authenticate(self):
+        """Test that cookies holding a Google access token use the database lookup"""
+        self.customer.access_token = 'ya29.google-token'
+        self.customer.save()
+        user, auth = self.authenticate('ya29.google-token')
+        self.assertEqual(user, self.user)
+        self.assertIsNone(auth)
+
+@pytest.mark.unit
+class HTTPClientTests(TestCase):
+    def tearDown(self):
+        http_client.reset()
+        circuit_breaker.reset()
+
+    def test_session_is_shared(self):
+        """Test that calls reuse one pooled session per process"""
+        self.assertIs(http_client.get_session(), http_client.get_session())
+
+    def test_endpoints_have_their_own_retry_budget(self):
+        """Test that only idempotent endpoints retry reads"""
+        session = http_client.get_session()
+        token_adapter = session.get_adapter('https://oauth2.googleapis.com/token')
+        userinfo_adapter = session.get_adapter(
+            'https://www.googleapis.com/oauth2/v3/userinfo')
+
+        self.assertEqual(token_adapter.max_retries.read, 0)
+        self.assertEqual(token_adapter.max_retries.connect, 2)
+        self.assertEqual(userinfo_adapter.max_retries.read, 1)
+
+    def test_request_uses_endpoint_url_and_timeout(self):
+        """Test that a call goes to the configured URL with its timeout"""
+        with patch.object(http_client.get_session(), 'request',
+                          return_value=MagicMock(status_code=200)) as mock_request:
+            http_client.post('google_token', data={'code': 'abc'})
+
+        mock_request.assert_called_once_with(
+            'POST', 'https://oauth2.googleapis.com/token',
+            data={'code': 'abc'}, timeout=(3.05, 10))
+
+    def test_session_never_stores_cookies(self):
+        """Test that a cookie set by one user's response is not sent for another"""
+        policy = http_client.get_session().cookies.get_policy()
+
+        self.assertIsInstance(policy, http_client.BlockAllCookies)
+        self.assertFalse(policy.set_ok(MagicMock(), MagicMock()))
+        self.assertFalse(policy.return_ok(MagicMock(), MagicMock()))
+
+    @patch('api.http_client.apost', side_effect=httpx.ReadTimeout('read timed out'))
+    def test_google_timeout_fails_fast(self, mock_post):
+        """Test that a slow Google answer becomes a 502 instead of a hung worker"""
+        response = Client().get(reverse('google_callback'), {'code': 'abc'})
+
+        self.assertEqual(response.status_code, 502)
+
+    def call_async(self, endpoint, handler, method='POST'):
+        """Run one async call against a mock transport, return (response, requests)"""
+        seen = []
+
+        def record(request):
+            seen.append(request)
+            return handler(request, len(seen))
+
+        def build(config):
+            return httpx.AsyncClient(
+                transport=httpx.MockTransport(record),
+                cookies=cookiejar.CookieJar(policy=http_client.BlockAllCookies()))
+
+        with patch('api.http_client.build_async_client', side_effect=build):
+            response = asyncio.run(http_client.arequest(method, endpoint))
+        return response, seen
+
+    def test_async_client_is_reused_within_a_loop(self):
+        """Test that the async client pools per event loop and closes with it"""
+        async def clients():
+            return await http_client.get_async_client(), await http_client.get_async_client()
+
+        first, second = asyncio.run(clients())
+        self.assertIs(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertIsNot(first, asyncio.run(clients())[0])
+
+    def test_wsgi_requests_leave_no_async_client_open(self):
+        """Test that clients built for async_to_sync's per-request loops are closed"""
+        built = []
+
+        def build(config):
+            client = httpx.AsyncClient(
+                transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+            built.append(client)
+            return client
+
+        with patch('api.http_client.build_async_client', side_effect=build):
+            for _ in range(2):
+                response = async_to_sync(http_client.aget)('google_userinfo')
+                self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(built), 2)
+        self.assertTrue(all(client.is_closed for client in built))
+
+    def test_async_token_exchange_retries_connect_only(self):
+        """Test that the async token exchange retries connects but never reads"""
+        def refuse_once(request, attempt):
+            if attempt == 1:
+                raise httpx.ConnectError('refused', request=request)
+            return httpx.Response(200, json={'access_token': 'abc'})
+
+        response, seen = self.call_async('google_token', refuse_once)
+        self.assertEqual(response.json(), {'access_token': 'abc'})
+        self.assertEqual(len(seen), 2)
+
+        def time_out(request, attempt):
+            raise httpx.ReadTimeout('slow', request=request)
+
+        with self.assertRaises(httpx.ReadTimeout):
+            self.call_async('google_token', time_out)
+
+    def test_async_userinfo_retries_server_errors(self):
+        """Test that userinfo retries 5xx answers within its budget"""
+        def unavailable(request, attempt):
+            return httpx.Response(503 if attempt < 3 else 200)
+
+        response, seen = self.call_async('google_userinfo', unavailable, 'GET')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(seen), 3)
+
+        def always_unavailable(request, attempt):
+            return httpx.Response(503)
+
+        response, seen = self.call_async('google_userinfo', always_unavailable, 'GET')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(seen), 3)
+
+    def test_async_client_never_stores_cookies(self):
+        """Test that the shared async client drops cookies set by Google"""
+        async def twice():
+            await http_client.aget('google_userinfo')
+            await http_client.aget('google_userinfo')
+
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(200, headers={'Set-Cookie': 'session=user-a'})
+
+        def build(config):
+            return httpx.AsyncClient(
+                transport=httpx.MockTransport(handler),
+                cookies=cookiejar.CookieJar(policy=http_client.BlockAllCookies()))
+
+        with patch('api.http_client.build_async_client', side_effect=build):
+            asyncio.run(twice())
+        self.assertNotIn('cookie', seen[1].headers)
+
+GOOGLE_APP = {'google': {'APPS': [{'client_id': 'test-client', 'secret': 'test-secret'}]}}
+
+
+def watch_blocking_cache_calls(test, shared):
+    """The names of sync methods of ``shared`` called on an event loop during ``test``"""
+    on_loop = []
+
+    def watch(method):
+        def call(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(method.__name__)
+            except RuntimeError:
+                # in a thread, e.g. through the async API's sync_to_async
+                pass
+            return method(*args, **kwargs)
+        return call
+
+    for name in ('get', 'set', 'add', 'incr', 'delete', 'delete_many'):
+        patcher = patch.object(shared, name, watch(getattr(shared, name)))
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return on_loop
+
+
+@pytest.mark.unit
+@override_settings(SOCIALACCOUNT_PROVIDERS=GOOGLE_APP)
+class GoogleIdTokenTests(TestCase):
+    """Logins against a local stand-in for Google with its own RSA signing key"""
+
+    def setUp(self):
+        # the OAuth views read the project settings module directly
+        patcher = patch.object(config_settings, 'SOCIALACCOUNT_PROVIDERS', GOOGLE_APP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.start()
+        google_id_token.jwks.clear()
+        cache.delete('google-jwks')
+
+    def start(self, **kwargs):
+        self.server, url, _, self.stats = start_google(tls=False, **kwargs)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(http_client.reset)
+        endpoints = {name: {'url': f'{url}/{path}'} for name, path in (
+            ('google_token', 'token'), ('google_userinfo', 'userinfo'), ('google_jwks', 'certs'))}
+        override = override_settings(HTTP_CLIENT={**django_settings.HTTP_CLIENT, 'ENDPOINTS': endpoints})
+        override.enable()
+        self.addCleanup(override.disable)
+        http_client.reset()
+
+    def login(self):
+        response = Client().get(reverse('google_callback'), {'code': 'abc'})
+        self.assertEqual(response.status_code, 302)
+        return response
+
+    def calls(self, path):
+        return self.stats.requests.get(path, 0)
+
+    def test_login_reads_profile_from_id_token(self):
+        """Test that logins verify the ID token with cached keys instead of calling userinfo"""
+        self.login()
+        self.login()
+
+        user = User.objects.get(email='bench.user@example.com')
+        self.assertEqual(user.first_name, 'Bench')
+        self.assertEqual(self.calls('/certs'), 1)
+        self.assertEqual(self.calls('/userinfo'), 0)
+
+    def test_wsgi_logins_reuse_pooled_connections(self):
+        """Test that WSGI logins call Google over the process's kept-alive connections"""
+        self.login()
+        connections = self.stats.connections
+        self.login()
+        self.login()
+
+        self.assertEqual(self.calls('/token'), 3)
+        self.assertEqual(self.stats.connections, connections)
+        self.assertEqual(dict(http_client._async_clients), {})
+
+    @override_settings(GOOGLE_ID_TOKEN={'MIN_REFETCH_INTERVAL': 0})
+    def test_rotated_key_is_fetched(self):
+        """Test that a token signed with a newly published key refetches the keys once"""
+        self.login()
+        self.server.keys.append(SigningKey())
+        self.login()
+
+        self.assertEqual(self.calls('/certs'), 2)
+        self.assertEqual(self.calls('/userinfo'), 0)
+
+    def test_forged_token_falls_back_to_userinfo(self):
+        """Test that a token not signed by the published key is not trusted"""
+        forged = SigningKey(kid=self.server.keys[0].kid).id_token('test-client')
+        genuine = self.server.keys[0].id_token('test-client')
+        other_app = self.server.keys[0].id_token('other-client')
+
+        self.assertIsNone(asyncio.run(google_id_token.user_info({'id_token': forged})))
+        self.assertIsNone(asyncio.run(google_id_token.user_info({'id_token': other_app})))
+        profile = asyncio.run(google_id_token.user_info({'id_token': genuine}))
+        self.assertEqual(profile['email'], 'bench.user@example.com')
+
+    @override_settings(GOOGLE_ID_TOKEN={'MIN_REFETCH_INTERVAL': 0})
+    def test_keys_expire_with_max_age(self):
+        """Test that the keys are fetched again once Cache-Control max-age has passed"""
+        self.server.shutdown()
+        self.start(jwks_max_age=0)
+        self.login()
+        self.login()
+
+        self.assertEqual(self.calls('/certs'), 2)
+        self.assertEqual(self.calls('/userinfo'), 0)
+
+    @override_settings(GOOGLE_ID_TOKEN={'REFRESH_AHEAD': 1.0})
+    def test_keys_refresh_in_background(self):
+        """Test that keys near expiry are refreshed by a background fetch"""
+        self.login()
+        self.login()
+
+        deadline = time.time() + 5
+        while self.calls('/certs') < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.calls('/certs'), 2)
+        self.assertEqual(self.calls('/userinfo'), 0)
+
+    @override_settings(GOOGLE_ID_TOKEN={'CACHE': 'default'})
+    def test_keys_are_shared_between_workers(self):
+        """Test that a worker reuses the keys another fetched into the shared cache"""
+        self.login()
+        google_id_token.jwks.clear()  # as a fresh worker
+        self.login()
+
+        self.assertEqual(self.calls('/certs'), 1)
+
+    @override_settings(GOOGLE_ID_TOKEN={'CACHE': 'default', 'REFRESH_AHEAD': 1.0})
+    def test_shared_keys_use_the_async_cache_api(self):
+        """Test that reading, storing and refreshing the shared keys never blocks the loop"""
+        keys = ['google-jwks', 'google-jwks:refreshing']
+        cache.delete_many(keys)
+        self.addCleanup(cache.delete_many, keys)
+        on_loop = watch_blocking_cache_calls(self, caches['default'])
+        self.login()
+        google_id_token.jwks.clear()
+        self.login()
+
+        # the refresh the second login started, in its own thread
+        deadline = time.time() + 5
+        while self.calls('/certs') < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(on_loop, [])
+        self.assertEqual(self.calls('/userinfo'), 0)
+
+
+@pytest.mark.unit
+@override_settings(SOCIALACCOUNT_PROVIDERS=GOOGLE_APP)
+class SingleFlightTests(TestCase):
+    """Concurrent token refreshes against a local stand-in for Google"""
+
+    def setUp(self):
+        patcher = patch.object(config_settings, 'SOCIALACCOUNT_PROVIDERS', GOOGLE_APP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server, url, _, self.stats = start_google(tls=False, latency=0.2)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(http_client.reset)
+        override = override_settings(HTTP_CLIENT={
+            **django_settings.HTTP_CLIENT, 'ENDPOINTS': {'google_token': {'url': f'{url}/token'}}})
+        override.enable()
+        self.addCleanup(override.disable)
+        http_client.reset()
+        self.addCleanup(single_flight.token_refreshes.clear)
+
+        user = User.objects.create_user(username='tabs', email='tabs@example.com')
+        self.customer = Customer.objects.create(
+            user=user, access_token='old_access_token', refresh_token='tabs_refresh_token')
+
+    async def refresh(self):
+        request = RequestFactory().post(reverse('refresh_token'))
+        request.COOKIES['refresh_token'] = 'tabs_refresh_token'
+        return await views.refresh_token(request)
+
+    def counting(self, seconds=0.2, status=200):
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(seconds)
+            return {'status': status, 'call': len(calls)}
+        return calls, work
+
+    async def test_concurrent_refreshes_share_one_exchange(self):
+        """Test that 100 simultaneous refreshes make one call to Google"""
+        responses = await asyncio.gather(*(self.refresh() for _ in range(100)))
+
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(self.stats.requests.get('/token'), 1)
+        self.assertEqual(len({response.cookies['access_token'].value for response in responses}), 1)
+        await self.customer.arefresh_from_db()
+        self.assertEqual(self.customer.access_token, responses[0].cookies['access_token'].value)
+
+    async def test_result_is_reused_until_customer_changes(self):
+        """Test that a refresh right after another reuses it, unless the customer was saved"""
+        await self.refresh()
+        await self.refresh()
+        self.assertEqual(self.stats.requests.get('/token'), 1)
+
+        await self.customer.asave()
+        await self.refresh()
+        self.assertEqual(self.stats.requests.get('/token'), 2)
+
+    def test_threads_join_one_flight(self):
+        """Test that callers in other threads and event loops wait for the same call"""
+        flight = single_flight.SingleFlight('test')
+        calls, work = self.counting()
+        results = []
+
+        def call():
+            results.append(asyncio.run(flight.run('key', work)))
+        threads = [threading.Thread(target=call) for _ in range(100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'status': 200, 'call': 1}] * 100)
+
+    def test_outage_is_not_kept(self):
+        """Test that results ``keep`` rejects are not reused once the flight lands"""
+        flight = single_flight.SingleFlight('test')
+        calls, work = self.counting(seconds=0, status=502)
+        keep = lambda outcome: outcome['status'] != 502
+
+        asyncio.run(flight.run('key', work, keep))
+        asyncio.run(flight.run('key', work, keep))
+
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(SINGLE_FLIGHT={'CACHE': 'default', 'POLL_INTERVAL': 0.01})
+    def test_workers_coalesce_through_shared_cache(self):
+        """Test that a worker waits for the call another worker holds the lock for"""
+        first, second = single_flight.SingleFlight('test'), single_flight.SingleFlight('test')
+        calls, work = self.counting()
+        results = {}
+        cache.delete_many(['flight:test:key:result', 'flight:test:key:lock'])
+
+        def call(name, flight):
+            results[name] = asyncio.run(flight.run('key', work))
+        threads = [threading.Thread(target=call, args=('first', first))]
+        threads[0].start()
+        while not cache.get('flight:test:key:lock'):
+            time.sleep(0.01)
+        threads.append(threading.Thread(target=call, args=('second', second)))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results['first'], results['second'])
+        cache.delete('flight:test:key:result')
+
+
+@pytest.mark.unit
+class AccountUpsertTests(TestCase):
+    PROFILE = {'email': 'ada@example.com', 'given_name': 'Ada', 'family_name': 'Lovelace'}
+
+    def test_first_login_creates_user_and_customer(self):
+        """Test that a first login creates a user without a password and their customer"""
+        customer, created = accounts.upsert_google_customer(self.PROFILE, 'access', 'refresh')
+
+        self.assertTrue(created)
+        customer = Customer.objects.select_related('user').get(pk=customer.pk)
+        self.assertEqual(customer.user.username, 'ada')
+        self.assertEqual(customer.user.first_name, 'Ada')
+        self.assertFalse(customer.user.has_usable_password())
+        self.assertEqual(customer.access_token_hash, hash_token('access'))
+        self.assertEqual(customer.refresh_token_hash, hash_token('refresh'))
+
+    @skipUnless(connection.vendor == 'postgresql', "the single-statement upsert is PostgreSQL's")
+    def test_login_is_one_query(self):
+        """Test that first and returning logins each cost one query"""
+        with self.assertNumQueries(1):
+            accounts.upsert_google_customer(self.PROFILE, 'access', 'refresh')
+        with self.assertNumQueries(1):
+            accounts.upsert_google_customer(self.PROFILE, 'access2', 'refresh2')
+
+    def test_returning_login_updates_tokens(self):
+        """Test that a returning login keeps the customer and drops its old cached token"""
+        first, _ = accounts.upsert_google_customer(self.PROFILE, 'old', 'refresh')
+        Customer.objects.filter(pk=first.pk).update(phone_number='+254700000000')
+        customer = Customer.objects.select_related('user').get(pk=first.pk)
+        auth_cache.set('old', customer.user, customer)
+
+        second, created = accounts.upsert_google_customer(self.PROFILE, 'new', 'refresh2')
+
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        self.assertIsNone(auth_cache.get('old'))
+        customer.refresh_from_db()
+        self.assertEqual(customer.access_token, 'new')
+        self.assertEqual(customer.refresh_token_hash, hash_token('refresh2'))
+        self.assertEqual(customer.phone_number, '+254700000000')
+
+    def test_username_clash_gets_deterministic_suffix(self):
+        """Test that someone else's username is suffixed with a digest of the email"""
+        User.objects.create_user(username='ada', email='ada@elsewhere.example')
+
+        customer, created = accounts.upsert_google_customer(self.PROFILE, 'access', 'refresh')
+
+        self.assertTrue(created)
+        self.assertEqual(User.objects.get(pk=customer.user_id).username,
+                         accounts.usernames('ada@example.com')[1])
+        self.assertEqual(User.objects.filter(email='ada@example.com').count(), 1)
+
+
+@pytest.mark.integration
+@skipUnless(connection.vendor == 'postgresql', "the single-statement upsert is PostgreSQL's")
+class AccountUpsertRaceTests(SimpleTestCase):
+    """First logins racing on their own connections, committed for real"""
+    databases = {'default'}
+
+    def test_concurrent_first_logins_create_one_user(self):
+        email = f'race-{uuid.uuid4().hex[:8]}@example.com'
+        self.addCleanup(lambda: User.objects.filter(email=email).delete())
+        barrier = threading.Barrier(20)
+        results = []
+
+        def login():
+            try:
+                barrier.wait()
+                results.append(accounts.upsert_google_customer({'email': email}, None, None))
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=login) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len({customer.pk for customer, _ in results}), 1)
+        self.assertEqual(sum(created for _, created in results), 1)
+        self.assertEqual(User.objects.filter(email=email).count(), 1)
+
+
+BREAKERS = {'BREAKERS': {
+    'google': {'FAILURE_THRESHOLD': 3, 'RESET_TIMEOUT': 0.2, 'MAX_CONCURRENCY': 2},
+    'sms': {'FAILURE_THRESHOLD': 2, 'RESET_TIMEOUT': 60},
+}}
+
+
+@pytest.mark.unit
+@override_settings(CIRCUIT_BREAKERS=BREAKERS)
+class CircuitBreakerTests(TestCase):
+    """Google and the SMS gateway failing, as local stand-ins with injected faults"""
+
+    def setUp(self):
+        self.server, url, _, self.stats = start_google(tls=False)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(http_client.reset)
+        override = override_settings(HTTP_CLIENT={
+            **django_settings.HTTP_CLIENT, 'ENDPOINTS': {'google_token': {'url': f'{url}/token'}}})
+        override.enable()
+        self.addCleanup(override.disable)
+        http_client.reset()
+        circuit_breaker.reset()
+        self.addCleanup(circuit_breaker.reset)
+
+    def exchange(self):
+        return asyncio.run(http_client.apost('google_token', data={'grant_type': 'refresh_token'}))
+
+    def calls(self):
+        return self.stats.requests.get('/token', 0)
+
+    def test_failures_open_the_circuit(self):
+        """Test that once Google keeps failing, calls are refused without reaching it"""
+        self.server.fault_status = 503
+        for _ in range(3):
+            self.assertEqual(self.exchange().status_code, 503)
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.OPEN)
+
+        start = time.perf_counter()
+        for _ in range(100):
+            with self.assertRaises(httpx.ConnectError):
+                self.exchange()
+        self.assertLess((time.perf_counter() - start) / 100, 0.01)
+        self.assertEqual(self.calls(), 3)
+
+    def test_client_errors_are_not_failures(self):
+        """Test that 4xx answers, like an expired grant, leave the circuit closed"""
+        self.server.fault_status = 400
+        for _ in range(5):
+            self.exchange()
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.CLOSED)
+
+    def test_half_open_probe_closes_the_circuit(self):
+        """Test that after the reset timeout one probe is let through and closes the circuit"""
+        self.server.fault_status = 503
+        for _ in range(3):
+            self.exchange()
+        self.server.fault_status = None
+        time.sleep(0.25)
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.HALF_OPEN)
+
+        self.assertEqual(self.exchange().status_code, 200)
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.CLOSED)
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        """Test that a failing probe keeps the circuit open for another reset timeout"""
+        self.server.fault_status = 503
+        for _ in range(3):
+            self.exchange()
+        time.sleep(0.25)
+
+        self.exchange()
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.OPEN)
+        self.assertEqual(self.calls(), 4)
+
+    def test_bulkhead_caps_concurrent_calls(self):
+        """Test that calls beyond the cap fail at once instead of queueing behind slow ones"""
+        self.server.fault_delay = 0.3
+
+        async def burst():
+            return await asyncio.gather(*(
+                http_client.apost('google_token', data={}) for _ in range(5)),
+                return_exceptions=True)
+        results = asyncio.run(burst())
+
+        self.assertEqual(sum(isinstance(result, httpx.ConnectError) for result in results), 3)
+        self.assertEqual(self.calls(), 2)
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.CLOSED)
+
+    @override_settings(CIRCUIT_BREAKERS={**BREAKERS, 'CACHE': 'default', 'SYNC_INTERVAL': 0})
+    def test_circuit_is_shared_between_workers(self):
+        """Test that a circuit opened by one worker refuses calls in another"""
+        cache.delete_many(['breaker:google:open_until', 'breaker:google:failures'])
+        self.server.fault_status = 503
+        for _ in range(3):
+            self.exchange()
+        other = circuit_breaker.CircuitBreaker('google')  # another worker's
+
+        with self.assertRaises(circuit_breaker.CircuitOpen):
+            with other.guard():
+                pass
+
+    def watch_cache(self, name):
+        """Patch the SharedState method ``name`` to log whether the breaker's lock is held"""
+        original = getattr(circuit_breaker.SharedState, name)
+        breaker = circuit_breaker.get('google')
+
+        def call(state, *args):
+            self.held.append((name, breaker._lock.locked()))
+            return original(state, *args)
+        return patch.object(circuit_breaker.SharedState, name, call)
+
+    @override_settings(CIRCUIT_BREAKERS={**BREAKERS, 'CACHE': 'default', 'SYNC_INTERVAL': 0})
+    def test_shared_state_is_used_outside_the_lock(self):
+        """Test that a slow cache never blocks other threads on the breaker's lock"""
+        keys = [f'breaker:google:{key}' for key in ('open_until', 'probe', 'failures')]
+        cache.delete_many(keys)
+        self.addCleanup(cache.delete_many, keys)
+        breaker, self.held = circuit_breaker.get('google'), []
+
+        with self.watch_cache('get_open_until'), self.watch_cache('start_probe'), \
+                self.watch_cache('add_failure'), self.watch_cache('set_open_until'):
+            for _ in range(3):
+                with self.assertRaises(ValueError), breaker.guard():
+                    raise ValueError('down')
+            time.sleep(0.25)
+            with breaker.guard():
+                pass
+
+        self.assertEqual({name for name, _ in self.held},
+                         {'get_open_until', 'start_probe', 'add_failure', 'set_open_until'})
+        self.assertEqual([name for name, locked in self.held if locked], [])
+
+    @override_settings(CIRCUIT_BREAKERS={**BREAKERS, 'CACHE': 'default', 'SYNC_INTERVAL': 0})
+    def test_async_calls_use_the_async_cache_api(self):
+        """Test that the async path never makes a blocking cache call on the event loop"""
+        keys = [f'breaker:google:{key}' for key in ('open_until', 'probe', 'failures')]
+        cache.delete_many(keys)
+        self.addCleanup(cache.delete_many, keys)
+        on_loop = watch_blocking_cache_calls(self, caches['default'])
+        self.server.fault_status = 503
+        for _ in range(3):
+            self.exchange()
+        time.sleep(0.25)
+        self.server.fault_status = None
+        self.exchange()
+
+        self.assertEqual(circuit_breaker.get('google').state(), circuit_breaker.CLOSED)
+        self.assertEqual(on_loop, [])
+
+    def test_open_sms_circuit_defers_the_outbox(self):
+        """Test that rows refused by an open circuit keep their attempt and wait"""
+        gateway, url, stats = start_gateway(latency=0)
+        self.addCleanup(gateway.shutdown)
+        gateway.fault_status = 500
+        service = utils.SMSGateway('sandbox', 'test')
+        service.base_url = f'{url}/version1'
+        patcher = patch.object(utils, 'sms', service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        entries = SMSOutbox.objects.bulk_create([
+            SMSOutbox(phone_number=f'+25470000000{i}', message=f'Message {i}')
+            for i in range(4)])
+
+        totals = outbox.drain(concurrency=1, config={**outbox.get_config(), 'BATCH_WINDOW': 0})
+
+        self.assertEqual(totals['sent'], 0)
+        self.assertEqual(stats.requests, 2)
+        self.assertEqual(circuit_breaker.get('sms').state(), circuit_breaker.OPEN)
+        attempts = sorted(SMSOutbox.objects.filter(
+            id__in=[entry.id for entry in entries]).values_list('attempts', flat=True))
+        self.assertEqual(attempts, [0, 0, 1, 1])
+
+    @override_settings(SMS_TIMEOUT=(1, 0.2))
+    def test_sms_gateway_gives_up_after_the_timeout(self):
+        """Test that a gateway that doesn't answer fails the send instead of hanging"""
+        gateway, url, stats = start_gateway(latency=0)
+        self.addCleanup(gateway.shutdown)
+        service = utils.SMSGateway('sandbox', 'test')
+        service.base_url = f'{url}/version1'
+
+        response = service.send('Hello', ['+254700000000', '+254711111111'])
+        self.assertEqual(
+            [recipient['number'] for recipient in response['SMSMessageData']['Recipients']],
+            ['+254700000000', '+254711111111'])
+
+        gateway.fault_delay = 1
+        start = time.perf_counter()
+        with self.assertRaises(requests.Timeout):
+            service.send('Hello', ['+254700000000'])
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+        gateway.fault_delay, gateway.fault_status = 0, 500
+        with self.assertRaises(utils.SMSGatewayError):
+            service.send('Hello', ['+254700000000'])
+
+
+@pytest.mark.unit
+@override_settings(REPLICA_DATABASES=['replica_1'], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, write=False):
+        """Run a request through the middleware, return (read alias, response)"""
+        seen = {}
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Orders)
+            seen['read'] = self.router.db_for_read(Orders)
+            return HttpResponse()
+
+        response = routers.ReplicaRoutingMiddleware(view)(request)
+        return seen['read'], response
+
+    def test_reads_outside_requests_use_primary(self):
+        """Test that management commands and workers never read from replicas"""
+        self.assertEqual(self.router.db_for_read(Orders), 'default')
+        self.assertEqual(self.router.db_for_write(Orders), 'default')
+
+    def test_safe_request_reads_from_replica(self):
+        """Test that a GET without recent writes reads from a replica"""
+        alias, response = self.route(self.factory.get('/api/orders/'))
+
+        self.assertEqual(alias, 'replica_1')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    @override_settings(REPLICA_DATABASES=['replica_1', 'replica_2'])
+    def test_request_reads_from_one_replica(self):
+        """Test that every read of a request goes to the same replica"""
+        seen = set()
+
+        def view(request):
+            seen.update(self.router.db_for_read(Orders) for _ in range(50))
+            return HttpResponse()
+
+        for _ in range(10):
+            seen.clear()
+            routers.ReplicaRoutingMiddleware(view)(self.factory.get('/api/orders/'))
+            self.assertEqual(len(seen), 1)
+            self.assertIn(seen.pop(), ['replica_1', 'replica_2'])
+
+    def test_unsafe_request_reads_from_primary(self):
+        """Test that reads made while handling a POST use the primary"""
+        alias, _ = self.route(self.factory.post('/api/orders/'))
+
+        self.assertEqual(alias, 'default')
+
+    def test_write_pins_request_and_client(self):
+        """Test that a write moves later reads and the client to the primary"""
+        alias, response = self.route(self.factory.get('/callback/'), write=True)
+
+        self.assertEqual(alias, 'default')
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+
+        request = self.factory.get('/api/orders/')
+        request.COOKIES[routers.PIN_COOKIE] = response.cookies[routers.PIN_COOKIE].value
+        alias, _ = self.route(request)
+        self.assertEqual(alias, 'default')
+
+    def test_expired_or_invalid_pin_is_ignored(self):
+        """Test that an old or malformed pin cookie does not pin reads"""
+        for value in (str(int(time.time()) - 1), 'garbage'):
+            request = self.factory.get('/api/orders/')
+            request.COOKIES[routers.PIN_COOKIE] = value
+            alias, _ = self.route(request)
+            self.assertEqual(alias, 'replica_1')
+
+    def test_reads_inside_transactions_use_primary(self):
+        """Test that reads inside an atomic block see the primary"""
+        with patch.object(connections['default'], 'in_atomic_block', True):
+            alias, _ = self.route(self.factory.get('/api/orders/'))
+
+        self.assertEqual(alias, 'default')
+
+    def test_async_request_flags_writes(self):
+        """Test that writes made from sync_to_async threads pin the client"""
+        async def view(request):
+            await sync_to_async(self.router.db_for_write)(Orders)
+            return HttpResponse()
+
+        middleware = routers.ReplicaRoutingMiddleware(view)
+        response = asyncio.run(middleware(self.factory.get('/callback/')))
+
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_middleware_chain_is_async_capable(self):
+        """Test that ASGI requests never block a thread on a sync-only middleware"""
+        for path in django_settings.MIDDLEWARE:
+            self.assertTrue(import_string(path).async_capable, path)
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas_configured(self):
+        """Test that without replicas nothing is routed or pinned"""
+        alias, response = self.route(self.factory.get('/'), write=True)
+
+        self.assertEqual(alias, 'default')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+class RateThrottle(throttling.UserRateThrottle):
+    rate = '10/minute'
+
+
+def throttled_requests(count, user_id=7):
+    """Run ``count`` requests through a fresh throttle, return how many passed"""
+    request = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=user_id))
+    return sum(RateThrottle().allow_request(request, None) for _ in range(count))
+
+
+@pytest.mark.unit
+class ThrottlingTests(SimpleTestCase):
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), 'throttle.sqlite3')
+        self.settings_override = override_settings(
+            THROTTLE={'STORE': 'sqlite', 'SQLITE_PATH': path})
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_limit_is_shared_across_processes(self):
+        """Test that four workers together are allowed the rate once, not four times"""
+        context = multiprocessing.get_context('fork')
+        with context.Pool(4) as pool:
+            allowed = pool.map(throttled_requests, [8] * 4)
+
+        self.assertEqual(sum(allowed), 10)
+
+    def test_rejected_requests_are_not_counted(self):
+        """Test that hammering while throttled does not extend the block"""
+        self.assertEqual(throttled_requests(50), 10)
+
+        store = throttling.get_store()
+        window = int(time.time() // 60)
+        count, _ = store.hit(f'throttle_user_7:{window}', 'unused', ttl=120)
+        self.assertEqual(count, 11)
+
+    def test_previous_window_weight_decays(self):
+        """Test that the previous window counts in proportion to its overlap"""
+        start = 600.0
+        with patch.object(RateThrottle, 'timer', return_value=start + 59):
+            self.assertEqual(throttled_requests(10), 10)
+
+        # 25% into the next window three quarters of those still count
+        throttle = RateThrottle()
+        request = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=7))
+        with patch.object(RateThrottle, 'timer', return_value=start + 75):
+            allowed = sum(throttle.allow_request(request, None) for _ in range(5))
+        self.assertEqual(allowed, 2)
+        self.assertAlmostEqual(throttle.wait(), 3.0)
+
+    def test_cache_store(self):
+        """Test that the Django cache store counts and undoes atomically"""
+        store = throttling.CacheCounterStore('default')
+        key = f'test:{uuid.uuid4().hex}'
+
+        self.assertEqual(store.hit(key, 'missing', ttl=60), (1, 0))
+        self.assertEqual(store.hit(key, 'missing', ttl=60), (2, 0))
+        store.undo(key)
+        self.assertEqual(store.hit(f'{key}:next', key, ttl=60), (1, 1))
+
+@pytest.mark.unit
+@override_settings(INSTRUMENTATION={'ENABLED': True, 'DUPLICATE_QUERY_THRESHOLD': 3})
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def serve(self, view):
+        return instrumentation.InstrumentationMiddleware(view)(self.factory.get('/'))
+
+    def test_server_timing_header(self):
+        """Test that queries and external calls are reported per request"""
+        def view(request):
+            User.objects.exists()
+            User.objects.count()
+            with instrumentation.external_call('google_token'):
+                pass
+            return HttpResponse()
+
+        header = self.serve(view)['Server-Timing']
+
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="2 queries", '
+                                 r'google_token;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_repeated_query_is_reported(self):
+        """Test that running one query per item logs an N+1 warning"""
+        def view(request):
+            for pk in range(3):
+                User.objects.filter(pk=pk).exists()
+            return HttpResponse()
+
+        with self.assertLogs('api.instrumentation', 'WARNING') as logs:
+            self.serve(view)
+
+        self.assertIn('ran the same query 3 times', logs.output[0])
+
+    def test_queries_outside_requests_are_not_recorded(self):
+        """Test that the execute wrapper is inert without a request"""
+        def view(request):
+            return HttpResponse()
+
+        User.objects.exists()
+        self.assertIn('desc="0 queries"', self.serve(view)['Server-Timing'])
+
+    @override_settings(INSTRUMENTATION={'ENABLED': False})
+    def test_disabled(self):
+        """Test that the middleware removes itself from the chain"""
+        with self.assertRaises(MiddlewareNotUsed):
+            instrumentation.InstrumentationMiddleware(lambda request: HttpResponse())
+
+    def test_metrics_endpoint(self):
+        """Test that requests show up in the histograms at /metrics"""
+        self.client.get('/oauth/')
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_bucket{view="login",method="GET",le="+Inf"}',
+                      response.content)
+        self.assertIn(b'http_request_db_queries_count{view="login"}', response.content)
+
+
+def count_in_child(times):
+    """Count SMS sends in a forked process and flush them like a worker would"""
+    for _ in range(times):
+        metrics.SMS_SENDS.labels('fork', 'sent').inc()
+    metrics.REGISTRY.flush()
+    return os.getpid()
+
+
+@pytest.mark.unit
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.counter = metrics.Counter('jobs', 'Jobs run', ['kind'], registry=self.registry)
+        self.histogram = metrics.Histogram(
+            'job_seconds', 'Job time', buckets=(0.1, 1), registry=self.registry)
+
+    def test_render(self):
+        """Test the Prometheus text format of counters and histograms"""
+        self.counter.labels('say "hi"').inc(2)
+        for value in (0.05, 0.5, 5):
+            self.histogram.observe(value)
+
+        text = self.registry.render()
+
+        self.assertIn('# TYPE jobs counter\njobs_total{kind="say \\"hi\\""} 2.0\n', text)
+        self.assertIn('job_seconds_bucket{le="0.1"} 1.0\n'
+                      'job_seconds_bucket{le="1.0"} 2.0\n'
+                      'job_seconds_bucket{le="+Inf"} 3.0\n'
+                      'job_seconds_sum 5.55\n'
+                      'job_seconds_count 3.0\n', text)
+
+    def test_label_count_is_checked(self):
+        with self.assertRaises(ValueError):
+            self.counter.labels()
+
+    def test_processes_are_summed(self):
+        """Test that workers' flushed values add up, also after they exit"""
+        directory = tempfile.mkdtemp()
+        with override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+            with multiprocessing.get_context('fork').Pool(3) as pool:
+                pids = pool.map(count_in_child, [10] * 3)
+            metrics.SMS_SENDS.labels('fork', 'sent').inc()
+
+            body, _ = metrics.render()
+            self.assertIn('sms_sends_total{mode="fork",outcome="sent"} 31.0', body)
+
+            for pid in set(pids):
+                metrics.mark_process_dead(pid, directory)
+            body, _ = metrics.render()
+            self.assertIn('sms_sends_total{mode="fork",outcome="sent"} 31.0', body)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['.lock', f'{os.getpid()}.json', 'archive.json'])
+
+    def test_values_do_not_survive_fork(self):
+        """Test that a forked worker starts from zero instead of recounting its parent"""
+        self.counter.labels('x').inc()
+        self.registry.after_fork()
+        self.assertEqual(self.counter.labels('x').value, 0)
+
+    @override_settings(METRICS={'TOKEN': 'secret'})
+    def test_metrics_token(self):
+        """Test that a configured token is required to read /metrics"""
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+@pytest.mark.unit
+@skipUnless(connection.vendor == 'postgresql', "orders are only partitioned on PostgreSQL")
+class OrderPartitionTests(TestCase):
+    OLD_MONTH = date(2021, 3, 1)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.customer = Customer.objects.create(user=self.user, phone_number='+254700000000')
+        self.archive_dir = tempfile.mkdtemp()
+
+    def partition_of(self, order):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM api_orders WHERE id = %s',
+                           [order.pk])
+            return cursor.fetchone()[0]
+
+    def old_order(self, **kwargs):
+        order = Orders.objects.create(customer=self.customer, total_amount=5, **kwargs)
+        order.order_date = datetime(2021, 3, 15, 12, tzinfo=dt_timezone.utc)
+        order.save()
+        return order
+
+    def test_coming_months_are_created(self):
+        """Test that migrate leaves partitions up to MONTHS_AHEAD months ahead"""
+        current = partitions.month_of(timezone.now())
+        attached = partitions.attached_partitions()
+        for offset in range(partitions.get_config()['MONTHS_AHEAD'] + 1):
+            self.assertIn(partitions.add_months(current, offset), attached)
+
+        order = Orders.objects.create(customer=self.customer, total_amount=5)
+        self.assertEqual(self.partition_of(order), partitions.partition_name(current))
+
+    def test_parked_rows_move_to_their_month(self):
+        """Test that rows of a month without a partition are moved once it is created"""
+        order = self.old_order()
+        self.assertEqual(self.partition_of(order), partitions.DEFAULT_PARTITION)
+
+        self.assertIn(self.OLD_MONTH, partitions.ensure_partitions())
+
+        self.assertEqual(self.partition_of(order), 'api_orders_y2021m03')
+        self.assertEqual(Orders.objects.get(pk=order.pk).order_code, order.order_code)
+
+    def test_codes_are_unique_across_partitions(self):
+        """Test that a code taken in one month is rejected in another"""
+        order = self.old_order()
+
+        with self.assertRaises(IntegrityError):
+            Orders.objects.create(customer=self.customer, total_amount=5,
+                                  order_code=order.order_code)
+        self.assertEqual(OrderCode.objects.get(code=order.order_code).order_id, order.pk)
+
+    def test_archive_and_restore(self):
+        """Test that an archived month leaves the table and comes back on restore"""
+        order = self.old_order()
+        partitions.ensure_partitions()
+
+        out = StringIO()
+        call_command('order_partitions', 'archive', '--before', '2021-04',
+                     '--dir', self.archive_dir, stdout=out)
+
+        self.assertIn('Archived 1 orders of 2021-03', out.getvalue())
+        self.assertFalse(Orders.objects.filter(pk=order.pk).exists())
+        self.assertFalse(SMSOutbox.objects.filter(order_id=order.pk).exists())
+        self.assertEqual(partitions.archived_months(self.archive_dir), [self.OLD_MONTH])
+        # the code stays taken while the order is archived
+        self.assertTrue(Orders.code_taken(order.order_code))
+
+        call_command('order_partitions', 'restore', '2021-03',
+                     '--dir', self.archive_dir, stdout=StringIO())
+
+        restored = Orders.objects.get(pk=order.pk)
+        self.assertEqual(restored.order_code, order.order_code)
+        self.assertEqual(restored.order_date, order.order_date)
+        self.assertEqual(self.partition_of(restored), 'api_orders_y2021m03')
+
+    def test_current_month_is_not_archived(self):
+        """Test that archiving refuses months still receiving orders"""
+        with self.assertRaises(ValueError):
+            partitions.archive_partition(partitions.month_of(timezone.now()), self.archive_dir)
+
+
+@pytest.mark.unit
+class BenchmarkSuiteTests(TestCase):
+    def report(self, **scenario):
+        entry = {'rps': 500, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0,
+                 'queries': 3, 'errors': 0}
+        return {'meta': {}, 'scenarios': {'orders': {**entry, **scenario}}}
+
+    def test_seed_and_cleanup(self):
+        """Test that seeded customers authenticate and cleanup removes all they own"""
+        prefix, tokens = suite.seed(users=3, orders_per_user=4)
+        customers = Customer.objects.filter(user__username__startswith=prefix)
+        self.assertEqual(customers.count(), 3)
+        self.assertEqual(Orders.objects.filter(customer__in=customers).count(), 12)
+        self.assertTrue(customers.filter(access_token_hash=hash_token(tokens[0])).exists())
+        self.assertEqual(
+            OrderDailyRollup.objects.filter(customer__in=customers)
+            .aggregate(total=Sum('order_count'))['total'], 12)
+
+        suite.cleanup(prefix)
+        self.assertFalse(User.objects.filter(username__startswith=prefix).exists())
+        self.assertEqual(Orders.objects.count(), 0)
+        self.assertEqual(OrderCode.objects.count(), 0)
+
+    def test_compare_within_tolerance(self):
+        """Test that small moves in throughput and latency are not regressions"""
+        current = self.report(rps=450, p50_ms=11.0, p99_ms=30.9)
+        self.assertEqual(suite.compare(self.report(), current, tolerance=0.2), [])
+
+    def test_compare_flags_regressions(self):
+        """Test that slower, less throughput, more queries and errors are reported"""
+        current = self.report(rps=300, p95_ms=40.0, queries=4, errors=2)
+        regressions = suite.compare(self.report(), current, tolerance=0.2)
+        self.assertEqual(regressions, [
+            'orders: rps 500 -> 300',
+            'orders: p95_ms 20.0 -> 40.0',
+            'orders: queries per request 3 -> 4',
+            'orders: errors 0 -> 2',
+        ])
+
 # Integration Tests
 @pytest.mark.integration
 class CustomerAPITests(APITestCase):
@@ -236,8 +1880,8 @@ class OrderAPITests(APITestCase):
             response = self.client.get(self.url)
             
             self.assertEqual(response.status_code, status.HTTP_200_OK)
-            self.assertEqual(len(response.data), 1)
-            self.assertEqual(response.data[0]['total_amount'], '1000.00')
+            self.assertEqual(len(response.data['results']), 1)
+            self.assertEqual(response.data['results'][0]['total_amount'], '1000.00')
     
     def test_create_order(self):
         """Test creating a new order"""
@@ -263,12 +1907,12 @@ class OAuthFlowTests(TestCase):
     def setUp(self):
         self.client = Client()
     
-    @patch('requests.get')
-    @patch('requests.post')
+    @patch('api.http_client.aget')
+    @patch('api.http_client.apost')
     def test_google_oauth_flow(self, mock_post, mock_get):
         """Test the complete Google OAuth flow"""
         # Mock the token exchange response
-        mock_post.return_value.status_code = 200
+        mock_post.return_value = MagicMock(status_code=200)
         mock_post.return_value.json.return_value = {
             'access_token': 'new_access_token',
             'refresh_token': 'new_refresh_token',
@@ -276,7 +1920,7 @@ class OAuthFlowTests(TestCase):
         }
         
         # Mock the user info response
-        mock_get.return_value.status_code = 200
+        mock_get.return_value = MagicMock(status_code=200)
         mock_get.return_value.json.return_value = {
             'email': 'newuser@example.com',
             'given_name': 'New',
@@ -304,7 +1948,7 @@ class OAuthFlowTests(TestCase):
         self.assertEqual(customer.access_token, 'new_access_token')
         self.assertEqual(customer.refresh_token, 'new_refresh_token')
     
-    @patch('requests.post')
+    @patch('api.http_client.apost')
     def test_token_refresh(self, mock_post):
         """Test refreshing an access token"""
         # Create a user with a refresh token
@@ -321,7 +1965,7 @@ class OAuthFlowTests(TestCase):
         )
         
         # Mock the refresh token response
-        mock_post.return_value.status_code = 200
+        mock_post.return_value = MagicMock(status_code=200)
         mock_post.return_value.json.return_value = {
             'access_token': 'new_access_token',
         }
@@ -0,0 +1,166 @@
+"""
+Request throttles whose counters live in a store shared by every worker.
+
+DRF's throttles keep a list of request timestamps per client in the
+default cache. Without a shared cache that list is per process, so each
+gunicorn worker grants the full rate, and every check rewrites the whole
+list. These throttles keep the same scopes and rates but count with a
+sliding-window counter: one atomic increment on the current window and a
+read of the previous one, weighted by how much of it still overlaps the
+last ``duration`` seconds.
+
+``settings.THROTTLE['STORE']`` picks where counters live:
+
+* ``cache`` counts in the Django cache ``THROTTLE['CACHE']``. Use a Redis
+  or Memcached cache so all nodes share the counters (their ``incr`` is
+  atomic; the database cache's is not).
+* ``sqlite`` counts in the SQLite file ``THROTTLE['SQLITE_PATH']``, shared
+  by every process on one host. Used when no shared cache is configured,
+  and by the tests.
+"""
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import throttling
+
+
+DEFAULTS = {
+    'STORE': 'cache',
+    'CACHE': 'default',
+    'SQLITE_PATH': 'throttle.sqlite3',
+    # expired sqlite counters are purged once per this many increments
+    'PURGE_EVERY': 1000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLE', {})}
+
+
+class CacheCounterStore:
+    def __init__(self, alias):
+        self.alias = alias
+
+    def hit(self, key, previous_key, ttl):
+        """Count a request under ``key``, return (count, count of previous_key)"""
+        cache = caches[self.alias]
+        cache.add(key, 0, timeout=ttl)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # expired between add and incr
+            cache.set(key, 1, timeout=ttl)
+            count = 1
+        return count, cache.get(previous_key, 0)
+
+    def undo(self, key):
+        try:
+            caches[self.alias].decr(key)
+        except ValueError:
+            pass
+
+
+class SQLiteCounterStore:
+    def __init__(self, path, purge_every=1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+
+    def _connection(self):
+        # one connection per thread, reopened in forked workers
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # counters may be lost on a crash, they are not worth an fsync
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS throttle_counters ('
+                'key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires REAL NOT NULL'
+                ') WITHOUT ROWID')
+            self._local.conn, self._local.pid, self._local.hits = conn, os.getpid(), 0
+        return self._local.conn
+
+    def hit(self, key, previous_key, ttl):
+        conn = self._connection()
+        now = time.time()
+        (count,) = conn.execute(
+            'INSERT INTO throttle_counters (key, count, expires) VALUES (?, 1, ?) '
+            'ON CONFLICT (key) DO UPDATE SET count = count + 1 RETURNING count',
+            [key, now + ttl]).fetchone()
+        row = conn.execute(
+            'SELECT count FROM throttle_counters WHERE key = ?', [previous_key]).fetchone()
+
+        self._local.hits += 1
+        if self._local.hits % self.purge_every == 0:
+            conn.execute('DELETE FROM throttle_counters WHERE expires < ?', [now])
+        return count, row[0] if row else 0
+
+    def undo(self, key):
+        self._connection().execute(
+            'UPDATE throttle_counters SET count = count - 1 WHERE key = ?', [key])
+
+
+@lru_cache(maxsize=None)
+def build_store(name, cache, sqlite_path, purge_every):
+    if name == 'cache':
+        return CacheCounterStore(cache)
+    if name == 'sqlite':
+        return SQLiteCounterStore(sqlite_path, purge_every)
+    raise ValueError(f"Unknown throttle store {name!r}, expected 'cache' or 'sqlite'")
+
+
+def get_store():
+    config = get_config()
+    return build_store(
+        config['STORE'], config['CACHE'], str(config['SQLITE_PATH']), config['PURGE_EVERY'])
+
+
+class SlidingWindowThrottleMixin:
+    """
+    Replaces SimpleRateThrottle's timestamp history with a sliding-window
+    counter in the shared store.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window, self.elapsed = divmod(self.now, self.duration)
+        window = int(window)
+        key = f'{self.key}:{window}'
+
+        store = get_store()
+        self.current, self.previous = store.hit(
+            key, f'{self.key}:{window - 1}', ttl=2 * self.duration)
+        self.estimate = self.current + self.previous * (1 - self.elapsed / self.duration)
+        if self.estimate <= self.num_requests:
+            return True
+
+        # rejected requests don't use up the allowance
+        store.undo(key)
+        return self.throttle_failure()
+
+    def wait(self):
+        remaining = self.duration - self.elapsed
+        if self.previous and self.current <= self.num_requests:
+            # the previous window's weight decays linearly to zero
+            return min(remaining, (self.estimate - self.num_requests) * self.duration / self.previous)
+        return remaining
+
+
+class AnonRateThrottle(SlidingWindowThrottleMixin, throttling.AnonRateThrottle):
+    pass
+
+
+class UserRateThrottle(SlidingWindowThrottleMixin, throttling.UserRateThrottle):
+    pass
@@ -1,10 +1,16 @@
+import logging
 import sys
 import os
-import africastalking
+import requests
 from dotenv import load_dotenv
+from django.conf import settings
 from django.contrib.auth.models import User
+from . import circuit_breaker, metrics
+from .instrumentation import external_call
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 username = os.getenv("AFRICASTALKING_USERNAME")
 api_key = os.getenv("AFRICASTALKING_API_KEY")
@@ -13,31 +19,108 @@ sender_id = os.getenv("AFRICASTALKING_SENDERID")
 # Only initialize if not in test mode
 is_testing = 'test' in sys.argv or 'pytest' in sys.modules
 
+# (connect, read) seconds for a request to the SMS gateway
+DEFAULT_SMS_TIMEOUT = (3.05, 10)
+
+
+class SMSGatewayError(Exception):
+    """The SMS gateway answered with an error status"""
+
+
+class SMSGateway:
+    """
+    Africa's Talking's messaging API. Its SDK posts without a timeout and
+    offers no way to set one, so the request is made here, the way the SDK
+    makes it, giving up after ``settings.SMS_TIMEOUT``.
+    """
+
+    def __init__(self, username, api_key):
+        self.username = username
+        self.api_key = api_key
+        domain = 'sandbox.africastalking.com' if username == 'sandbox' else 'africastalking.com'
+        self.base_url = f'https://api.{domain}/version1'
+
+    def send(self, message, recipients):
+        response = requests.post(
+            f'{self.base_url}/messaging',
+            headers={'Accept': 'application/json', 'apiKey': self.api_key},
+            data={'username': self.username, 'to': ','.join(recipients),
+                  'message': message, 'bulkSMSMode': 1},
+            timeout=getattr(settings, 'SMS_TIMEOUT', DEFAULT_SMS_TIMEOUT))
+        if not 200 <= response.status_code < 300:
+            raise SMSGatewayError(response.text)
+        if response.headers.get('content-type') == 'application/json':
+            return response.json()
+        return response.text
+
+
 if not is_testing:
-    africastalking.initialize(username, api_key)
-    sms = africastalking.SMS
+    sms = SMSGateway(username, api_key)
 else:
 
     class MockSMS:
         @staticmethod
         def send(message, recipients):
-            return {"SMSMessageData": {"Recipients": [{"status": "Success"}]}}
+            return {"SMSMessageData": {"Recipients": [
+                {"number": number, "status": "Success"} for number in recipients]}}
 
     sms = MockSMS()
 
 
-def send_sms(phone_number, message):
+def gateway_send(mode, message, phone_numbers):
+    """
+    One request to the SMS gateway, timed and counted per ``mode``. Raises
+    circuit_breaker.Unavailable without a request while the gateway is
+    failing or already has its share of concurrent requests.
+    """
+    with circuit_breaker.get('sms').guard(), external_call('sms'), \
+            metrics.SMS_SEND_SECONDS.labels(mode).time():
+        try:
+            response = sms.send(message, phone_numbers)
+        except Exception:
+            metrics.SMS_SENDS.labels(mode, 'error').inc()
+            raise
+    metrics.SMS_SENDS.labels(mode, 'sent').inc()
+    metrics.SMS_RECIPIENTS.labels(mode).inc(len(phone_numbers))
+    return response
+
+
+def send_sms(phone_number, message, raise_errors=False):
     try:
-        response = sms.send(message, [phone_number])
-        print(f"SMS sent to {phone_number}: {response}")
-        print(f"Response from sending the message: {response}")
+        response = gateway_send('single', message, [phone_number])
+        logger.info("SMS sent to %s: %s", phone_number, response)
         return response
     except Exception as e:
-        print(f"Error sending SMS: {e}")
+        logger.error("Error sending SMS: %s", e)
+        if raise_errors:
+            raise
         return None
 
 
+def send_bulk_sms(phone_numbers, message, raise_errors=False):
+    """Send the same message to many recipients in one gateway request"""
+    try:
+        response = gateway_send('bulk', message, list(phone_numbers))
+        logger.info("Bulk SMS sent to %d recipients: %s", len(phone_numbers), response)
+        return response
+    except Exception as e:
+        logger.error("Error sending bulk SMS: %s", e)
+        if raise_errors:
+            raise
+        return None
+
+
+DEFAULT_CONFIRMATION_TEMPLATE = "Hello {first_name}, your order with code {order_code} has been confirmed. Thank you for shopping with us!"
+
+
+def order_confirmation_message(customer, order):
+    # a template without per-order fields lets the outbox worker send many
+    # confirmations in a single bulk request
+    template = getattr(settings, 'SMS_CONFIRMATION_TEMPLATE', None) or DEFAULT_CONFIRMATION_TEMPLATE
+    return template.format(first_name=customer.user.first_name,
+                           order_code=order.order_code)
+
+
 def send_order_confirmation_sms(customer, order):
-    print("sending confirmation SMS.....")
-    message = f"Hello {customer.user.first_name}, your order with code {order.order_code} has been confirmed. Thank you for shopping with us!"
+    message = order_confirmation_message(customer, order)
     return send_sms(customer.phone_number, message)
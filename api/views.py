@@ -1,24 +1,39 @@
 from django.shortcuts import render, redirect
+from django.core.handlers.wsgi import WSGIRequest
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from config import settings
 from urllib.parse import urlencode
 import urllib
-import requests
-from django.contrib.auth.models import User
+import httpx
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import ValidationError  # Add this import
-from .models import Customer, Orders
-from .serializers import CustomerSerializer, OrderSerializer
+from .models import Customer, Orders, hash_token
+from .serializers import (
+    CustomerSerializer, OrderSerializer, OrderSummaryQuerySerializer,
+    OrderSummarySerializer)
+from .pagination import OrderCursorPagination
 from .authentication import CookieAuthentication
+from .auth_cache import auth_cache
+from .conditional import ConditionalGetMixin, conditional, timestamp
+from . import (
+    accounts, google_id_token, http_client, metrics, order_codes, outbox, reports, rollups,
+    session_tokens, single_flight)
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.response import Response
 
+import functools
+import hmac
 import os
+from contextlib import contextmanager
 from os import getenv
 from dotenv import load_dotenv
 
@@ -43,7 +58,8 @@ def google_login(request):
         'client_id': settings.SOCIALACCOUNT_PROVIDERS['google']['APPS'][0]['client_id'],
         'redirect_uri': redirect_uri,
         'response_type': 'code',
-        'scope': 'email profile',
+        # openid makes Google return an ID token with the profile
+        'scope': 'openid email profile',
         'access_type': 'offline',  # Required for refresh token
         'prompt': 'consent',  # show the consent dialog
         'include_granted_scopes': 'true'
@@ -53,7 +69,59 @@ def google_login(request):
     return redirect(auth_url)
 
 
-def google_callback(request):
+def track_oauth(grant, success_status):
+    """Count and time a view exchanging a Google ``grant``"""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                with metrics.GOOGLE_OAUTH_SECONDS.labels(grant).time():
+                    response = await view(request, *args, **kwargs)
+            except Exception:
+                metrics.GOOGLE_OAUTH.labels(grant, 'error').inc()
+                raise
+            if response.status_code == success_status:
+                outcome = 'success'
+            elif response.status_code == 502:
+                outcome = 'unavailable'
+            else:
+                outcome = 'rejected'
+            metrics.GOOGLE_OAUTH.labels(grant, outcome).inc()
+            return response
+        return wrapper
+    return decorator
+
+
+def pooled_under_wsgi(view):
+    """
+    Under WSGI an async view runs in an event loop of its own, so call
+    Google through the process's pooled session rather than a client that
+    would connect afresh for every request.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not isinstance(request, WSGIRequest):
+            return await view(request, *args, **kwargs)
+        with http_client.pooled_session():
+            return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def session_cookie(customer, tokens):
+    """
+    The ``access_token`` cookie value and lifetime after a Google exchange:
+    a session token of ours when SESSION_TOKENS is enabled, otherwise
+    Google's access token.
+    """
+    if session_tokens.enabled():
+        token, _ = session_tokens.mint(customer)
+        return token, session_tokens.get_config()['LIFETIME']
+    return tokens.get('access_token'), 3600
+
+
+@track_oauth('authorization_code', success_status=302)
+@pooled_under_wsgi
+async def google_callback(request):
     code = request.GET.get('code')
 
     if not code:
@@ -62,7 +130,6 @@ def google_callback(request):
     redirect_uri = os.getenv('REDIRECT_URI')
 
     # Token exchange parameters
-    token_url = 'https://oauth2.googleapis.com/token'
     data = {
         'code': code,
         'client_id': settings.SOCIALACCOUNT_PROVIDERS['google']['APPS'][0]['client_id'],
@@ -73,7 +140,10 @@ def google_callback(request):
     }
 
     # getting the access and refresh token
-    response = requests.post(token_url, data=data)
+    try:
+        response = await http_client.apost('google_token', data=data)
+    except httpx.HTTPError:
+        return JsonResponse({'error': 'Google token endpoint unavailable'}, status=502)
 
     if response.status_code != 200:
         return JsonResponse({
@@ -87,48 +157,41 @@ def google_callback(request):
     if 'refresh_token' not in tokens:
         print("No refresh token was returned")
 
-    # get user info using access token
-    userinfo_url = 'https://www.googleapis.com/oauth2/v3/userinfo'
-    headers = {'Authorization': f'Bearer {tokens["access_token"]}'}
-    userinfo_response = requests.get(userinfo_url, headers=headers)
+    # the profile is in the ID token when it verifies against Google's
+    # cached keys, otherwise ask userinfo using the access token
+    user_info = await google_id_token.user_info(tokens)
+    if user_info is None:
+        headers = {'Authorization': f'Bearer {tokens["access_token"]}'}
+        try:
+            userinfo_response = await http_client.aget('google_userinfo', headers=headers)
+        except httpx.HTTPError:
+            return JsonResponse({'error': 'Google userinfo endpoint unavailable'}, status=502)
 
-    if userinfo_response.status_code != 200:
-        return JsonResponse({'error': 'Failed to get user info'}, status=400)
+        if userinfo_response.status_code != 200:
+            return JsonResponse({'error': 'Failed to get user info'}, status=400)
 
-    user_info = userinfo_response.json()
+        user_info = userinfo_response.json()
 
-    # create a new user based of their email from google
+    # find or create the user by their email from google and store the
+    # tokens on their customer, in one statement. With session tokens the
+    # browser gets our own token, so Google's access token isn't kept at all
+    customer = None
     if user_info.get('email'):
-        try:
-            # check if a user with the email provided exists in our database
-            user = User.objects.get(email=user_info['email'])
-        except User.DoesNotExist:
-
-            username = user_info.get('email').split('@')[0]
-            user = User.objects.create_user(
-                username=username,
-                email=user_info['email'],
-                first_name=user_info.get('given_name', ''),
-                last_name=user_info.get('family_name', '')
-            )
-
-        customer, created = Customer.objects.get_or_create(
-            user=user,
-            defaults={'phone_number': ''}
-        )
-
-        # store tokens in the database
-        customer.access_token = tokens.get('access_token')
-        customer.refresh_token = tokens.get('refresh_token')
-        customer.save()
+        customer, _ = await sync_to_async(accounts.upsert_google_customer)(
+            user_info,
+            None if session_tokens.enabled() else tokens.get('access_token'),
+            tokens.get('refresh_token'))
+    elif session_tokens.enabled():
+        return JsonResponse({'error': 'Google did not share an email address'}, status=400)
 
     response = redirect('/profile/')  # Redirect to profile page
 
+    access_token, max_age = session_cookie(customer, tokens)
+
     # set https-only cookies for the tokens
-    max_age = 3600  #
     response.set_cookie(
         'access_token',
-        tokens.get('access_token'),
+        access_token,
         max_age=max_age,
         httponly=True,
         secure=True,
@@ -147,13 +210,17 @@ def google_callback(request):
     return response
 
 
-@csrf_exempt
-def refresh_token(request):
-    refresh_token = request.COOKIES.get('refresh_token')
-    if not refresh_token:
-        return JsonResponse({'error': 'No refresh token'}, status=401)
+async def exchange_refresh_token(refresh_token):
+    """
+    Refresh with Google and store the new access token. Returns the
+    outcome as a dict (with ``status``) that concurrent refreshes share.
+    """
+    customer = await Customer.objects.only(
+        'id', 'user_id', 'access_token', 'refresh_token_hash').filter(
+            refresh_token_hash=hash_token(refresh_token)).afirst()
+    if customer is None:
+        return {'status': 401, 'error': 'Invalid refresh token'}
 
-    token_url = 'https://oauth2.googleapis.com/token'
     data = {
         'client_id': settings.SOCIALACCOUNT_PROVIDERS['google']['APPS'][0]['client_id'],
         'client_secret': settings.SOCIALACCOUNT_PROVIDERS['google']['APPS'][0]['secret'],
@@ -161,25 +228,46 @@ def refresh_token(request):
         'grant_type': 'refresh_token'
     }
 
-    response = requests.post(token_url, data=data)
+    try:
+        response = await http_client.apost('google_token', data=data)
+    except httpx.HTTPError:
+        return {'status': 502, 'error': 'Google token endpoint unavailable'}
 
     if response.status_code != 200:
-        return JsonResponse({'error': 'Failed to refresh token'}, status=401)
+        return {'status': 401, 'error': 'Failed to refresh token'}
 
     tokens = response.json()
-
-    try:
-        customer = Customer.objects.get(refresh_token=refresh_token)
+    if not session_tokens.enabled():
+        await sync_to_async(auth_cache.invalidate)(customer.access_token)
         customer.access_token = tokens.get('access_token')
-        customer.save()
-    except Customer.DoesNotExist:
-        return JsonResponse({'error': 'Invalid refresh token'}, status=401)
+        await customer.asave(update_fields=['access_token'])
+    return {'status': 200, 'tokens': tokens, 'customer': (customer.pk, customer.user_id)}
+
 
+@csrf_exempt
+@track_oauth('refresh_token', success_status=200)
+@pooled_under_wsgi
+async def refresh_token(request):
+    refresh_token = request.COOKIES.get('refresh_token')
+    if not refresh_token:
+        return JsonResponse({'error': 'No refresh token'}, status=401)
+
+    # tabs and devices refreshing at once make one call to Google and
+    # share its answer; an outage isn't kept, so retries try again
+    outcome = await single_flight.token_refreshes.run(
+        hash_token(refresh_token), lambda: exchange_refresh_token(refresh_token),
+        keep=lambda outcome: outcome['status'] != 502)
+    if outcome['status'] != 200:
+        return JsonResponse({'error': outcome['error']}, status=outcome['status'])
+
+    customer_id, user_id = outcome['customer']
+    access_token, max_age = session_cookie(
+        Customer(pk=customer_id, user_id=user_id), outcome['tokens'])
     api_response = JsonResponse({'success': True})
     api_response.set_cookie(
         'access_token',
-        tokens.get('access_token'),
-        max_age=3600,
+        access_token,
+        max_age=max_age,
         httponly=True,
         secure=True,
         samesite='Lax'
@@ -188,45 +276,201 @@ def refresh_token(request):
     return api_response
 
 
-class OrderViewset(viewsets.ModelViewSet):
+@contextmanager
+def track_order_request(endpoint):
+    """Count the outcome and time of an order creation request"""
+    try:
+        with metrics.ORDER_CREATE_SECONDS.labels(endpoint).time():
+            yield
+    except ValidationError:
+        metrics.ORDER_REQUESTS.labels(endpoint, 'rejected').inc()
+        raise
+    except Exception:
+        metrics.ORDER_REQUESTS.labels(endpoint, 'failed').inc()
+        raise
+    metrics.ORDER_REQUESTS.labels(endpoint, 'created').inc()
+
+
+def get_request_customer(request, load=False):
+    """
+    Return the Customer of the authenticated user.
+
+    CookieAuthentication loads the customer together with the user, so this
+    normally costs no query; other authentication classes fall back to one.
+    A session token only carries ids, so with ``load`` its customer and
+    user are fetched in one query for views that read their other fields.
+    """
+    if load and session_tokens.is_session(request.auth):
+        return (Customer.objects.select_related('user')
+                .filter(pk=request.auth['cid']).first())
+    try:
+        return request.user.customer
+    except Customer.DoesNotExist:
+        return None
+
+
+def version_of(queryset, pk):
+    """The first row of ``queryset`` with primary key ``pk``, None if there is none"""
+    try:
+        return queryset.filter(pk=pk).first()
+    except (TypeError, ValueError):
+        # not a valid id, the normal lookup answers 404
+        return None
+
+
+class OrderViewset(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Orders.objects.all()
     serializer_class = OrderSerializer
     authentication_classes = [CookieAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
-        user = self.request.user
-        try:
-            # Get the customer associated with the user
-            customer = Customer.objects.get(user=user)
-            return Orders.objects.filter(customer=customer)
-        except Customer.DoesNotExist:
+        # Get the customer associated with the user
+        customer = get_request_customer(self.request)
+        if customer is None:
             return Orders.objects.none()
+        return Orders.objects.filter(customer=customer)
+
+    def list_version(self):
+        # the count changes on deletes, the latest updated_at on inserts and edits
+        version = self.get_queryset().aggregate(
+            count=Count('pk'), updated=Max('updated_at'))
+        return version, timestamp(version['updated'])
+
+    def detail_version(self):
+        version = version_of(
+            self.get_queryset().values('pk', 'updated_at'), self.kwargs['pk'])
+        if version is None:
+            return None
+        return version, timestamp(version['updated_at'])
+
+    def get_ordering_customer(self):
+        # the confirmation SMS needs the phone number and first name
+        customer = get_request_customer(self.request, load=True)
+        if customer is None:
+            raise ValidationError(
+                {"customer": "Customer not found for this user"})
+
+        # Add phone number validation
+        if not customer.phone_number:
+            # the cached values may predate a phone number update
+            customer.refresh_from_db(fields=['phone_number'])
+        if not customer.phone_number:
+            raise ValidationError(
+                {"phone_number": "Customer must have a phone number to place orders"})
+        return customer
+
+    def create(self, request, *args, **kwargs):
+        with track_order_request('single'):
+            response = super().create(request, *args, **kwargs)
+        metrics.ORDERS_CREATED.labels('single').inc()
+        return response
 
     def perform_create(self, serializer):
-        try:
-            user = self.request.user
-            customer = Customer.objects.get(user=user)
+        serializer.save(customer=self.get_ordering_customer())
 
-            # Add phone number validation
-            if not customer.phone_number:
-                raise ValidationError(
-                    {"phone_number": "Customer must have a phone number to place orders"})
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create a batch of orders from a JSON array in one transaction.
 
-            serializer.save(customer=customer)
-        except Customer.DoesNotExist:
-            raise ValidationError(
-                {"customer": "Customer not found for this user"})
+        All orders are validated before any is written; one invalid entry
+        rejects the whole batch with per-item errors.
+        """
+        with track_order_request('bulk'):
+            serializer = self.get_serializer(
+                data=request.data, many=True, allow_empty=False,
+                max_length=settings.ORDER_BULK_MAX_SIZE)
+            serializer.is_valid(raise_exception=True)
+            orders = self.perform_bulk_create(serializer)
+        metrics.ORDERS_CREATED.labels('bulk').inc(len(orders))
+        data = self.get_serializer(orders, many=True).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, serializer):
+        customer = self.get_ordering_customer()
+
+        orders = [
+            Orders(customer=customer, total_amount=item['total_amount'])
+            for item in serializer.validated_data
+        ]
+        attempts = settings.ORDER_CODE_MAX_ATTEMPTS
+        with transaction.atomic():
+            for attempt in range(1, attempts + 1):
+                # generated here as bulk_create bypasses Orders.save()
+                order_codes.assign_order_codes(orders)
+                try:
+                    with transaction.atomic():
+                        orders = Orders.objects.bulk_create(orders)
+                    break
+                except IntegrityError:
+                    codes = [order.order_code for order in orders]
+                    if attempt == attempts or not Orders.code_taken(*codes):
+                        raise
+
+            # bulk_create skips the post_save signals, so the outbox rows
+            # and rollups they maintain are written here instead
+            outbox.enqueue_order_confirmations(orders)
+            rollups.record_orders(orders)
+        return orders
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Order count, total and average over ``start``..``end`` (inclusive
+        ISO dates), bucketed per ``day`` or ``month``.
+        """
+        query = OrderSummaryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        customer = get_request_customer(request)
+        if customer is None:
+            return Response(
+                {"error": "Customer profile not found for this user"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        summary = reports.order_summary(
+            customer,
+            start=params.get('start'),
+            end=params.get('end'),
+            bucket=params['bucket'],
+            source=params.get('source') or settings.ORDER_SUMMARY_SOURCE,
+        )
+        return Response(OrderSummarySerializer(summary).data)
 
 
-class CustomerViewset(viewsets.ModelViewSet):
+class CustomerViewset(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
     authentication_classes = [CookieAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
 
-        return Customer.objects.filter(user=self.request.user)
+        return CustomerSerializer.setup_eager_loading(
+            Customer.objects.filter(user=self.request.user))
+
+    def get_versions(self):
+        # the embedded order count and recent orders follow the customer's orders
+        return (Customer.objects.filter(user=self.request.user)
+                .values('pk', 'updated_at')
+                .annotate(order_count=Count('orders'),
+                          orders_updated=Max('orders__updated_at'))
+                .order_by('pk'))
+
+    def list_version(self):
+        versions = list(self.get_versions())
+        return versions, timestamp(
+            *(version['updated_at'] for version in versions),
+            *(version['orders_updated'] for version in versions))
+
+    def detail_version(self):
+        version = version_of(self.get_versions(), self.kwargs['pk'])
+        if version is None:
+            return None
+        return version, timestamp(version['updated_at'], version['orders_updated'])
 
     def perform_create(self, serializer):
         try:
@@ -277,24 +521,35 @@ class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        try:
-            customer = Customer.objects.get(user=user)
-
-            response_data = {
-                "welcome": f"Welcome, {user.first_name} {user.last_name}",
-                "user_id": user.id,
-                "username": user.username,
-                "email": user.email,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "customer_id": customer.id,
-                "phone_number": customer.phone_number,
-
-            }
-            return Response(response_data)
-        except Customer.DoesNotExist:
+        customer = get_request_customer(request, load=True)
+        if customer is None:
             return Response(
                 {"error": "Customer profile not found for this user"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        user = customer.user
+
+        # authentication already loaded everything the profile shows
+        version = (user.id, user.username, user.email, user.first_name,
+                   user.last_name, customer.id, customer.phone_number)
+        return conditional(request, version, lambda: Response({
+            "welcome": f"Welcome, {user.first_name} {user.last_name}",
+            "user_id": user.id,
+            "username": user.username,
+            "email": user.email,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "customer_id": customer.id,
+            "phone_number": customer.phone_number,
+
+        }))
+
+
+def metrics_view(request):
+    """Every registered metric in the Prometheus text format"""
+    token = metrics.get_config()['TOKEN']
+    if token and not hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Benchmark CookieAuthentication lookups as the customers table grows.
+
+Compares the old lookup on the raw ``access_token`` TextField (sequential
+scan) with the indexed ``access_token_hash`` lookup used by
+CookieAuthentication, and with verifying a signed session token (no
+query). The auth cache is off. All seeded rows are rolled back at the end.
+
+    python benchmarks/bench_auth.py                 # 10k, 100k and 1M customers
+    python benchmarks/bench_auth.py 10000 50000     # custom sizes
+"""
+import os
+import sys
+import time
+import random
+import statistics
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+
+
+class Rollback(Exception):
+    pass
+
+
+class FakeRequest:
+    def __init__(self, access_token):
+        self.COOKIES = {'access_token': access_token}
+
+
+def seed(size, User, Customer, hash_token):
+    users = User.objects.bulk_create(
+        [User(username=f'bench-{uuid.uuid4().hex}') for _ in range(size)],
+        batch_size=5000)
+    tokens = [uuid.uuid4().hex * 3 for _ in range(size)]
+    Customer.objects.bulk_create(
+        [Customer(user=user, access_token=token, access_token_hash=hash_token(token))
+         for user, token in zip(users, tokens)],
+        batch_size=5000)
+    return tokens
+
+
+def timed(func, tokens):
+    samples = []
+    for token in tokens:
+        start = time.perf_counter()
+        func(token)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean_ms': round(statistics.mean(samples), 3),
+        'p50_ms': round(samples[len(samples) // 2], 3),
+        'p95_ms': round(samples[int(len(samples) * 0.95)], 3),
+    }
+
+
+def run(size, lookups=200):
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from api import session_tokens
+    from api.authentication import CookieAuthentication
+    from api.models import Customer, hash_token
+
+    auth = CookieAuthentication()
+    result = {}
+    try:
+        with transaction.atomic():
+            tokens = seed(size, User, Customer, hash_token)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE api_customer')
+            sample = random.sample(tokens, min(lookups, len(tokens)))
+
+            result['before'] = timed(
+                lambda token: Customer.objects.select_related('user').get(
+                    access_token=token),
+                sample)
+            result['after'] = timed(
+                lambda token: auth.authenticate(FakeRequest(token)), sample)
+
+            customers = Customer.objects.filter(
+                access_token_hash__in=[hash_token(token) for token in sample])
+            signed = [session_tokens.mint(customer)[0] for customer in customers]
+            auth.authenticate(FakeRequest(signed[0]))  # loads the revocation list
+            result['session'] = timed(
+                lambda token: auth.authenticate(FakeRequest(token)), signed)
+            raise Rollback()
+    except Rollback:
+        pass
+    return result
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'customers':>10} {'lookup':>8} {'mean_ms':>9} {'p50_ms':>9} {'p95_ms':>9}")
+    enabled = override_settings(
+        AUTH_CACHE={**settings.AUTH_CACHE, 'ENABLED': False},
+        SESSION_TOKENS={**settings.SESSION_TOKENS, 'ENABLED': True})
+    for size in sizes:
+        with enabled:
+            result = run(size)
+        for label in ('before', 'after', 'session'):
+            stats = result[label]
+            print(f"{size:>10} {label:>8} {stats['mean_ms']:>9} "
+                  f"{stats['p50_ms']:>9} {stats['p95_ms']:>9}")
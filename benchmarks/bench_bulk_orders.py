@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark creating orders one POST at a time against one bulk POST.
+
+Both runs go through the full Django request stack (middleware, cookie
+authentication, serializer validation, signals or their bulk equivalent)
+with the in-process test client, so the numbers exclude network time.
+Request throttling is disabled for the run. All rows are rolled back at
+the end.
+
+    python benchmarks/bench_bulk_orders.py          # 1,000 orders
+    python benchmarks/bench_bulk_orders.py 5000
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+
+
+class Rollback(Exception):
+    pass
+
+
+def make_client(User, Customer):
+    from django.test import Client
+
+    user = User.objects.create(
+        username=f'bench-{uuid.uuid4().hex}', first_name='Bench')
+    token = uuid.uuid4().hex
+    Customer.objects.create(
+        user=user, phone_number='+254700000000', access_token=token)
+    client = Client()
+    client.cookies['access_token'] = token
+    return client
+
+
+def single_posts(client, payload):
+    for item in payload:
+        response = client.post(
+            '/api/orders/', item, content_type='application/json')
+        assert response.status_code == 201, response.content
+
+
+def bulk_post(client, payload):
+    response = client.post(
+        '/api/orders/bulk/', payload, content_type='application/json')
+    assert response.status_code == 201, response.content
+
+
+def run(count):
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+    from api.models import Customer
+    from api.views import OrderViewset
+    from config import settings
+
+    settings.ORDER_BULK_MAX_SIZE = max(settings.ORDER_BULK_MAX_SIZE, count)
+    OrderViewset.throttle_classes = []
+    payload = [{'total_amount': f'{i % 500 + 1}.00'} for i in range(count)]
+
+    result = {}
+    try:
+        with transaction.atomic():
+            for label, func in (('single', single_posts), ('bulk', bulk_post)):
+                client = make_client(User, Customer)
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    func(client, payload)
+                    elapsed = time.perf_counter() - start
+                result[label] = {
+                    'seconds': round(elapsed, 3),
+                    'orders_per_s': round(count / elapsed),
+                    'queries': len(queries),
+                }
+            raise Rollback()
+    except Rollback:
+        pass
+    return result
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    result = run(count)
+    print(f"{'orders':>7} {'mode':>7} {'seconds':>9} {'orders/s':>9} {'queries':>8}")
+    for label in ('single', 'bulk'):
+        stats = result[label]
+        print(f"{count:>7} {label:>7} {stats['seconds']:>9} "
+              f"{stats['orders_per_s']:>9} {stats['queries']:>8}")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark full responses against 304 revalidations of polled reads.
+
+Seeds one customer with each number of orders given. It then times GETs of
+the order list, the customer list and the profile, both without validators
+and with the ``If-None-Match`` of the previous response. It also counts
+their queries. The auth cache is on, as in a warm worker. All seeded rows
+are rolled back at the end.
+
+    python benchmarks/bench_conditional_get.py              # 10, 1000 and 50000 orders
+    python benchmarks/bench_conditional_get.py 100 10000    # custom sizes
+"""
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+
+
+class Rollback(Exception):
+    pass
+
+
+def timed(client, url, headers, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    samples = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url, headers=headers)
+            samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'bytes': len(response.content),
+        'p50_ms': round(statistics.median(samples), 3),
+    }
+
+
+def run(size, repeat=200):
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from django.test import Client
+    from django.urls import reverse
+    from api.models import Customer, Orders
+
+    results = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create_user(username=f'bench-{uuid.uuid4().hex}')
+            token = uuid.uuid4().hex
+            customer = Customer.objects.create(
+                user=user, phone_number='+254700000000', access_token=token)
+            Orders.objects.bulk_create(
+                [Orders(customer=customer, total_amount=1, order_code=f'B{uuid.uuid4().hex[:18]}')
+                 for _ in range(size)],
+                batch_size=5000)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE api_orders')
+
+            client = Client()
+            client.cookies['access_token'] = token
+            for url in (reverse('order-list'), reverse('customer-list'), reverse('profile')):
+                etag = client.get(url)['ETag']
+                results[url] = {
+                    'full': timed(client, url, {}, repeat),
+                    'revalidate': timed(client, url, {'If-None-Match': etag}, repeat),
+                }
+            raise Rollback()
+    except Rollback:
+        pass
+    return results
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.bench_settings')
+    django.setup()
+    from django.test.utils import override_settings, setup_test_environment
+    from django.conf import settings
+
+    setup_test_environment()
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 1000, 50_000]
+    print(f"{'orders':>7} {'url':>16} {'request':>11} {'status':>6} "
+          f"{'queries':>7} {'bytes':>6} {'p50_ms':>7}")
+    with override_settings(AUTH_CACHE={**settings.AUTH_CACHE, 'ENABLED': True}):
+        for size in sizes:
+            for url, result in run(size).items():
+                for label, stats in result.items():
+                    print(f"{size:>7} {url:>16} {label:>11} {stats['status']:>6} "
+                          f"{stats['queries']:>7} {stats['bytes']:>6} {stats['p50_ms']:>7}")
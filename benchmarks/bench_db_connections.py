@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Load-test /profile/ under each database connection strategy.
+
+For every strategy a gunicorn server (gthread workers) is started with the
+matching DB_* environment, with its database traffic routed through
+latency_proxy so each new PostgreSQL connection pays a simulated remote
+handshake. Concurrent keep-alive clients then hit /profile/ while
+pg_stat_activity is sampled for the number of open server connections.
+
+    python benchmarks/bench_db_connections.py
+    python benchmarks/bench_db_connections.py --requests 4000 --concurrency 32 --handshake 0.03
+"""
+import argparse
+import os
+import sys
+import threading
+from urllib.parse import urlparse, urlunparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import django
+
+from benchmarks.latency_proxy import start_proxy
+from benchmarks.loadgen import (
+    drive, free_port, seed_customer, start_server, stop_server, summarize)
+
+STRATEGIES = {
+    'per-request': {'DB_CONN_MAX_AGE': '0', 'DB_POOL': 'False'},
+    'persistent': {'DB_CONN_MAX_AGE': '60', 'DB_CONN_HEALTH_CHECKS': 'True',
+                   'DB_POOL': 'False'},
+    'pool': {'DB_POOL': 'True', 'DB_POOL_MIN_SIZE': '2', 'DB_POOL_MAX_SIZE': '4'},
+}
+
+
+def backend_count(dbname):
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_stat_activity "
+            "WHERE datname = %s AND backend_type = 'client backend' AND pid <> pg_backend_pid()",
+            [dbname])
+        return cursor.fetchone()[0]
+
+
+def run(name, args, token, proxy_url, dbname):
+    port = free_port()
+    env = {**os.environ, **STRATEGIES[name],
+           'DATABASE_URL': proxy_url,
+           'DJANGO_SETTINGS_MODULE': 'benchmarks.bench_settings',
+           'PYTHONPATH': ROOT}
+    process = start_server(
+        [sys.executable, '-m', 'gunicorn', 'config.wsgi',
+         '--bind', f'127.0.0.1:{port}', '--worker-class', 'gthread',
+         '--workers', str(args.workers), '--threads', str(args.threads),
+         '--log-level', 'warning'],
+        port, ROOT, env)
+    peak, stop = [0], threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            peak[0] = max(peak[0], backend_count(dbname))
+            stop.wait(0.05)
+
+    sampler = threading.Thread(target=sample)
+    try:
+        sampler.start()
+        samples, elapsed = drive(
+            port, token, ['/profile/'], args.requests, args.concurrency)
+    finally:
+        stop.set()
+        sampler.join()
+        stop_server(process)
+    return {**summarize(samples, elapsed), 'peak_connections': peak[0]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--handshake', type=float, default=0.03,
+                        help="Simulated seconds to open a PostgreSQL connection")
+    parser.add_argument('strategies', nargs='*', default=list(STRATEGIES))
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+    from django.conf import settings
+
+    db = settings.DATABASES['default']
+    _, proxy_port, proxy_stats = start_proxy(
+        (db['HOST'], int(db['PORT'])), handshake=args.handshake)
+    url = urlparse(os.environ['DATABASE_URL'])
+    proxy_url = urlunparse(url._replace(
+        netloc=f'{url.username}:{url.password}@127.0.0.1:{proxy_port}'))
+
+    from django.db import connection
+
+    user, token = seed_customer()
+    connection.close()  # only the servers' connections should be counted
+    try:
+        print(f"{'strategy':>12} {'rps':>6} {'p50_ms':>7} {'p95_ms':>7} "
+              f"{'p99_ms':>7} {'peak_conns':>10} {'handshakes':>10}")
+        for name in args.strategies:
+            before = proxy_stats.connections
+            result = run(name, args, token, proxy_url, db['NAME'])
+            print(f"{name:>12} {result['rps']:>6} {result['p50_ms']:>7} "
+                  f"{result['p95_ms']:>7} {result['p99_ms']:>7} "
+                  f"{result['peak_connections']:>10} "
+                  f"{proxy_stats.connections - before:>10}")
+    finally:
+        user.delete()
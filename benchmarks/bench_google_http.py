@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Connection reuse for Google OAuth calls, against a local HTTPS fake.
+
+Compares a bare ``requests.post`` per call (new TCP + TLS handshake every
+time, as the views used to do) with ``api.http_client`` (pooled keep-alive
+session).
+
+    python benchmarks/bench_google_http.py            # 500 token exchanges
+    python benchmarks/bench_google_http.py 2000
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+import requests
+
+from benchmarks.fake_google import start_google
+
+
+def timed(call, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = call()
+        response.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean_ms': round(statistics.mean(samples), 3),
+        'p50_ms': round(samples[len(samples) // 2], 3),
+        'p95_ms': round(samples[int(len(samples) * 0.95)], 3),
+    }
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+    from django.conf import settings
+    from api import http_client
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server, url, ca_file, stats = start_google()
+    os.environ['REQUESTS_CA_BUNDLE'] = ca_file
+    settings.HTTP_CLIENT = {
+        **getattr(settings, 'HTTP_CLIENT', {}),
+        'ENDPOINTS': {'google_token': {'url': f'{url}/token'}},
+    }
+    http_client.reset()
+    data = {'grant_type': 'refresh_token', 'refresh_token': 'bench'}
+
+    print(f"{'client':>8} {'calls':>6} {'connections':>12} {'mean_ms':>8} {'p50_ms':>8} {'p95_ms':>8}")
+    for label, call in (
+        ('bare', lambda: requests.post(f'{url}/token', data=data, timeout=10)),
+        ('pooled', lambda: http_client.post('google_token', data=data)),
+    ):
+        stats.connections = 0
+        result = timed(call, count)
+        print(f"{label:>8} {count:>6} {stats.connections:>12} {result['mean_ms']:>8} "
+              f"{result['p50_ms']:>8} {result['p95_ms']:>8}")
+    server.shutdown()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Cost of recording a metric, and a check that /metrics sums every worker.
+
+Times ``inc`` and ``observe`` on api.metrics series, and on
+prometheus_client's multiprocess mode for comparison when it is installed.
+Then starts gunicorn with ``--workers`` workers and instrumentation on,
+sends ``--requests`` requests and compares the count reported by
+/metrics with the number sent.
+
+    python benchmarks/bench_metrics.py
+    python benchmarks/bench_metrics.py --ops 1000000 --workers 3 --requests 600
+"""
+import argparse
+import http.client
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.loadgen import free_port, start_server, stop_server
+
+PROMETHEUS_CLIENT = '''
+import os, sys, tempfile, time
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp()
+from prometheus_client import Counter, Histogram
+counter = Counter('bench', 'bench', ['kind']).labels('a')
+histogram = Histogram('bench_seconds', 'bench', ['kind']).labels('a')
+ops = int(sys.argv[1])
+for name, record in (('inc', counter.inc), ('observe', lambda: histogram.observe(0.03))):
+    start = time.perf_counter()
+    for _ in range(ops):
+        record()
+    print(name, (time.perf_counter() - start) / ops * 1e9)
+'''
+
+
+def per_op(ops):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    from api import metrics
+
+    registry = metrics.Registry()
+    counter = metrics.Counter('bench', 'bench', ['kind'], registry=registry).labels('a')
+    histogram = metrics.Histogram('bench_seconds', 'bench', ['kind'], registry=registry).labels('a')
+    results = {}
+    for name, record in (('inc', counter.inc), ('observe', lambda: histogram.observe(0.03))):
+        start = time.perf_counter()
+        for _ in range(ops):
+            record()
+        results[name] = (time.perf_counter() - start) / ops * 1e9
+    return results
+
+
+def prometheus_client_per_op(ops):
+    try:
+        output = subprocess.run(
+            [sys.executable, '-c', PROMETHEUS_CLIENT, str(ops)],
+            capture_output=True, text=True, check=True).stdout
+    except subprocess.CalledProcessError:
+        return None
+    return {name: float(value) for name, value in
+            (line.split() for line in output.splitlines())}
+
+
+def scrape(port, attempts=3):
+    for attempt in range(attempts):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        try:
+            conn.request('GET', '/metrics')
+            return conn.getresponse().read().decode()
+        except (http.client.HTTPException, OSError):
+            # a recycled gthread worker drops connections it accepted
+            if attempt == attempts - 1:
+                raise
+        finally:
+            conn.close()
+
+
+def aggregation(workers, requests):
+    port = free_port()
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'GUNICORN_ACCESS_LOG': '',
+           'INSTRUMENTATION_ENABLED': 'True', 'WEB_CONCURRENCY': str(workers),
+           'METRICS_MULTIPROCESS_DIR': tempfile.mkdtemp(),
+           # recycle workers mid-run so archived counts are covered too
+           'GUNICORN_MAX_REQUESTS': str(requests // (workers * 2)),
+           'GUNICORN_MAX_REQUESTS_JITTER': '0'}
+    process = start_server(
+        [sys.executable, '-m', 'gunicorn', '-c', 'config/gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{port}'], port, ROOT, env)
+    try:
+        sent = 0
+        while sent < requests:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            try:
+                conn.request('GET', '/oauth/')
+                conn.getresponse().read()
+                sent += 1
+            except (http.client.HTTPException, OSError):
+                pass  # accepted by a worker that was exiting, never served
+            finally:
+                conn.close()
+        time.sleep(float(os.getenv('METRICS_FLUSH_INTERVAL', '1')) * 2)
+        text = scrape(port)
+    finally:
+        stop_server(process)
+    match = re.search(r'^http_request_duration_seconds_count\{view="login",method="GET"\} (\S+)$',
+                      text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--ops', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=600)
+    args = parser.parse_args()
+
+    print(f"{'registry':>28} {'inc_ns':>7} {'observe_ns':>10}")
+    ours = per_op(args.ops)
+    print(f"{'api.metrics':>28} {ours['inc']:>7.0f} {ours['observe']:>10.0f}")
+    theirs = prometheus_client_per_op(args.ops)
+    if theirs:
+        print(f"{'prometheus_client (mmap)':>28} {theirs['inc']:>7.0f} {theirs['observe']:>10.0f}")
+
+    counted = aggregation(args.workers, args.requests)
+    print(f"\n{args.workers} gunicorn workers, recycled every "
+          f"{args.requests // (args.workers * 2)} requests: "
+          f"sent {args.requests}, /metrics counted {counted:.0f}")
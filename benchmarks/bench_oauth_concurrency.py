@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Drive concurrent Google logins through the sync and async serving stacks.
+
+Starts benchmarks/fake_google.py with a realistic Google round-trip
+latency and one gunicorn worker per interface (gthread WSGI, uvicorn
+ASGI), then fires ``--concurrency`` simultaneous
+``/accounts/google/login/callback/`` requests at each. Every login costs
+a token exchange and a userinfo call; the fake reports how many of those
+were in flight at once, which is what the worker can overlap.
+
+    python benchmarks/bench_oauth_concurrency.py
+    python benchmarks/bench_oauth_concurrency.py --logins 1000 --concurrency 200 --latency 0.2
+"""
+import argparse
+import http.client
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import django
+
+from benchmarks.fake_google import start_google
+from benchmarks.loadgen import free_port, start_server, stop_server, summarize
+
+BENCH_EMAIL = 'bench.user@example.com'
+INTERFACES = ['wsgi', 'asgi']
+
+
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    start = time.perf_counter()
+    try:
+        conn.request('GET', '/accounts/google/login/callback/?code=bench')
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    assert response.status == 302, response.status
+    return (time.perf_counter() - start) * 1000
+
+
+def run(interface, args, env, stats):
+    port = free_port()
+    process = start_server(
+        [sys.executable, '-m', 'gunicorn', '-c', 'config/gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{port}'],
+        port, ROOT, {**env, 'SERVER_INTERFACE': interface})
+    try:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(login, [port] * args.concurrency))  # warm up
+            stats.peak_active = 0
+            start = time.perf_counter()
+            samples = sorted(pool.map(login, [port] * args.logins))
+            elapsed = time.perf_counter() - start
+    finally:
+        stop_server(process)
+    return {**summarize(samples, elapsed), 'google_in_flight': stats.peak_active}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=600)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help="Simulated seconds per Google call")
+    parser.add_argument('interfaces', nargs='*', default=INTERFACES)
+    args = parser.parse_args()
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.bench_settings'
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from api.models import Customer
+
+    _, google_url, _, stats = start_google(latency=args.latency, tls=False)
+    # every fake login resolves to the same account; create it up front so
+    # concurrent first logins don't race to insert it
+    user, _ = User.objects.get_or_create(
+        username='bench.user', defaults={'email': BENCH_EMAIL})
+    Customer.objects.get_or_create(user=user, defaults={'phone_number': ''})
+
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'GUNICORN_ACCESS_LOG': '',
+           'BENCH_GOOGLE_URL': google_url, 'WEB_CONCURRENCY': '1'}
+    try:
+        print(f"{'interface':>9} {'logins/s':>8} {'p50_ms':>7} {'p95_ms':>7} "
+              f"{'p99_ms':>7} {'google_in_flight':>16}")
+        for interface in args.interfaces:
+            result = run(interface, args, env, stats)
+            print(f"{interface:>9} {result['rps']:>8} {result['p50_ms']:>7} "
+                  f"{result['p95_ms']:>7} {result['p99_ms']:>7} "
+                  f"{result['google_in_flight']:>16}")
+    finally:
+        user.delete()
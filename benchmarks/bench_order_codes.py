@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Stress the order code generator for uniqueness and throughput.
+
+Each worker process generates its share of codes with its own
+TimeOrderedCodeGenerator, checks that its stream is strictly increasing
+and writes it to a temporary file. The sorted files are then merged and
+scanned for duplicates across processes, so memory stays flat however
+many codes are generated. The legacy uuid4 generator is measured for
+comparison along with the number of codes after which a collision
+becomes likely for each code space. Exits with status 1 if a duplicate
+turns up or a process generates fewer than MIN_RATE codes per second.
+
+    python benchmarks/bench_order_codes.py                # 20M codes, 4 processes
+    python benchmarks/bench_order_codes.py 50000000 8
+"""
+import heapq
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# codes per second each process must sustain
+MIN_RATE = 20_000
+
+
+def worker(args):
+    count, path = args
+    from api.order_codes import TimeOrderedCodeGenerator
+
+    generator = TimeOrderedCodeGenerator()
+    previous = ''
+    start = time.perf_counter()
+    with open(path, 'w') as out:
+        for _ in range(count):
+            code = generator()
+            if code <= previous:
+                raise AssertionError(f'{code} is not after {previous}')
+            previous = code
+            out.write(code + '\n')
+    return count, time.perf_counter() - start
+
+
+def count_duplicates(paths):
+    files = [open(path) for path in paths]
+    try:
+        duplicates, previous = 0, None
+        for code in heapq.merge(*files):
+            if code == previous:
+                duplicates += 1
+            previous = code
+        return duplicates
+    finally:
+        for handle in files:
+            handle.close()
+
+
+def legacy_rate(count=1_000_000):
+    from api.order_codes import uuid_order_code
+
+    start = time.perf_counter()
+    for _ in range(count):
+        uuid_order_code()
+    return count / (time.perf_counter() - start)
+
+
+def likely_collision_after(bits):
+    # birthday bound: 50% chance of a collision after ~1.18 * sqrt(2^bits)
+    return int(math.sqrt(2 * math.log(2) * 2 ** bits))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000_000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    share = total // processes
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = [(share, os.path.join(tmp, f'codes-{i}.txt')) for i in range(processes)]
+        start = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(worker, jobs)
+        wall = time.perf_counter() - start
+        duplicates = count_duplicates([path for _, path in jobs])
+
+    generated = sum(count for count, _ in results)
+    print(f"generated            {generated:,} codes in {processes} processes")
+    print(f"duplicates           {duplicates}")
+    print(f"wall time            {wall:.1f}s ({generated / wall:,.0f} codes/s)")
+    print(f"legacy uuid4[:8]     {legacy_rate():,.0f} codes/s")
+    print(f"50% collision after  {likely_collision_after(32):,} codes (legacy), "
+          f"{likely_collision_after(32):,} codes within one millisecond "
+          f"in separate processes (time-ordered)")
+
+    slowest = min(count / elapsed for count, elapsed in results)
+    print(f"slowest process      {slowest:,.0f} codes/s (minimum {MIN_RATE:,})")
+    if duplicates or slowest < MIN_RATE:
+        sys.exit(1)
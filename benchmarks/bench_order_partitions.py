@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Benchmark the monthly-partitioned orders table against a plain one.
+
+Builds both layouts in a scratch ``bench_partitions`` schema, filled with
+the same ``--orders`` synthetic orders spread over ``--months`` months for
+``--customers`` customers. The partitioned copy has the same indexes and
+code registry trigger as api_orders after migration 0007. The run times
+single-order inserts, a customer's latest page, the conditional-GET
+version query and a one-month summary. It also times removing the oldest
+month: a DELETE on the plain table against archiving the partition to a
+gzipped CSV. The schema is dropped at the end.
+
+    python benchmarks/bench_order_partitions.py                   # 50M orders
+    python benchmarks/bench_order_partitions.py --orders 5000000
+"""
+import argparse
+import gzip
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+
+SCHEMA = 'bench_partitions'
+
+COLUMNS = '''
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    customer_id bigint NOT NULL,
+    order_date timestamptz NOT NULL,
+    order_code varchar(20) NOT NULL,
+    total_amount numeric(10, 2) NOT NULL,
+    updated_at timestamptz NOT NULL
+'''
+
+RESERVE_CODE = f'''
+CREATE FUNCTION {SCHEMA}.reserve_code() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO {SCHEMA}.codes (code, order_id) VALUES (NEW.order_code, NEW.id)
+    ON CONFLICT (code) DO UPDATE SET order_id = EXCLUDED.order_id
+    WHERE {SCHEMA}.codes.order_id = EXCLUDED.order_id;
+    IF NOT FOUND THEN
+        RAISE unique_violation;
+    END IF;
+    RETURN NEW;
+END
+$$
+'''
+
+QUERIES = {
+    'latest_page': (
+        'SELECT id, order_date, order_code, total_amount FROM {table} '
+        'WHERE customer_id = %s ORDER BY order_date DESC, id DESC LIMIT 20'),
+    'version': (
+        'SELECT count(id), max(updated_at) FROM {table} WHERE customer_id = %s'),
+    'month_summary': (
+        'SELECT count(*), sum(total_amount) FROM {table} '
+        'WHERE customer_id = %s AND order_date >= %s AND order_date < %s'),
+}
+
+
+def log(message):
+    print(f'  {time.strftime("%H:%M:%S")} {message}', flush=True)
+
+
+def build(cursor, args, start, months):
+    from api import partitions
+
+    cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+    cursor.execute(f'CREATE TABLE {SCHEMA}.plain ({COLUMNS})')
+    cursor.execute(
+        f'CREATE TABLE {SCHEMA}.partitioned ({COLUMNS}) PARTITION BY RANGE (order_date)')
+    for month in months:
+        low, high = partitions.bounds(month)
+        cursor.execute(
+            f"CREATE TABLE {SCHEMA}.partitioned_{month:%Y%m} PARTITION OF {SCHEMA}.partitioned "
+            f"FOR VALUES FROM ('{low.isoformat()}') TO ('{high.isoformat()}')")
+
+    log(f'loading {args.orders} orders into the plain table')
+    span = (timezone_now() - start).total_seconds()
+    cursor.execute(
+        f"INSERT INTO {SCHEMA}.plain (customer_id, order_date, order_code, total_amount, updated_at) "
+        f"SELECT customer, date, 'ORD-' || lpad(to_hex(i), 16, '0'), (random() * 1000)::numeric(10, 2), date "
+        f"FROM (SELECT i, (random() * (%s - 1))::bigint + 1 AS customer, "
+        f"%s::timestamptz + make_interval(secs => %s * i / %s) AS date "
+        f"FROM generate_series(1, %s) AS i) AS rows",
+        [args.customers, start, span, args.orders, args.orders])
+    log('copying into the partitioned table')
+    cursor.execute(f'INSERT INTO {SCHEMA}.partitioned SELECT * FROM {SCHEMA}.plain')
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{SCHEMA}.partitioned', 'id'), %s)", [args.orders])
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{SCHEMA}.plain', 'id'), %s)", [args.orders])
+
+    log('indexing the plain table')
+    cursor.execute(f'ALTER TABLE {SCHEMA}.plain ADD PRIMARY KEY (id)')
+    cursor.execute(f'ALTER TABLE {SCHEMA}.plain ADD UNIQUE (order_code)')
+    cursor.execute(
+        f'CREATE INDEX ON {SCHEMA}.plain (customer_id, order_date, id) INCLUDE (updated_at)')
+
+    log('indexing the partitioned table and its code registry')
+    cursor.execute(f'ALTER TABLE {SCHEMA}.partitioned ADD PRIMARY KEY (id, order_date)')
+    cursor.execute(
+        f'CREATE INDEX ON {SCHEMA}.partitioned (customer_id, order_date, id) INCLUDE (updated_at)')
+    cursor.execute(f'CREATE INDEX ON {SCHEMA}.partitioned (order_code)')
+    cursor.execute(
+        f'CREATE TABLE {SCHEMA}.codes AS SELECT order_code AS code, id AS order_id '
+        f'FROM {SCHEMA}.plain')
+    cursor.execute(f'ALTER TABLE {SCHEMA}.codes ADD PRIMARY KEY (code)')
+    cursor.execute(RESERVE_CODE)
+    cursor.execute(
+        f'CREATE TRIGGER reserve_code BEFORE INSERT ON {SCHEMA}.partitioned '
+        f'FOR EACH ROW EXECUTE FUNCTION {SCHEMA}.reserve_code()')
+
+    log('vacuuming')
+    for table in ('plain', 'partitioned', 'codes'):
+        cursor.execute(f'VACUUM ANALYZE {SCHEMA}.{table}')
+
+
+def timezone_now():
+    from django.utils import timezone
+    return timezone.now()
+
+
+def timed(run, samples):
+    durations = []
+    for sample in samples:
+        start = time.perf_counter()
+        run(sample)
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return {
+        'mean_ms': round(statistics.mean(durations), 3),
+        'p50_ms': round(durations[len(durations) // 2], 3),
+        'p95_ms': round(durations[int(len(durations) * 0.95)], 3),
+    }
+
+
+def measure(cursor, args, months):
+    from api import partitions
+
+    customers = [random.randint(1, args.customers) for _ in range(args.samples)]
+    month_low, month_high = partitions.bounds(months[-2])
+    results = {}
+    for table in ('plain', 'partitioned'):
+        name = f'{SCHEMA}.{table}'
+        codes = iter(range(args.orders + 1, args.orders + 1 + args.samples))
+
+        def insert(customer):
+            now = timezone_now()
+            cursor.execute(
+                f'INSERT INTO {name} (customer_id, order_date, order_code, total_amount, updated_at) '
+                f'VALUES (%s, %s, %s, 10, %s)',
+                [customer, now, f'ORD-{next(codes):016x}', now])
+
+        results[table, 'insert'] = timed(insert, customers)
+        for query, sql in QUERIES.items():
+            sql = sql.format(table=name)
+            params = (lambda customer: [customer, month_low, month_high]
+                      if query == 'month_summary' else [customer])
+            results[table, query] = timed(
+                lambda customer: (cursor.execute(sql, params(customer)), cursor.fetchall()),
+                customers)
+    return results
+
+
+def drop_oldest_month(cursor, months):
+    from api import partitions
+
+    month = months[0]
+    low, high = partitions.bounds(month)
+    start = time.perf_counter()
+    cursor.execute(f'DELETE FROM {SCHEMA}.plain WHERE order_date < %s', [high])
+    deleted = cursor.rowcount
+    delete_seconds = time.perf_counter() - start
+
+    partition = f'{SCHEMA}.partitioned_{month:%Y%m}'
+    path = os.path.join(tempfile.mkdtemp(), f'partitioned_{month:%Y%m}.csv.gz')
+    start = time.perf_counter()
+    cursor.execute(f'ALTER TABLE {SCHEMA}.partitioned DETACH PARTITION {partition}')
+    with gzip.open(path, 'wb') as stream:
+        partitions.copy_out(cursor, f'COPY {partition} TO STDOUT WITH (FORMAT csv, HEADER)', stream)
+    cursor.execute(f'DROP TABLE {partition}')
+    archive_seconds = time.perf_counter() - start
+    return {
+        'orders': deleted,
+        'delete_s': round(delete_seconds, 1),
+        'archive_s': round(archive_seconds, 1),
+        'archive_mb': round(os.path.getsize(path) / 1e6, 1),
+    }
+
+
+def table_sizes(cursor):
+    cursor.execute(
+        f"SELECT pg_total_relation_size('{SCHEMA}.plain'), "
+        f"(SELECT sum(pg_total_relation_size(inhrelid)) FROM pg_inherits "
+        f"WHERE inhparent = '{SCHEMA}.partitioned'::regclass), "
+        f"pg_total_relation_size('{SCHEMA}.codes')")
+    return [round(int(size) / 1e9, 2) for size in cursor.fetchone()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=50_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--samples', type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+    from django.db import connection
+    from api import partitions
+
+    current = partitions.month_of(timezone_now())
+    months = [partitions.add_months(current, offset) for offset in range(-args.months, 2)]
+    start = timezone_now() - timedelta(days=30.4 * args.months)
+
+    print(f"{args.orders} orders, {args.customers} customers, {args.months} months")
+    try:
+        with connection.cursor() as cursor:
+            build(cursor, args, start, months)
+            plain, partitioned, codes = table_sizes(cursor)
+            print(f"\nsize: plain {plain} GB, partitioned {partitioned} GB + code registry {codes} GB")
+
+            results = measure(cursor, args, months)
+            print(f"\n{'operation':>14} {'table':>12} {'mean_ms':>9} {'p50_ms':>9} {'p95_ms':>9}")
+            for (table, operation), stats in results.items():
+                print(f"{operation:>14} {table:>12} {stats['mean_ms']:>9} "
+                      f"{stats['p50_ms']:>9} {stats['p95_ms']:>9}")
+
+            removed = drop_oldest_month(cursor, months)
+            print(f"\noldest month ({removed['orders']} orders): DELETE {removed['delete_s']} s, "
+                  f"detach + gzip CSV + drop {removed['archive_s']} s ({removed['archive_mb']} MB)")
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Compare throughput of the development server with the gunicorn profile.
+
+Starts ``manage.py runserver`` (what the Docker image used to run), then
+gunicorn with config/gunicorn.conf.py serving WSGI and ASGI, and drives
+each with the same mix of /profile/ and /api/orders/ requests from
+concurrent keep-alive clients. Database traffic goes through latency_proxy so opening
+a PostgreSQL connection costs a remote handshake, as it does against Neon
+(``--handshake 0`` for a local database). Throttling is disabled for the
+run (see bench_settings). The seeded customer is deleted at the end.
+
+    python benchmarks/bench_serving.py
+    python benchmarks/bench_serving.py --requests 5000 --concurrency 64 --handshake 0
+"""
+import argparse
+import os
+import sys
+from urllib.parse import urlparse, urlunparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import django
+
+from benchmarks.latency_proxy import start_proxy
+from benchmarks.loadgen import (
+    drive, free_port, seed_customer, start_server, stop_server, summarize)
+
+PATHS = ['/profile/', '/api/orders/?page_size=20']
+
+
+def commands(port):
+    gunicorn = [sys.executable, '-m', 'gunicorn', '-c', 'config/gunicorn.conf.py',
+                '--bind', f'127.0.0.1:{port}']
+    return {
+        'runserver': ([sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}'], {}),
+        'gunicorn-wsgi': (gunicorn, {'SERVER_INTERFACE': 'wsgi'}),
+        'gunicorn-asgi': (gunicorn, {'SERVER_INTERFACE': 'asgi'}),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--handshake', type=float, default=0.03,
+                        help="Simulated seconds to open a PostgreSQL connection")
+    parser.add_argument('servers', nargs='*',
+                        default=['runserver', 'gunicorn-wsgi', 'gunicorn-asgi'])
+    args = parser.parse_args()
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.bench_settings'
+    django.setup()
+
+    from django.conf import settings
+
+    db = settings.DATABASES['default']
+    _, proxy_port, _ = start_proxy((db['HOST'], int(db['PORT'])), handshake=args.handshake)
+    url = urlparse(os.environ['DATABASE_URL'])
+    proxy_url = urlunparse(url._replace(
+        netloc=f'{url.username}:{url.password}@127.0.0.1:{proxy_port}'))
+
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'GUNICORN_ACCESS_LOG': '',
+           'DATABASE_URL': proxy_url}
+    user, token = seed_customer(orders=200)
+    try:
+        print(f"{'server':>14} {'rps':>6} {'p50_ms':>7} {'p95_ms':>7} {'p99_ms':>7}")
+        for name in args.servers:
+            port = free_port()
+            command, extra_env = commands(port)[name]
+            process = start_server(command, port, ROOT, {**env, **extra_env})
+            try:
+                result = summarize(*drive(
+                    port, token, PATHS, args.requests, args.concurrency))
+            finally:
+                stop_server(process)
+            print(f"{name:>14} {result['rps']:>6} {result['p50_ms']:>7} "
+                  f"{result['p95_ms']:>7} {result['p99_ms']:>7}")
+    finally:
+        user.delete()
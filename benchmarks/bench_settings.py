@@ -0,0 +1,21 @@
+"""
+Settings for benchmark servers: the project settings without request
+throttling, and without the in-process auth cache so every request
+authenticates against the database like a cold worker would.
+
+BENCH_GOOGLE_URL points the OAuth views at benchmarks/fake_google.py.
+"""
+import os
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import AUTH_CACHE, HTTP_CLIENT, REST_FRAMEWORK
+
+REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+AUTH_CACHE = {**AUTH_CACHE, 'ENABLED': False}
+
+if os.getenv('BENCH_GOOGLE_URL'):
+    HTTP_CLIENT = {**HTTP_CLIENT, 'ENDPOINTS': {
+        'google_token': {'url': f"{os.environ['BENCH_GOOGLE_URL']}/token"},
+        'google_userinfo': {'url': f"{os.environ['BENCH_GOOGLE_URL']}/userinfo"},
+        'google_jwks': {'url': f"{os.environ['BENCH_GOOGLE_URL']}/certs"},
+    }}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Throughput of the SMS outbox worker against the local stand-in gateway.
+
+Queues N confirmations and drains them twice: once with personalised
+messages (one request per SMS) and once with a shared template (bulk
+requests of up to SMS_OUTBOX['MAX_RECIPIENTS'] numbers).
+
+    python benchmarks/bench_sms_batching.py              # 2,000 messages
+    python benchmarks/bench_sms_batching.py 10000 0.1    # messages, gateway latency
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+
+from benchmarks.fake_sms_gateway import start_gateway
+
+
+def seed(count, personalised):
+    from api.models import SMSOutbox
+
+    rows = []
+    for i in range(count):
+        message = (f"Hello {i}, your order with code ORD-{i:08d} has been confirmed."
+                   if personalised else "Your order has been confirmed.")
+        rows.append(SMSOutbox(phone_number=f'+2547{i:08d}', message=message))
+    return [row.id for row in SMSOutbox.objects.bulk_create(rows, batch_size=2000)]
+
+
+def run(count, personalised, url):
+    from api import outbox, utils
+    from api.models import SMSOutbox
+
+    ids = seed(count, personalised)
+    utils.sms.base_url = f'{url}/version1'
+    config = {**outbox.get_config(), 'BATCH_WINDOW': 0}
+    try:
+        start = time.perf_counter()
+        # send_sms prints every gateway response
+        with contextlib.redirect_stdout(io.StringIO()):
+            totals = outbox.drain(config=config)
+        elapsed = time.perf_counter() - start
+    finally:
+        SMSOutbox.objects.filter(id__in=ids).delete()
+    return totals, elapsed
+
+
+if __name__ == "__main__":
+    # the real SDK client is used, pointed at the stand-in gateway
+    os.environ.setdefault('AFRICASTALKING_USERNAME', 'sandbox')
+    os.environ.setdefault('AFRICASTALKING_API_KEY', 'benchmark')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+    from api.models import SMSOutbox
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    if SMSOutbox.objects.exclude(
+            status__in=[SMSOutbox.SENT, SMSOutbox.FAILED, SMSOutbox.UNKNOWN]).exists():
+        sys.exit("The outbox has undelivered rows, run this against an empty database.")
+
+    server, url, stats = start_gateway(latency=latency)
+    print(f"{'mode':>13} {'messages':>9} {'requests':>9} {'seconds':>8} {'msg/s':>8}")
+    for label, personalised in (('personalised', True), ('shared', False)):
+        stats.requests = 0
+        totals, elapsed = run(count, personalised, url)
+        print(f"{label:>13} {totals['sent']:>9} {stats.requests:>9} "
+              f"{elapsed:>8.2f} {totals['sent'] / elapsed:>8.0f}")
+    server.shutdown()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Compare DRF's timestamp-history throttle with the shared sliding-window
+throttles in api/throttling.py.
+
+For each backend, ``--workers`` forked processes each send ``--requests``
+checks for the same user against a ``--rate`` limit. Each process has its
+own LocMemCache, as gunicorn workers do without a shared cache. The run
+reports how many requests were allowed in total, which should equal the
+rate, and the mean cost of one check at the start and end of a process's
+run. The timestamp history grows with the number of allowed requests.
+
+    python benchmarks/bench_throttling.py
+    python benchmarks/bench_throttling.py --workers 4 --requests 5000 --rate 10000/hour
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+
+BACKENDS = ['drf-locmem', 'sqlite']
+
+
+def throttle_class(backend, rate):
+    from rest_framework import throttling as drf_throttling
+    from api import throttling
+
+    base = (drf_throttling.UserRateThrottle if backend == 'drf-locmem'
+            else throttling.UserRateThrottle)
+    return type('BenchThrottle', (base,), {'rate': rate})
+
+
+def worker(backend, rate, requests):
+    throttle = throttle_class(backend, rate)()
+    request = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=1))
+    allowed, samples = 0, []
+    for _ in range(requests):
+        start = time.perf_counter()
+        allowed += throttle.allow_request(request, None)
+        samples.append(time.perf_counter() - start)
+    tenth = max(1, requests // 10)
+    first = sum(samples[:tenth]) / tenth * 1e6
+    last = sum(samples[-tenth:]) / tenth * 1e6
+    return allowed, first, last
+
+
+def run(backend, args):
+    from django.test import override_settings
+
+    path = os.path.join(tempfile.mkdtemp(), 'throttle.sqlite3')
+    with override_settings(THROTTLE={'STORE': 'sqlite', 'SQLITE_PATH': path}):
+        with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+            results = pool.starmap(
+                worker, [(backend, args.rate, args.requests)] * args.workers)
+    return {
+        'allowed': sum(allowed for allowed, _, _ in results),
+        'first_us': round(sum(first for _, first, _ in results) / len(results), 1),
+        'last_us': round(sum(last for _, _, last in results) / len(results), 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--rate', default='10000/hour')
+    parser.add_argument('backends', nargs='*', default=BACKENDS)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+    print(f"rate {args.rate}, {args.workers} workers x {args.requests} requests")
+    print(f"{'backend':>10} {'allowed':>8} {'first_us':>9} {'last_us':>8}")
+    for backend in args.backends:
+        result = run(backend, args)
+        print(f"{backend:>10} {result['allowed']:>8} {result['first_us']:>9} "
+              f"{result['last_us']:>8}")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Local stand-in for Google's OAuth token, userinfo and key endpoints.
+
+Serves ``POST /token``, ``GET /userinfo`` and ``GET /certs`` over HTTPS
+with a throwaway self-signed certificate, after an artificial latency.
+Token responses carry an ``id_token`` signed with a throwaway RSA key that
+``/certs`` publishes, for the client id of the request. ``start_google``
+returns the base URL and the CA file to trust (``REQUESTS_CA_BUNDLE``).
+
+Faults can be injected while it runs: set ``server.fault_status`` to
+answer every request with that error status, and ``server.fault_delay`` to
+add that many seconds to each answer.
+
+    python benchmarks/fake_google.py --port 8443 --latency 0.02
+"""
+import argparse
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.x509.oid import NameOID
+
+# the same fake user for every token keeps the benchmark DB small
+PROFILE = {
+    'sub': '1234567890',
+    'email': 'bench.user@example.com',
+    'email_verified': True,
+    'name': 'Bench User',
+    'given_name': 'Bench',
+    'family_name': 'User',
+}
+
+
+def make_certificate(directory):
+    """Write a self-signed certificate for 127.0.0.1/localhost, return paths"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName('localhost'),
+            x509.IPAddress(ipaddress.ip_address('127.0.0.1')),
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class GoogleStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.connections = 0
+
+        # requests being answered at the same moment, and the most seen
+        self.active = 0
+        self.peak_active = 0
+
+    def record(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    @contextmanager
+    def serving(self):
+        with self.lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class SigningKey:
+    """An RSA key, its JWKS entry and ID tokens signed with it"""
+
+    def __init__(self, kid=None):
+        self.kid = kid or uuid.uuid4().hex
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.jwk = {**json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(
+            self.private_key.public_key())), 'kid': self.kid, 'alg': 'RS256', 'use': 'sig'}
+
+    def id_token(self, audience, **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': audience,
+                   'iat': now, 'exp': now + 3600, **PROFILE, **claims}
+        return jwt.encode(payload, self.private_key, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+
+def make_handler(latency, stats, keys, jwks_max_age):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with stats.lock:
+                stats.connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            with stats.serving():
+                time.sleep(latency + self.server.fault_delay)
+            stats.record(path)
+            if self.server.fault_status:
+                return self.send_json({'error': 'backend_error'}, self.server.fault_status)
+            if path != '/token':
+                return self.send_json({'error': 'not_found'}, 404)
+            tokens = {
+                'access_token': f'ya29.fake-{uuid.uuid4().hex}',
+                'expires_in': 3599,
+                'token_type': 'Bearer',
+                'scope': 'email profile',
+            }
+            if form.get('grant_type') == ['authorization_code']:
+                tokens['refresh_token'] = f'1//fake-{uuid.uuid4().hex}'
+                tokens['id_token'] = keys[-1].id_token(form.get('client_id', [''])[0])
+            self.send_json(tokens)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            with stats.serving():
+                time.sleep(latency + self.server.fault_delay)
+            stats.record(path)
+            if self.server.fault_status:
+                return self.send_json({'error': 'backend_error'}, self.server.fault_status)
+            if path == '/certs':
+                return self.send_json({'keys': [key.jwk for key in keys]}, headers={
+                    'Cache-Control': f'public, max-age={jwks_max_age}, must-revalidate'})
+            if path != '/userinfo':
+                return self.send_json({'error': 'not_found'}, 404)
+            self.send_json(PROFILE)
+
+    return Handler
+
+
+class GoogleServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # async clients open hundreds of connections at once
+    request_queue_size = 1024
+
+
+def start_google(port=0, latency=0.0, tls=True, jwks_max_age=21600):
+    """
+    Start the fake in a daemon thread, return (server, base_url, ca_file, stats).
+
+    ``server.keys`` lists the published signing keys, the last one signs;
+    append a SigningKey to rotate.
+    """
+    stats = GoogleStats()
+    keys = [SigningKey()]
+    server = GoogleServer(
+        ('127.0.0.1', port), make_handler(latency, stats, keys, jwks_max_age))
+    server.keys = keys
+    server.fault_status, server.fault_delay = None, 0.0
+    ca_file = None
+    scheme = 'http'
+    if tls:
+        cert_path, key_path = make_certificate(tempfile.mkdtemp())
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        ca_file, scheme = cert_path, 'https'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'{scheme}://127.0.0.1:{server.server_address[1]}', ca_file, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--no-tls', action='store_true')
+    parser.add_argument('--fault-status', type=int,
+                        help="Answer every request with this error status")
+    parser.add_argument('--fault-delay', type=float, default=0.0,
+                        help="Extra seconds before every answer")
+    args = parser.parse_args()
+
+    server, url, ca_file, stats = start_google(args.port, args.latency, not args.no_tls)
+    server.fault_status, server.fault_delay = args.fault_status, args.fault_delay
+    print(f"Fake Google listening on {url} "
+          f"(token: {url}/token, userinfo: {url}/userinfo, keys: {url}/certs)")
+    if ca_file:
+        print(f"Trust it with REQUESTS_CA_BUNDLE={ca_file}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Africa's Talking messaging endpoint.
+
+Answers ``POST /version1/messaging`` like the real API, with one
+``Recipients`` entry per number in ``to``, after an artificial latency.
+Point the client at it by setting ``api.utils.sms.base_url`` to ``<url>/version1``.
+Set ``server.fault_status`` to answer with that error status instead, and
+``server.fault_delay`` to add seconds to each answer.
+
+    python benchmarks/fake_sms_gateway.py --port 8025 --latency 0.05
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class GatewayStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.messages = 0
+
+    def record(self, recipients):
+        with self.lock:
+            self.requests += 1
+            self.messages += recipients
+
+
+def make_handler(latency, stats, failing_numbers=()):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            numbers = form.get('to', [''])[0].split(',')
+            time.sleep(latency + self.server.fault_delay)
+            stats.record(len(numbers))
+            if self.server.fault_status:
+                body = b'The service is unavailable'
+                self.send_response(self.server.fault_status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            recipients = []
+            for number in numbers:
+                ok = number not in failing_numbers
+                recipients.append({
+                    'number': number,
+                    'status': 'Success' if ok else 'InvalidPhoneNumber',
+                    'statusCode': 101 if ok else 403,
+                    'cost': 'KES 0.8000' if ok else '0',
+                    'messageId': f'ATXid_{uuid.uuid4().hex}' if ok else 'None',
+                })
+            body = json.dumps({'SMSMessageData': {
+                'Message': f'Sent to {len(numbers)}/{len(numbers)} Total Cost: KES 0',
+                'Recipients': recipients,
+            }}).encode()
+
+            self.send_response(201)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def start_gateway(port=0, latency=0.05, failing_numbers=()):
+    """Start the gateway in a daemon thread, return (server, base_url, stats)"""
+    stats = GatewayStats()
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', port), make_handler(latency, stats, failing_numbers))
+    server.daemon_threads = True
+    server.fault_status, server.fault_delay = None, 0.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}', stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Seconds each request takes to answer")
+    parser.add_argument('--fault-status', type=int,
+                        help="Answer every request with this error status")
+    parser.add_argument('--fault-delay', type=float, default=0.0,
+                        help="Extra seconds before every answer")
+    args = parser.parse_args()
+
+    server, url, stats = start_gateway(args.port, args.latency)
+    server.fault_status, server.fault_delay = args.fault_status, args.fault_delay
+    print(f"Fake SMS gateway listening on {url}/version1/messaging")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"{stats.requests} requests, {stats.messages} messages")
+        server.shutdown()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+TCP proxy that delays every new connection, standing in for the TCP, TLS
+and authentication round trips of a remote PostgreSQL host (e.g. Neon)
+when benchmarking against a local server.
+
+    python benchmarks/latency_proxy.py --port 6543 --upstream 127.0.0.1:5432 --handshake 0.03
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+class ProxyStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    def record(self):
+        with self.lock:
+            self.connections += 1
+
+
+def pump(source, target):
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            target.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def make_handler(upstream, handshake, stats):
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            stats.record()
+            time.sleep(handshake)
+            with socket.create_connection(upstream) as remote:
+                for sock in (self.request, remote):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                reader = threading.Thread(
+                    target=pump, args=(remote, self.request), daemon=True)
+                reader.start()
+                pump(self.request, remote)
+                reader.join()
+
+    return Handler
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_proxy(upstream, port=0, handshake=0.03):
+    """Start the proxy in a daemon thread, return (server, port, stats)"""
+    stats = ProxyStats()
+    server = ThreadingTCPServer(
+        ('127.0.0.1', port), make_handler(upstream, handshake, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1], stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=6543)
+    parser.add_argument('--upstream', default='127.0.0.1:5432')
+    parser.add_argument('--handshake', type=float, default=0.03,
+                        help="Seconds added before each new connection is forwarded")
+    args = parser.parse_args()
+
+    host, _, port = args.upstream.rpartition(':')
+    server, _, _ = start_proxy((host, int(port)), args.port, args.handshake)
+    print(f"Proxying 127.0.0.1:{args.port} -> {args.upstream}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,155 @@
+"""
+Helpers shared by the benchmarks that drive a real HTTP server: starting
+a server process, seeding a customer to authenticate as, and replaying
+requests from concurrent keep-alive clients.
+"""
+import http.client
+import os
+import re
+import signal
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# the db entry InstrumentationMiddleware adds to Server-Timing
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port, cwd, env, startup=30):
+    """Start ``command`` and wait until it accepts connections on ``port``"""
+    # own process group, so reloaders and worker processes stop with it
+    process = subprocess.Popen(
+        command, cwd=cwd, env=env, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + startup
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError(f'{command[0]} did not start')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def seed_customer(orders=0):
+    """Create a customer with ``orders`` orders, return (user, access_token)"""
+    from django.contrib.auth.models import User
+    from api.models import Customer, Orders
+    from api.order_codes import assign_order_codes
+
+    user = User.objects.create(username=f'bench-{uuid.uuid4().hex}', first_name='Bench')
+    token = uuid.uuid4().hex
+    customer = Customer.objects.create(
+        user=user, phone_number='+254700000000', access_token=token)
+    Orders.objects.bulk_create(assign_order_codes([
+        Orders(customer=customer, total_amount=i % 500 + 1) for i in range(orders)
+    ]))
+    return user, token
+
+
+def drive(port, token, paths, total, concurrency, warmup=None):
+    """
+    Send ``total`` GETs cycling through ``paths`` from ``concurrency``
+    keep-alive clients; return (sorted latencies in ms, elapsed seconds).
+    """
+    local = threading.local()
+    headers = {'Cookie': f'access_token={token}'}
+
+    def one(index):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        start = time.perf_counter()
+        try:
+            local.conn.request('GET', paths[index % len(paths)], headers=headers)
+            response = local.conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # the server closed the keep-alive connection, reconnect once
+            local.conn.close()
+            local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            local.conn.request('GET', paths[index % len(paths)], headers=headers)
+            response = local.conn.getresponse()
+            response.read()
+        assert response.status == 200, response.status
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(warmup or concurrency * 2)))
+        start = time.perf_counter()
+        samples = sorted(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - start
+    return samples, elapsed
+
+
+def replay(port, build, total, concurrency, warmup=None):
+    """
+    Send ``total`` requests from ``concurrency`` keep-alive clients, where
+    ``build(index)`` returns (method, path, headers, body, expected status).
+
+    Returns (sorted latencies in ms, query counts, unexpected responses,
+    elapsed seconds). Query counts are read from the Server-Timing header,
+    so they are only there when the server runs with INSTRUMENTATION.
+    """
+    local = threading.local()
+
+    def send(method, path, headers, body):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        try:
+            local.conn.request(method, path, body=body, headers=headers)
+            response = local.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # the server closed the keep-alive connection, reconnect once
+            local.conn.close()
+            local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            local.conn.request(method, path, body=body, headers=headers)
+            response = local.conn.getresponse()
+        response.read()
+        return response
+
+    def one(index):
+        method, path, headers, body, expected = build(index)
+        start = time.perf_counter()
+        response = send(method, path, headers, body)
+        duration = (time.perf_counter() - start) * 1000
+        match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing', ''))
+        queries = int(match[1]) if match else None
+        return duration, queries, response.status == expected
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(warmup if warmup is not None else concurrency * 2)))
+        start = time.perf_counter()
+        results = list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - start
+    samples = sorted(duration for duration, _, _ in results)
+    queries = [count for _, count, _ in results if count is not None]
+    errors = sum(not ok for _, _, ok in results)
+    return samples, queries, errors, elapsed
+
+
+def summarize(samples, elapsed):
+    return {
+        'rps': round(len(samples) / elapsed),
+        'p50_ms': round(samples[len(samples) // 2], 1),
+        'p95_ms': round(samples[int(len(samples) * 0.95)], 1),
+        'p99_ms': round(samples[int(len(samples) * 0.99)], 1),
+    }
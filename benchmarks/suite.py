@@ -0,0 +1,157 @@
+"""
+The scenarios behind ``manage.py benchmark``.
+
+``seed`` bulk-inserts customers with orders, ``run`` drives each scenario
+through the real URL routes of a gunicorn server, and ``compare`` checks
+a run's JSON report against a baseline. Every seeded user's name starts
+with a per-run prefix, so ``cleanup`` removes exactly what ``seed`` and
+the scenarios created.
+"""
+import json
+import statistics
+import uuid
+
+from benchmarks.loadgen import replay, summarize
+
+# the account benchmarks/fake_google.py signs every login in as
+OAUTH_USERNAME = 'bench.user'
+OAUTH_EMAIL = 'bench.user@example.com'
+
+SCENARIOS = ['orders', 'customers', 'profile', 'oauth_callback', 'create_order']
+
+LATENCIES = ['p50_ms', 'p95_ms', 'p99_ms']
+# below this many milliseconds a latency change is scheduling noise
+LATENCY_FLOOR_MS = 1.0
+
+
+def seed(users, orders_per_user, batch_size=2000):
+    """
+    Create ``users`` users and customers with ``orders_per_user`` orders
+    each, in bulk. Returns (username prefix, access tokens).
+    """
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from api import rollups
+    from api.models import Customer, Orders, hash_token
+    from api.order_codes import assign_order_codes
+
+    prefix = f'bench-{uuid.uuid4().hex[:8]}-'
+    tokens = [uuid.uuid4().hex for _ in range(users)]
+    with transaction.atomic():
+        created = User.objects.bulk_create(
+            [User(username=f'{prefix}{i}', first_name='Bench', last_name=str(i),
+                  email=f'{prefix}{i}@example.com')
+             for i in range(users)],
+            batch_size=batch_size)
+        # bulk_create skips Customer.save(), which fills in the digest
+        customers = Customer.objects.bulk_create(
+            [Customer(user=user, phone_number=f'+2547{i:08d}', access_token=token,
+                      access_token_hash=hash_token(token))
+             for i, (user, token) in enumerate(zip(created, tokens))],
+            batch_size=batch_size)
+
+        per_batch = max(1, batch_size // max(orders_per_user, 1))
+        for start in range(0, len(customers), per_batch):
+            orders = assign_order_codes([
+                Orders(customer=customer, total_amount=i % 500 + 1)
+                for customer in customers[start:start + per_batch]
+                for i in range(orders_per_user)
+            ])
+            rollups.record_orders(Orders.objects.bulk_create(orders, batch_size=batch_size))
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {Orders._meta.db_table}')
+    return prefix, tokens
+
+
+def cleanup(prefix):
+    """Delete the users seeded under ``prefix`` and everything they own"""
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from api.models import Customer, OrderCode, Orders, SMSOutbox
+
+    customers = Customer.objects.filter(user__username__startswith=prefix)
+    orders = Orders.objects.filter(customer__in=customers)
+    with transaction.atomic():
+        SMSOutbox.objects.filter(order__in=orders).delete()
+        OrderCode.objects.filter(order_id__in=orders.values('id')).delete()
+        # deleted in SQL, Orders' post_delete would update the rollups
+        # row by row only for them to be deleted with the customers
+        sql, params = customers.values('id').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {Orders._meta.db_table} WHERE customer_id IN ({sql})', params)
+        User.objects.filter(username__startswith=prefix).delete()
+
+
+def oauth_account():
+    """
+    Create the account fake Google logs everyone in as, so concurrent
+    first logins don't race to insert it. Returns it if it is new.
+    """
+    from django.contrib.auth.models import User
+    from api.models import Customer
+
+    user, created = User.objects.get_or_create(
+        username=OAUTH_USERNAME, defaults={'email': OAUTH_EMAIL})
+    Customer.objects.get_or_create(user=user, defaults={'phone_number': ''})
+    return user if created else None
+
+
+def requests_for(scenario, tokens):
+    """The request builder ``loadgen.replay`` sends for ``scenario``"""
+    def cookie(index):
+        return {'Cookie': f'access_token={tokens[index % len(tokens)]}'}
+
+    if scenario == 'orders':
+        return lambda index: ('GET', '/api/orders/?page_size=20', cookie(index), None, 200)
+    if scenario == 'customers':
+        return lambda index: ('GET', '/api/customers/', cookie(index), None, 200)
+    if scenario == 'profile':
+        return lambda index: ('GET', '/profile/', cookie(index), None, 200)
+    if scenario == 'oauth_callback':
+        return lambda index: ('GET', '/accounts/google/login/callback/?code=bench', {}, None, 302)
+    if scenario == 'create_order':
+        body = json.dumps({'total_amount': '25.00'})
+        return lambda index: (
+            'POST', '/api/orders/',
+            {**cookie(index), 'Content-Type': 'application/json'}, body, 201)
+    raise ValueError(f'Unknown scenario {scenario!r}')
+
+
+def run(scenario, port, tokens, total, concurrency):
+    """Drive one scenario, return its report entry"""
+    samples, queries, errors, elapsed = replay(
+        port, requests_for(scenario, tokens), total, concurrency)
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        **summarize(samples, elapsed),
+        'queries': statistics.median(queries) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Regressions of ``current`` against ``baseline`` (both run reports), as
+    messages. Throughput and latency may move by ``tolerance`` (a fraction)
+    before they count; any rise in queries per request does.
+    """
+    regressions = []
+    for scenario, now in current['scenarios'].items():
+        before = baseline['scenarios'].get(scenario)
+        if before is None:
+            continue
+        if now['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{scenario}: rps {before['rps']} -> {now['rps']}")
+        for key in LATENCIES:
+            if (now[key] > before[key] * (1 + tolerance)
+                    and now[key] - before[key] >= LATENCY_FLOOR_MS):
+                regressions.append(f"{scenario}: {key} {before[key]} -> {now[key]}")
+        if None not in (now['queries'], before['queries']) and now['queries'] > before['queries']:
+            regressions.append(
+                f"{scenario}: queries per request {before['queries']} -> {now['queries']}")
+        if now['errors'] > before['errors']:
+            regressions.append(f"{scenario}: errors {before['errors']} -> {now['errors']}")
+    return regressions
@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# sync code runs on a fresh thread per request under ASGI, so per-thread
+# persistent connections would never be reused; pool them per process
+os.environ.setdefault('DB_POOL', 'True')
 
 application = get_asgi_application()
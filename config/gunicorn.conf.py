@@ -0,0 +1,104 @@
+"""
+Gunicorn settings for production serving.
+
+    gunicorn -c config/gunicorn.conf.py
+
+SERVER_INTERFACE picks the application: ``wsgi`` (default) serves
+config.wsgi through threaded workers; ``asgi`` serves config.asgi through
+uvicorn workers, so the async OAuth views keep many Google round trips in
+flight per process. The synchronous API views are slower under ASGI (see
+benchmarks/bench_serving.py), so only pick it for login-heavy deployments.
+
+Every value can be overridden from the environment (see example.env).
+
+Signals: ``kill -HUP <master>`` re-reads this file and replaces the
+workers gracefully. Because the app is preloaded in the master, HUP does
+not pick up new code; deploy code with ``kill -USR2 <master>`` (starts a
+new master alongside the old one) followed by ``kill -TERM <old master>``.
+"""
+import glob
+import os
+import tempfile
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() == 'true'
+
+
+def cpu_count():
+    # CPUs this container may run on, not every CPU of the host
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+CPUS = cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '8000')}")
+
+interface = os.getenv('SERVER_INTERFACE', 'wsgi')
+wsgi_app = f'config.{interface}:application'
+
+# requests mostly wait on PostgreSQL, Google and Africa's Talking, so each
+# gthread worker runs a few threads on top of the classic 2 x CPUs + 1
+worker_class = os.getenv(
+    'GUNICORN_WORKER_CLASS',
+    'uvicorn_worker.UvicornWorker' if interface == 'asgi' else 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 2 * CPUS + 1))
+threads = int(os.getenv('GUNICORN_THREADS', max(2, CPUS)))
+
+# import Django once in the master; forked workers share its memory
+# pages copy-on-write instead of each importing the project again
+reload = env_bool('GUNICORN_RELOAD', False)
+preload_app = env_bool('GUNICORN_PRELOAD', not reload)
+
+# recycle workers after a jittered number of requests so slow leaks are
+# bounded and the workers don't all restart at the same moment
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+# time in-flight requests get to finish on reload or shutdown
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# worker heartbeats on tmpfs, a slow container disk can't stall them
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# each worker flushes its metrics to a file here and /metrics sums them
+# (api/metrics.py); set once, so a HUP reload keeps the same directory
+if not os.getenv('METRICS_MULTIPROCESS_DIR'):
+    os.environ['METRICS_MULTIPROCESS_DIR'] = tempfile.mkdtemp(
+        prefix='sil-metrics-', dir=worker_tmp_dir)
+
+# empty GUNICORN_ACCESS_LOG turns the access log off
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # metrics left by a previous master start from zero again
+    for path in glob.glob(os.path.join(os.environ['METRICS_MULTIPROCESS_DIR'], '*.json')):
+        os.unlink(path)
+
+
+def post_fork(server, worker):
+    # a connection opened while preloading must not be shared between
+    # workers (api.http_client already rebuilds its session per process)
+    if server.cfg.preload_app:
+        from django.db import connections
+
+        from api.metrics import REGISTRY
+
+        connections.close_all()
+        # without preloading, api.apps starts it when the worker loads Django
+        REGISTRY.start_flusher()
+
+
+def child_exit(server, worker):
+    # keep the counts of recycled workers without keeping their files
+    from api.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid, os.environ['METRICS_MULTIPROCESS_DIR'])
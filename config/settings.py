@@ -1,5 +1,6 @@
 from urllib.parse import urlparse, parse_qsl
 import os
+import tempfile
 from os import getenv
 from dotenv import load_dotenv
 from pathlib import Path
@@ -44,13 +45,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # outermost, so its total covers the whole chain; removed when disabled
+    'api.instrumentation.InstrumentationMiddleware',
+    # first, so session and authentication reads are routed as well
+    'api.routers.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.WhiteNoiseMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware",
 ]
@@ -158,11 +163,44 @@ DATABASES = {
         'USER': tmpPostgres.username,
         'PASSWORD': tmpPostgres.password,
         'HOST': tmpPostgres.hostname,
-        'PORT': 5432,
+        'PORT': tmpPostgres.port or 5432,
         'OPTIONS': dict(parse_qsl(tmpPostgres.query)),
+        # keep connections open between requests instead of paying the
+        # TCP + TLS + auth handshake each time; 0 closes after every request
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        # ping a reused connection before the request that picks it up
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true',
     }
 }
 
+# DB_POOL=True switches to psycopg 3's connection pool (one per worker
+# process) instead of per-thread persistent connections
+if os.getenv('DB_POOL', 'False').lower() == 'true':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        # seconds a request waits for a free connection before failing
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
+# comma-separated read replicas; api.routers sends safe reads there
+REPLICA_DATABASES = []
+for index, url in enumerate(filter(None, os.getenv('REPLICA_DATABASE_URLS', '').split(',')), 1):
+    replica = dj_database_url.parse(url.strip())
+    replica['CONN_MAX_AGE'] = DATABASES['default']['CONN_MAX_AGE']
+    replica['CONN_HEALTH_CHECKS'] = DATABASES['default']['CONN_HEALTH_CHECKS']
+    if 'pool' in DATABASES['default']['OPTIONS'] and 'postgresql' in replica['ENGINE']:
+        replica.setdefault('OPTIONS', {})['pool'] = DATABASES['default']['OPTIONS']['pool']
+    # test runs read and write the primary's test database
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[f'replica_{index}'] = replica
+    REPLICA_DATABASES.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+# seconds a client's reads stay on the primary after it writes
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -215,8 +253,8 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.SessionAuthentication",
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'api.throttling.AnonRateThrottle',
+        'api.throttling.UserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '5/day',
@@ -224,6 +262,149 @@ REST_FRAMEWORK = {
     }
 }
 
+# REDIS_URL adds a 'shared' cache seen by every worker and node (needs the
+# redis package); without it caches are per process
+REDIS_URL = os.getenv('REDIS_URL') or None
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+if REDIS_URL:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+
+# where throttle counters live, see api/throttling.py: the shared cache when
+# there is one, otherwise a SQLite file shared by the processes of this host
+THROTTLE = {
+    'STORE': os.getenv('THROTTLE_STORE') or ('cache' if REDIS_URL else 'sqlite'),
+    'CACHE': os.getenv('THROTTLE_CACHE') or ('shared' if REDIS_URL else 'default'),
+    'SQLITE_PATH': os.getenv('THROTTLE_SQLITE_PATH') or os.path.join(
+        tempfile.gettempdir(), 'sil-throttle.sqlite3'),
+}
+
+# token -> (user, customer) cache used by CookieAuthentication, see api/auth_cache.py
+# set AUTH_CACHE_SHARED_CACHE to a CACHES alias to share entries across workers
+AUTH_CACHE = {
+    'ENABLED': os.getenv('AUTH_CACHE_ENABLED', 'True').lower() == 'true',
+    'MAX_ENTRIES': int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '10000')),
+    'TTL': int(os.getenv('AUTH_CACHE_TTL', '60')),
+    'LOCAL_TTL': int(os.getenv('AUTH_CACHE_LOCAL_TTL', '5')),
+    'SHARED_CACHE': os.getenv('AUTH_CACHE_SHARED_CACHE') or None,
+}
+
+# the OAuth callback reads the profile from Google's ID token, verified
+# against Google's keys cached per process or in GOOGLE_JWKS_CACHE, a
+# CACHES alias shared by the workers. See api/google_id_token.py
+GOOGLE_ID_TOKEN = {
+    'ENABLED': os.getenv('GOOGLE_ID_TOKEN_ENABLED', 'True').lower() == 'true',
+    'CACHE': os.getenv('GOOGLE_JWKS_CACHE') or ('shared' if REDIS_URL else None),
+}
+
+# concurrent calls doing the same work, like refreshing one refresh token,
+# share one result, see api/single_flight.py. SINGLE_FLIGHT_CACHE names the
+# CACHES alias that coalesces them across workers
+SINGLE_FLIGHT = {
+    'CACHE': os.getenv('SINGLE_FLIGHT_CACHE') or ('shared' if REDIS_URL else None),
+    'GRACE': int(os.getenv('SINGLE_FLIGHT_GRACE', '10')),
+}
+
+# signed session tokens instead of Google's access token in the cookie,
+# see api/session_tokens.py. SESSION_TOKEN_KEYS is "kid:secret,kid:secret";
+# without it a key is derived from SECRET_KEY
+SESSION_TOKENS = {
+    'ENABLED': os.getenv('SESSION_TOKENS_ENABLED', 'False').lower() == 'true',
+    'KEYS': dict(
+        entry.strip().split(':', 1)
+        for entry in os.getenv('SESSION_TOKEN_KEYS', '').split(',') if entry.strip()),
+    'SIGNING_KEY': os.getenv('SESSION_TOKEN_SIGNING_KEY') or None,
+    'LIFETIME': int(os.getenv('SESSION_TOKEN_LIFETIME', '900')),
+    'REVOCATION_REFRESH': int(os.getenv('SESSION_TOKEN_REVOCATION_REFRESH', '10')),
+}
+
+# order confirmation SMS are queued in api.SMSOutbox and sent by
+# `python manage.py process_sms_outbox`, see api/outbox.py
+SMS_OUTBOX = {
+    'BATCH_SIZE': int(os.getenv('SMS_OUTBOX_BATCH_SIZE', '500')),
+    'MAX_RECIPIENTS': int(os.getenv('SMS_OUTBOX_MAX_RECIPIENTS', '100')),
+    'BATCH_WINDOW': float(os.getenv('SMS_OUTBOX_BATCH_WINDOW', '0.5')),
+    'CONCURRENCY': int(os.getenv('SMS_OUTBOX_CONCURRENCY', '4')),
+    'MAX_ATTEMPTS': int(os.getenv('SMS_OUTBOX_MAX_ATTEMPTS', '5')),
+    'BACKOFF_BASE': int(os.getenv('SMS_OUTBOX_BACKOFF_BASE', '30')),
+    'POLL_INTERVAL': float(os.getenv('SMS_OUTBOX_POLL_INTERVAL', '2')),
+    'COUNTRY_CODE': os.getenv('SMS_OUTBOX_COUNTRY_CODE', '254'),
+}
+
+# order confirmation text, {first_name} and {order_code} are filled in.
+# Confirmations with identical text are sent as one bulk request; the
+# default names both, so only a template without those fields batches.
+SMS_CONFIRMATION_TEMPLATE = os.getenv('SMS_CONFIRMATION_TEMPLATE') or None
+
+# per-request query counts, DB/external/total time as Server-Timing headers
+# and histograms at /metrics, see api/instrumentation.py
+INSTRUMENTATION = {
+    'ENABLED': os.getenv('INSTRUMENTATION_ENABLED', 'False').lower() == 'true',
+    'SERVER_TIMING': os.getenv('INSTRUMENTATION_SERVER_TIMING', 'True').lower() == 'true',
+    'DUPLICATE_QUERY_THRESHOLD': int(os.getenv('INSTRUMENTATION_DUPLICATE_QUERY_THRESHOLD', '5')),
+}
+
+# counters and histograms served at /metrics, see api/metrics.py. Each
+# gunicorn worker flushes its values to METRICS_MULTIPROCESS_DIR (set by
+# config/gunicorn.conf.py) so every scrape sees all workers
+METRICS = {
+    'MULTIPROCESS_DIR': os.getenv('METRICS_MULTIPROCESS_DIR') or None,
+    'FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', '1')),
+    'TOKEN': os.getenv('METRICS_TOKEN') or None,
+}
+
+# pooled client for calls to Google, see api/http_client.py for per-endpoint
+# timeouts and retry budgets
+HTTP_CLIENT = {
+    'POOL_MAXSIZE': int(os.getenv('HTTP_POOL_MAXSIZE', '20')),
+    'ASYNC_MAX_CONNECTIONS': int(os.getenv('HTTP_ASYNC_MAX_CONNECTIONS', '200')),
+}
+
+# circuit breakers and concurrency caps for calls to Google and Africa's
+# Talking, see api/circuit_breaker.py. CIRCUIT_BREAKER_CACHE names the
+# CACHES alias the circuits are shared through
+CIRCUIT_BREAKERS = {
+    'ENABLED': os.getenv('CIRCUIT_BREAKERS_ENABLED', 'True').lower() == 'true',
+    'CACHE': os.getenv('CIRCUIT_BREAKER_CACHE') or ('shared' if REDIS_URL else None),
+    'BREAKERS': {
+        name: {
+            'FAILURE_THRESHOLD': int(os.getenv(f'{prefix}_FAILURE_THRESHOLD', '5')),
+            'RESET_TIMEOUT': int(os.getenv(f'{prefix}_RESET_TIMEOUT', '30')),
+            'MAX_CONCURRENCY': int(os.getenv(f'{prefix}_MAX_CONCURRENCY', default)),
+        }
+        for name, prefix, default in (
+            ('google', 'GOOGLE_BREAKER', '100'), ('sms', 'SMS_BREAKER', '8'))
+    },
+}
+# (connect, read) seconds before giving up on the SMS gateway
+SMS_TIMEOUT = (3.05, float(os.getenv('SMS_TIMEOUT', '10')))
+
+# default source of /api/orders/summary/: 'live' aggregates the orders
+# table, 'rollup' reads the incrementally maintained OrderDailyRollup rows
+ORDER_SUMMARY_SOURCE = os.getenv('ORDER_SUMMARY_SOURCE', 'live')
+
+# callable producing new order codes; 'api.order_codes.uuid_order_code'
+# restores the original 8-hex-character codes
+ORDER_CODE_GENERATOR = os.getenv(
+    'ORDER_CODE_GENERATOR', 'api.order_codes.time_ordered_order_code')
+# inserts retried with a fresh code when the generated one already exists
+ORDER_CODE_MAX_ATTEMPTS = int(os.getenv('ORDER_CODE_MAX_ATTEMPTS', 3))
+
+# largest array accepted by POST /api/orders/bulk/
+ORDER_BULK_MAX_SIZE = int(os.getenv('ORDER_BULK_MAX_SIZE', 1000))
+
+# monthly partitions of the orders table on PostgreSQL, see api/partitions.py.
+# Partitions are created this many months ahead; archived months are
+# written to ORDER_ARCHIVE_DIR as gzipped CSV
+ORDER_PARTITIONS = {
+    'MONTHS_AHEAD': int(os.getenv('ORDER_PARTITION_MONTHS_AHEAD', '3')),
+    'ARCHIVE_DIR': os.getenv('ORDER_ARCHIVE_DIR') or os.path.join(BASE_DIR, 'order_archive'),
+}
+
 
 SPECTACULAR_SETTINGS = {
     "TITLE": "Savannah Ecom API",
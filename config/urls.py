@@ -25,6 +25,7 @@ urlpatterns = [
          SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 
     path("profile/", views.ProfileView.as_view(), name="profile"),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
 
 
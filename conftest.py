@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 import django
 from django.conf import settings
 
@@ -12,6 +13,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 # Set a default SECRET_KEY for testing
 os.environ.setdefault("SECRET_KEY", "django-insecure-test-key-for-testing-only")
 
+# Throttle counters in a fresh file, so earlier runs can't throttle this one
+os.environ.setdefault(
+    "THROTTLE_SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "throttle.sqlite3"))
+
 # Initialize Django
 def pytest_configure():
     django.setup()
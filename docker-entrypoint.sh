@@ -10,5 +10,5 @@ done
 # Run migrations
 python manage.py migrate
 
-# Start the Django development server
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+# Start gunicorn; exec so it receives the container's signals
+exec gunicorn -c config/gunicorn.conf.py
\ No newline at end of file
@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 import os
 import sys
+import tempfile
 import django
 from django.conf import settings
 from django.test.utils import get_runner
 
 if __name__ == "__main__":
     os.environ['DJANGO_SETTINGS_MODULE'] = 'config.settings'
+    os.environ.setdefault(
+        'THROTTLE_SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'throttle.sqlite3'))
     django.setup()
     TestRunner = get_runner(settings)
     test_runner = TestRunner()